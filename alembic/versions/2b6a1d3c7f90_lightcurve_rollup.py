@@ -0,0 +1,61 @@
+"""add lightcurve_rollup table
+
+Revision ID: 2b6a1d3c7f90
+Revises: 5c4cbd1f4a3e
+Create Date: 2026-10-18 14:03:52.118734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b6a1d3c7f90'
+down_revision = '5c4cbd1f4a3e'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION as Double
+
+averages = ['avg_f_peak', 'avg_f_peak_sq', 'avg_f_peak_weight',
+            'avg_weighted_f_peak', 'avg_weighted_f_peak_sq',
+            'avg_f_int', 'avg_f_int_sq', 'avg_f_int_weight',
+            'avg_weighted_f_int', 'avg_weighted_f_int_sq', 'max_f_int']
+
+
+def upgrade():
+    columns = [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('runcat', sa.Integer(), nullable=False),
+        sa.Column('band', sa.Integer(), nullable=False),
+        sa.Column('stokes', sa.SmallInteger(), server_default=sa.text('1'),
+                  nullable=False),
+        sa.Column('resolution', sa.String(length=8), nullable=False),
+        sa.Column('bin_start', sa.DateTime(), nullable=False),
+        sa.Column('datapoints', sa.Integer(), nullable=False),
+        sa.Column('last_image', sa.Integer(), nullable=False),
+    ]
+    columns += [sa.Column(name, Double(), nullable=True) for name in averages]
+    op.create_table('lightcurve_rollup', *(columns + [
+        sa.ForeignKeyConstraint(['band'], ['frequencyband.id'], ),
+        sa.ForeignKeyConstraint(['runcat'], ['runningcatalog.id'], ),
+        sa.PrimaryKeyConstraint('id')]))
+    op.create_index(op.f('ix_lightcurve_rollup_band'), 'lightcurve_rollup',
+                    ['band'], unique=False)
+    op.create_index(op.f('ix_lightcurve_rollup_bin_start'),
+                    'lightcurve_rollup', ['bin_start'], unique=False)
+    op.create_index('lightcurve_rollup_runcat_band_stokes_resolution_bin_start_key',
+                    'lightcurve_rollup',
+                    ['runcat', 'band', 'stokes', 'resolution', 'bin_start'],
+                    unique=True)
+    op.execute("UPDATE version SET value = 42 WHERE name = 'revision'")
+
+
+def downgrade():
+    op.execute("UPDATE version SET value = 41 WHERE name = 'revision'")
+    op.drop_index('lightcurve_rollup_runcat_band_stokes_resolution_bin_start_key',
+                  table_name='lightcurve_rollup')
+    op.drop_index(op.f('ix_lightcurve_rollup_bin_start'),
+                  table_name='lightcurve_rollup')
+    op.drop_index(op.f('ix_lightcurve_rollup_band'),
+                  table_name='lightcurve_rollup')
+    op.drop_table('lightcurve_rollup')
@@ -0,0 +1,47 @@
+"""add sky pixel index
+
+Revision ID: 5c4cbd1f4a3e
+Revises: 8f0577e411f0
+Create Date: 2026-10-18 10:12:31.402318
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c4cbd1f4a3e'
+down_revision = '8f0577e411f0'
+branch_labels = None
+depends_on = None
+
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+from tkp.db.sql.populate import sql_repo
+from tkp.db.sql.preprocessor import dialectise
+
+# table, ra column, declination column
+positions = [('extractedsource', 'ra', 'decl'),
+             ('runningcatalog', 'wm_ra', 'wm_decl'),
+             ('skyregion', 'centre_ra', 'centre_decl')]
+
+
+def upgrade():
+    with open(os.path.join(sql_repo, 'functions', 'sky_pixel.sql')) as f:
+        op.execute(dialectise(f.read(), 'postgresql'))
+    for table, ra, decl in positions:
+        op.add_column(table, sa.Column('pixel', sa.Integer(), nullable=True))
+        op.execute("UPDATE %s SET pixel = sky_pixel(%s, %s)" %
+                   (table, ra, decl))
+        op.alter_column(table, 'pixel', nullable=False)
+        op.create_index(op.f('ix_%s_pixel' % table), table, ['pixel'],
+                        unique=False)
+    op.execute("UPDATE version SET value = 41 WHERE name = 'revision'")
+
+
+def downgrade():
+    op.execute("UPDATE version SET value = 40 WHERE name = 'revision'")
+    for table, ra, decl in reversed(positions):
+        op.drop_index(op.f('ix_%s_pixel' % table), table_name=table)
+        op.drop_column(table, 'pixel')
+    op.execute("DROP FUNCTION sky_pixel(DOUBLE PRECISION, DOUBLE PRECISION)")
@@ -17,6 +17,7 @@ install_requires = """
 
 extras_require = {
     'monetdb': ['sqlalchemy_monetdb>=0.9.1'],
+    'futures': ['futures'],
 }
 
 tkp_scripts = [
@@ -100,6 +100,16 @@ class TestFitsImage(unittest.TestCase):
 
 
 
+class SortMetadata(unittest.TestCase):
+    @requires_data(os.path.join(DATAPATH, 'sourcefinder/L15_12h_const/observed-all.fits'))
+    def testHeaderOnly(self):
+        # Reading only the header gives the same values as opening the image.
+        fits_file = os.path.join(DATAPATH, 'sourcefinder/L15_12h_const/observed-all.fits')
+        image = FitsImage(fits_file, beam=(54./3600, 54./3600, 0.))
+        self.assertEqual(accessors.sort_metadata(fits_file),
+                         (image.taustart_ts, image.freq_eff))
+
+
 class FrequencyInformation(unittest.TestCase):
     @requires_data(os.path.join(DATAPATH, 'accessors/missing_metadata.fits'))
     def testFreqinfo(self):
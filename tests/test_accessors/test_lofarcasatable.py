@@ -28,6 +28,10 @@ class TestLofarCasaImage(unittest.TestCase):
         self.assertAlmostEqual(known_bmin, bmin, 2)
         self.assertAlmostEqual(known_bpa, bpa, 2)
 
+    def test_sort_metadata(self):
+        self.assertEqual(accessors.sort_metadata(casatable),
+                         (self.accessor.taustart_ts, self.accessor.freq_eff))
+
     def test_phase_centre(self):
         known_ra, known_decl = 212.836, 52.203
         self.assertAlmostEqual(self.accessor.centre_ra, known_ra, 2)
@@ -11,6 +11,7 @@ from tkp.accessors.fitsimage import FitsImage
 from tkp.accessors.fitsimageblob import FitsImageBlob
 from tkp.accessors.aartfaaccasaimage import AartfaacCasaImage
 from tkp.accessors.lofarcasaimage import LofarCasaImage
+from tkp.utility.sharedmem import segment_directory, remove_directory
 
 AARTFAAC_FITS = path.join(DATAPATH, 'accessors/aartfaac.fits')
 CASA_TABLE = path.join(DATAPATH, 'casatable/L55596_000TO009_skymodellsc_wmax6000_noise_mult10_cell40_npix512_wplanes215.img.restored.corr')
@@ -42,3 +43,17 @@ class TestAccessorPickle(unittest.TestCase):
         pickled = cPickle.dumps(accessor)
         unpickled = cPickle.loads(pickled)
         self.assertEqual(type(unpickled), type(accessor))
+
+    def test_shared_data_pickle(self):
+        directory = segment_directory()
+        try:
+            accessor = FitsImage(AARTFAAC_FITS)
+            original = accessor.data.copy()
+            accessor.share_data(directory)
+            pickled = cPickle.dumps(accessor)
+            self.assertTrue(len(pickled) < original.nbytes)
+            unpickled = cPickle.loads(pickled)
+            self.assertTrue((unpickled.data == original).all())
+            accessor.release_data()
+        finally:
+            remove_directory(directory)
@@ -0,0 +1,91 @@
+import unittest
+
+import tkp.db
+import tkp.db.general as dbgen
+from tkp.db.orm import DataSet
+from tkp.db.associations import associate_extracted_sources
+from tkp.db.association_engine import AssociationEngine, _flag_many_to_many
+from tkp.testutil import db_subs
+from tkp.testutil.decorators import requires_database
+
+
+class TestFlagManyToMany(unittest.TestCase):
+    def test_one_to_many(self):
+        # one runcat, two extractions: nothing to flag
+        pairs = [(1, 10, 0.5), (1, 11, 1.0)]
+        self.assertEqual(_flag_many_to_many(pairs), set())
+
+    def test_many_to_many(self):
+        # two runcats both matching two extractions, every extraction keeps
+        # its closest runcat
+        pairs = [(1, 10, 0.5), (1, 11, 1.0), (2, 10, 2.0), (2, 11, 0.1)]
+        self.assertEqual(_flag_many_to_many(pairs), set([(2, 10), (1, 11)]))
+
+
+@requires_database()
+class TestAssociationEngine(unittest.TestCase):
+    """
+    The in memory engine should give the same running catalogue as the
+    default database association.
+    """
+    def tearDown(self):
+        tkp.db.rollback()
+
+    def associate(self, images_sources, use_engine, **image_kwargs):
+        dataset = DataSet(data={'description': 'association engine test'})
+        engine = AssociationEngine(dataset.id) if use_engine else None
+        im_params = db_subs.generate_timespaced_dbimages_data(
+            len(images_sources), **image_kwargs)
+        for im, sources in zip(im_params, images_sources):
+            image = tkp.db.Image(dataset=dataset, data=im)
+            dbgen.insert_extracted_sources(image.id, sources, 'blind')
+            associate_extracted_sources(image.id, deRuiter_r=3.717,
+                                        engine=engine)
+        return dataset.id
+
+    def runcat(self, dataset_id):
+        query = """\
+SELECT rc.datapoints
+      ,rc.wm_ra
+      ,rc.wm_decl
+      ,rc.wm_uncertainty_ew
+      ,rc.wm_uncertainty_ns
+      ,rf.f_datapoints
+      ,rf.avg_f_int
+      ,(SELECT COUNT(*) FROM assocxtrsource a WHERE a.runcat = rc.id)
+  FROM runningcatalog rc
+      ,runningcatalog_flux rf
+ WHERE rc.dataset = %(dataset)s
+   AND rf.runcat = rc.id
+ORDER BY rc.wm_ra, rc.wm_decl
+"""
+        cursor = tkp.db.execute(query, {'dataset': dataset_id})
+        return cursor.fetchall()
+
+    def compare(self, images_sources, **image_kwargs):
+        database = self.associate(images_sources, False, **image_kwargs)
+        memory = self.associate(images_sources, True, **image_kwargs)
+        expected = self.runcat(database)
+        result = self.runcat(memory)
+        self.assertNotEqual(len(expected), 0)
+        self.assertEqual(len(expected), len(result))
+        for row_expected, row_result in zip(expected, result):
+            for e, r in zip(row_expected, row_result):
+                self.assertAlmostEqual(e, r, places=8)
+
+    def test_one_to_one(self):
+        sources = [db_subs.example_extractedsource_tuple(ra=123.123 + 2 * i)
+                   for i in range(3)]
+        self.compare([sources] * 4)
+
+    def test_one_to_many(self):
+        src = db_subs.example_extractedsource_tuple()
+        split = [src._replace(ra=src.ra - 0.0005),
+                 src._replace(ra=src.ra + 0.0005)]
+        self.compare([[src], [src], split, split])
+
+    def test_cross_meridian(self):
+        src = db_subs.example_extractedsource_tuple(ra=359.9999, dec=0.5)
+        other_side = src._replace(ra=0.0001)
+        self.compare([[src], [other_side], [src], [other_side]],
+                     centre_ra=0, centre_decl=0, xtr_radius=10)
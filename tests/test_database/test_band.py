@@ -131,3 +131,80 @@ class TestBand(unittest.TestCase):
         data['freq_bw_max'] = 0.5e5  # limit bandwith to 0.5 MHz
         assocated_image = Image(dataset=dataset, data=data)
         self.assertNotEqual(get_band_for_image(first_image), get_band_for_image(assocated_image))
+
+
+class TestBulkRegistration(unittest.TestCase):
+    """
+    insert_images() should give the same bands and skyregions as inserting
+    the images one by one.
+    """
+    def tearDown(self):
+        tkp.db.rollback()
+
+    def register(self, images, bulk):
+        from tkp.db.alchemy.image import insert_images
+        database = tkp.db.database.Database()
+        dataset = DataSet(data={'description': self._testMethodName},
+                          database=database)
+        if bulk:
+            rows = insert_images(database.session, dataset.id,
+                                 [copy(i) for i in images])
+            database.session.commit()
+            ids = [row['id'] for row in rows]
+        else:
+            ids = [Image(data=copy(i), dataset=dataset).id for i in images]
+        query = """\
+SELECT f.freq_low, f.freq_high, s.centre_ra, s.centre_decl, i.url
+  FROM image i, frequencyband f, skyregion s
+ WHERE i.id = %(id)s AND f.id = i.band AND s.id = i.skyrgn
+"""
+        return ids, [tuple(tkp.db.execute(query, {'id': id}).fetchone())
+                     for id in ids]
+
+    @requires_database()
+    def test_same_as_single(self):
+        images = db_subs.generate_timespaced_dbimages_data(4)
+        images[1]['freq_eff'] = 150e6
+        images[2]['centre_ra'] = 124.
+        images[3]['freq_eff'] = 140.5e6  # overlaps with the first band
+        for n, image in enumerate(images):
+            image['url'] = 'image%d' % n
+        single_ids, single = self.register(images, bulk=False)
+        bulk_ids, bulk = self.register(images, bulk=True)
+        self.assertEqual(single, bulk)
+        # ids are returned in input order
+        self.assertEqual(bulk_ids, sorted(bulk_ids))
+        self.assertEqual([row[-1] for row in bulk],
+                         ['image%d' % n for n in range(4)])
+
+    @requires_database()
+    def test_empty(self):
+        self.assertEqual(self.register([], bulk=True), ([], []))
+
+
+class TestBandCache(unittest.TestCase):
+    """
+    The bands and skyregions of a dataset are selected once.
+    """
+    def tearDown(self):
+        tkp.db.rollback()
+
+    @requires_database()
+    def test_cached(self):
+        from tkp.db.alchemy.image import band_cache, skyregion_cache
+        dataset = DataSet(data={'description': self._testMethodName})
+        images = db_subs.generate_timespaced_dbimages_data(3)
+        images[2]['freq_eff'] = 150e6
+        misses = band_cache.misses, skyregion_cache.misses
+        hits = band_cache.hits
+        for image in images:
+            Image(data=copy(image), dataset=dataset).id
+        self.assertEqual((band_cache.misses, skyregion_cache.misses),
+                         (misses[0] + 1, misses[1] + 1))
+        self.assertEqual(band_cache.hits, hits + 2)
+        # the band inserted for the last image is cached as well
+        bands = [b.id for b in band_cache.values[dataset.id]]
+        self.assertEqual(len(bands), 2)
+        self.assertEqual(get_band_for_image(Image(data=copy(images[2]),
+                                                  dataset=dataset)),
+                         bands[1])
@@ -0,0 +1,35 @@
+import unittest
+
+from tkp.db.cache import DatasetCache, caches, invalidate, stats
+
+
+class TestDatasetCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = DatasetCache('test')
+        self.loads = []
+
+    def tearDown(self):
+        del caches['test']
+
+    def load(self, value):
+        def load():
+            self.loads.append(value)
+            return value
+        return load
+
+    def test_get(self):
+        self.assertEqual(self.cache.get(1, self.load('a')), 'a')
+        self.assertEqual(self.cache.get(1, self.load('b')), 'a')
+        self.assertEqual(self.cache.get(2, self.load('c')), 'c')
+        self.assertEqual(self.loads, ['a', 'c'])
+        self.assertEqual(stats()['test'],
+                         {'hits': 1, 'misses': 2, 'datasets': 2})
+
+    def test_invalidate(self):
+        self.cache.get(1, self.load('a'))
+        self.cache.get(2, self.load('b'))
+        invalidate(1)
+        self.assertEqual(self.cache.get(1, self.load('c')), 'c')
+        self.assertEqual(self.cache.get(2, self.load('d')), 'b')
+        self.cache.invalidate()
+        self.assertEqual(self.cache.stats()['datasets'], 0)
@@ -2,6 +2,27 @@ import unittest
 from exceptions import StandardError
 from tkp.testutil.decorators import requires_database
 import tkp.db
+from tkp.db.database import prepare_query
+
+
+class TestPrepareQuery(unittest.TestCase):
+    def test_named(self):
+        query = "SELECT a FROM t WHERE b = %(b)s AND c > %(c)s AND d = %(b)s"
+        self.assertEqual(prepare_query(query),
+                         ("SELECT a FROM t WHERE b = $1 AND c > $2 AND d = $1",
+                          ['b', 'c']))
+
+    def test_positional(self):
+        self.assertEqual(prepare_query("SELECT %s, %s"),
+                         ("SELECT $1, $2", 2))
+
+    def test_escaped(self):
+        self.assertEqual(prepare_query("SELECT 'a%%' WHERE x = %(x)s"),
+                         ("SELECT 'a%' WHERE x = $1", ['x']))
+
+    def test_mixed(self):
+        self.assertRaises(ValueError, prepare_query, "SELECT %(a)s, %s")
+
 
 class TestDatabaseConnection(unittest.TestCase):
 
@@ -52,3 +73,87 @@ class TestDatabaseConnection(unittest.TestCase):
         for exception in bad_exceptions:
             with self.assertRaises(AttributeError):
                 getattr(self.database.exceptions, exception)
+
+    @requires_database()
+    def test_temporary_table(self):
+        if self.database.engine != 'postgresql':
+            self.skipTest("temporary tables are only used on postgresql")
+        self.assertTrue(self.database.temporary_table('temprunningcatalog'))
+        # calling it again is a no-op
+        self.assertTrue(self.database.temporary_table('temprunningcatalog'))
+        query = """\
+SELECT n.nspname
+  FROM pg_class c
+      ,pg_namespace n
+ WHERE c.oid = 'temprunningcatalog'::regclass
+   AND n.oid = c.relnamespace
+"""
+        schema = tkp.db.execute(query).fetchone()[0]
+        self.assertTrue(schema.startswith('pg_temp'))
+
+    @requires_database()
+    def test_script(self):
+        if self.database.engine != 'postgresql':
+            self.skipTest("temporary tables are only used on postgresql")
+        self.database.execute("CREATE TEMPORARY TABLE test_script (x integer)",
+                              commit=True)
+        with self.database.script() as script:
+            cursor = self.database.execute(
+                "INSERT INTO test_script VALUES (%(x)s), (%(x)s)", {'x': 1})
+            self.assertEqual(cursor.rowcount, None)
+            self.assertRaises(RuntimeError, cursor.fetchall)
+            # nested blocks join the outer script
+            with self.database.script() as inner:
+                self.database.execute(
+                    "DELETE FROM test_script WHERE x = %(x)s", {'x': 2})
+            self.assertIs(inner, script)
+            self.assertEqual(script.counts, None)
+        self.assertEqual(script.counts, [2, 0])
+        self.assertEqual(script.labels(), ['INSERT INTO test_script',
+                                           'DELETE FROM test_script'])
+        # queries run directly again after the block
+        query = "SELECT COUNT(*) FROM test_script"
+        self.assertEqual(self.database.execute(query).fetchone()[0], 2)
+        self.database.execute("DROP TABLE test_script", commit=True)
+
+    @requires_database()
+    def test_prepared_statement(self):
+        if self.database.engine != 'postgresql':
+            self.skipTest("prepared statements are only used on postgresql")
+        enabled = self.database.prepared_statements
+        self.database.prepared_statements = True
+        try:
+            query = "SELECT %(x)s + 1, CAST(%(y)s AS TEXT)"
+            for x in range(2):
+                cursor = self.database.execute(query, {'x': x, 'y': 'b'},
+                                               name='test_prepared')
+                self.assertEqual(cursor.fetchone(), (x + 1, 'b'))
+            query = "SELECT COUNT(*) FROM pg_prepared_statements " \
+                    "WHERE name = 'test_prepared'"
+            self.assertEqual(self.database.execute(query).fetchone()[0], 1)
+            # a name belongs to one query
+            self.assertRaises(ValueError, self.database.execute, "SELECT 1",
+                              name='test_prepared')
+        finally:
+            self.database.prepared_statements = enabled
+
+    @requires_database()
+    def test_prepared_write_autocommits(self):
+        if self.database.engine != 'postgresql':
+            self.skipTest("prepared statements are only used on postgresql")
+        enabled = self.database.prepared_statements
+        self.database.prepared_statements = True
+        self.database.execute("CREATE TABLE test_prepared_write (x INTEGER)",
+                              commit=True)
+        try:
+            self.database.execute(
+                "INSERT INTO test_prepared_write VALUES (%(x)s)", {'x': 1},
+                name='test_prepared_write')
+            # an uncommitted insert would be undone by the rollback
+            self.database.connection.connection.rollback()
+            query = "SELECT COUNT(*) FROM test_prepared_write"
+            self.assertEqual(self.database.execute(query).fetchone()[0], 1)
+        finally:
+            self.database.execute("DROP TABLE test_prepared_write",
+                                  commit=True)
+            self.database.prepared_statements = enabled
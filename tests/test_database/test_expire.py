@@ -108,7 +108,7 @@ class TestExpire(unittest.TestCase):
         """
         Check if associate_nd increments the forcedfits_count column
         """
-        e = Extractedsource(zone=1, ra=1, decl=1, uncertainty_ew=1, x=1, y=1,
+        e = Extractedsource(zone=1, pixel=1, ra=1, decl=1, uncertainty_ew=1, x=1, y=1,
                             z=1, uncertainty_ns=1, ra_err=1, decl_err=1,
                             ra_fit_err=1, decl_fit_err=1, ew_sys_err=1,
                             ns_sys_err=1, error_radius=1, racosdecl=1,
@@ -129,7 +129,7 @@ class TestExpire(unittest.TestCase):
         """
         Check if 1-to-1 association resets expiration counter to 0
         """
-        e = Extractedsource(zone=1, ra=1, decl=1, uncertainty_ew=1, x=1, y=1,
+        e = Extractedsource(zone=1, pixel=1, ra=1, decl=1, uncertainty_ew=1, x=1, y=1,
                             z=1, uncertainty_ns=1, ra_err=1, decl_err=1,
                             ra_fit_err=1, decl_fit_err=1, ew_sys_err=1,
                             ns_sys_err=1, error_radius=1, racosdecl=1,
@@ -1,10 +1,16 @@
+import logging
 import unittest
 
 import time
+import tkp.db
 from tkp.db.orm import DataSet
-from tkp.db.general import update_dataset_process_end_ts
+from tkp.db.general import (update_dataset_process_end_ts,
+                            insert_extracted_sources, extractedsource_columns)
 from tkp.db import execute as db_query
-from tkp.testutil.decorators import requires_database
+from tkp.testutil import db_subs
+from tkp.testutil.decorators import requires_database, duration
+
+logger = logging.getLogger(__name__)
 
 @requires_database()
 class TestProcessTime(unittest.TestCase):
@@ -18,3 +24,58 @@ class TestProcessTime(unittest.TestCase):
             WHERE id = %(id)s
         """, {"id": dataset.id}).fetchone()
         self.assertLess(start_time, end_time)
+
+
+@requires_database()
+class TestInsertExtractedSources(unittest.TestCase):
+    """
+    The COPY and the INSERT path should store identical rows.
+    """
+    def setUp(self):
+        self.database = tkp.db.Database()
+        if self.database.engine != 'postgresql':
+            self.skipTest("COPY is only supported on postgresql")
+        self.dataset = DataSet(data={'description': 'extractedsource insert'})
+        im_params = db_subs.generate_timespaced_dbimages_data(2)
+        self.images = [tkp.db.Image(dataset=self.dataset, data=im)
+                       for im in im_params]
+
+    def tearDown(self):
+        tkp.db.rollback()
+
+    def sources(self, n):
+        src = db_subs.example_extractedsource_tuple()
+        sources = [src._replace(ra=src.ra + 0.001 * i, dec=src.dec + 0.0005 * i)
+                   for i in range(n)]
+        sources[1] = sources[1]._replace(error_radius=float('inf'))
+        sources[2] = sources[2]._replace(flux_err=float('inf'))
+        return sources
+
+    def rows(self, image):
+        columns = [c for c in extractedsource_columns if c != 'image']
+        query = "SELECT %s FROM extractedsource WHERE image = %%(image)s " \
+                "ORDER BY ra" % ', '.join(columns)
+        return db_query(query, {'image': image.id}).fetchall()
+
+    def test_copy_matches_insert(self):
+        sources = self.sources(10)
+        insert_extracted_sources(self.images[0].id, sources, 'ff_nd',
+                                 ff_runcat_ids=[None] * 10, use_copy=False)
+        insert_extracted_sources(self.images[1].id, sources, 'ff_nd',
+                                 ff_runcat_ids=[None] * 10, use_copy=True)
+        inserted = self.rows(self.images[0])
+        copied = self.rows(self.images[1])
+        self.assertEqual(len(inserted), 9)
+        self.assertEqual(inserted, copied)
+
+    @duration(60)
+    def test_benchmark(self):
+        sources = self.sources(10000)
+        for image, use_copy in zip(self.images, (False, True)):
+            start = time.time()
+            insert_extracted_sources(image.id, sources, use_copy=use_copy)
+            rate = len(sources) / (time.time() - start)
+            logger.info("%s: %.0f extractedsource rows per second" %
+                        ('COPY' if use_copy else 'INSERT', rate))
+        self.assertEqual(len(self.rows(self.images[0])),
+                         len(self.rows(self.images[1])))
@@ -36,6 +36,17 @@ class TestInsert(unittest.TestCase):
         monitor_positions = [ (5., 5), (123,85.)]
         dbgen.insert_monitor_positions(dataset1.id, monitor_positions)
 
+    def test_entries_cached(self):
+        dataset = DataSet(data=self.description)
+        dbgen.insert_monitor_positions(dataset.id, [(5., 5)])
+        self.assertEqual(len(dbmon.get_monitor_entries(dataset.id)), 1)
+        hits = dbmon.monitor_cache.hits
+        self.assertEqual(len(dbmon.get_monitor_entries(dataset.id)), 1)
+        self.assertEqual(dbmon.monitor_cache.hits, hits + 1)
+        # inserting invalidates the cached entries
+        dbgen.insert_monitor_positions(dataset.id, [(123, 85.)])
+        self.assertEqual(len(dbmon.get_monitor_entries(dataset.id)), 2)
+
 
 @requires_database()
 class TestMonitor(unittest.TestCase):
@@ -235,7 +235,7 @@ class TestExtractedSource(unittest.TestCase):
         image = Image(
                 dataset=dataset,
                 data=db_subs.example_dbimage_data_dict())
-        extracted_source_data = dict(zone=13,
+        extracted_source_data = dict(zone=13, pixel=1,
                     ra=12.12, decl=13.13, ra_err=21.1, decl_err=21.09,
                     ra_fit_err=1.12, decl_fit_err=1.23,
                     uncertainty_ew=0.1,uncertainty_ns=0.1,
@@ -272,7 +272,7 @@ class TestExtractedSource(unittest.TestCase):
                 'ra_err': 21.1, 'decl_err': 21.09,
                 'ra_fit_err': 0.1, 'decl_fit_err': 0.1,
                 'uncertainty_ew': 0.1, 'uncertainty_ns': 0.1,
-                'zone': 1, 'x': 0.11, 'y': 0.22, 'z': 0.33,
+                'zone': 1, 'pixel': 1, 'x': 0.11, 'y': 0.22, 'z': 0.33,
                 'racosdecl': 0.44,
                 'det_sigma': 10.0,
                 'ew_sys_err': 20, 'ns_sys_err': 20,
@@ -318,7 +318,7 @@ class TestExtractedSource(unittest.TestCase):
                 'ra_err': 21.1, 'decl_err': 21.09,
                 'ra_fit_err': 0.1, 'decl_fit_err': 0.1,
                 'uncertainty_ew': 0.1, 'uncertainty_ns': 0.1,
-                'zone': 1, 'x': 0.11, 'y': 0.22, 'z': 0.33,
+                'zone': 1, 'pixel': 1, 'x': 0.11, 'y': 0.22, 'z': 0.33,
                 'racosdecl': 0.44,
                 'det_sigma': 11.1,
                 'ew_sys_err': 20, 'ns_sys_err': 20,
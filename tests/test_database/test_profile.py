@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import tkp.db
+from tkp.db.profile import QueryProfile, caller_name
+from tkp.testutil.decorators import requires_database
+
+
+def _query_from_here():
+    return caller_name()
+
+
+class TestQueryProfile(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_caller_name(self):
+        self.assertEqual(_query_from_here(), '_query_from_here')
+
+    def test_summary(self):
+        profile = QueryProfile()
+        profile.record('fast', 0.1, 2)
+        profile.record('slow', 1.0, 5)
+        profile.record('slow', 3.0, -1)
+        summary = profile.summary()
+        self.assertEqual([p['phase'] for p in summary], ['slow', 'fast'])
+        self.assertEqual(summary[0]['count'], 2)
+        self.assertEqual(summary[0]['rows'], 5)
+        self.assertAlmostEqual(summary[0]['total'], 4.0)
+        self.assertAlmostEqual(summary[0]['mean'], 2.0)
+        self.assertAlmostEqual(summary[0]['max'], 3.0)
+
+    def test_report(self):
+        path = os.path.join(self.temp_dir, 'query_profile.json')
+        profile = QueryProfile(path=path)
+        profile.record('phase', 0.5)
+        profile.report(images=[1, 2])
+        profile.record('phase', 0.5)
+        profile.report(images=[3])
+        with open(path) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([e['images'] for e in entries], [[1, 2], [3]])
+        self.assertEqual(entries[1]['phases'][0]['count'], 1)
+        self.assertEqual(profile.summary(), [])
+
+    def test_phase(self):
+        profile = QueryProfile()
+        profile.phase = 'fixed'
+        with profile.measure(rows=3):
+            pass
+        self.assertEqual(profile.summary()[0]['phase'], 'fixed')
+
+
+@requires_database()
+class TestDatabaseProfile(unittest.TestCase):
+    def test_execute(self):
+        database = tkp.db.Database()
+        profile = QueryProfile()
+        profile.attach(database.alchemy_engine)
+        try:
+            tkp.db.execute("SELECT 1")
+        finally:
+            profile.detach()
+        phases = [p['phase'] for p in profile.summary()]
+        self.assertIn('test_execute', phases)
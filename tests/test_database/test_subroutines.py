@@ -6,6 +6,7 @@ import tkp.db
 from tkp.testutil.decorators import requires_database
 from tkp.testutil.db_queries import convert_to_cartesian as db_cartesian
 from tkp.utility.coordinates import eq_to_cart as py_cartesian
+from tkp.utility.coordinates import sky_pixel as py_sky_pixel
 
 """Test miscellaneous minor database functions"""
 
@@ -57,3 +58,19 @@ class TestCartesianConversions(unittest.TestCase):
             check_known_result(kr)
 
 
+
+@requires_database()
+class TestSkyPixel(unittest.TestCase):
+    """
+    The sky_pixel() database function should give the same pixels as
+    tkp.utility.coordinates.sky_pixel().
+    """
+    def test_python_consistency(self):
+        positions = [(0.0, -90.0), (0.0, 90.0), (359.99999, 0.0),
+                     (0.0, 0.0), (180.0, -0.05), (123.123, 45.45),
+                     (42.0, -89.95), (270.5, 60.0), (0.001, -33.3)]
+        query = "SELECT sky_pixel(%(ra)s, %(decl)s)"
+        for ra, decl in positions:
+            db_pixel = tkp.db.execute(query, {'ra': ra, 'decl': decl}
+                                      ).fetchone()[0]
+            self.assertEqual(db_pixel, py_sky_pixel(ra, decl))
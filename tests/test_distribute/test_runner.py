@@ -1,5 +1,17 @@
+import time
 import unittest
 import tkp.distribute
+from tkp.testutil.decorators import requires_module
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def sleep_packed(packed):
+    seconds, _ = packed
+    return sleep(seconds)
 
 
 class TestRunner(unittest.TestCase):
@@ -11,6 +23,36 @@ class TestRunner(unittest.TestCase):
             runner = tkp.distribute.Runner(method)
             runner.map("get_accessors", [])
 
+    def test_imap_unordered(self):
+        for method in 'serial', 'multiproc':
+            runner = tkp.distribute.Runner(method)
+            results = runner.imap_unordered("get_accessors", [[], [], []])
+            self.assertEqual(sorted(results), [(0, []), (1, []), (2, [])])
+
+    @requires_module('concurrent.futures')
+    def test_futures(self):
+        runner = tkp.distribute.Runner('futures', cores=2)
+        self.assertEqual(runner.map("get_accessors", [[], []]), [[], []])
+        results = runner.imap_unordered("get_accessors", [[], []], timeout=60)
+        self.assertEqual(sorted(results), [(0, []), (1, [])])
+
+    def test_task_timeout(self):
+        from multiprocessing import TimeoutError
+        tkp.distribute.Runner('multiproc', cores=2)
+        results = tkp.distribute.multiproc.imap_unordered(
+            sleep_packed, [0, 3], [], timeout=0.5)
+        self.assertEqual(next(results), (0, 0))
+        self.assertRaises(TimeoutError, next, results)
+
+    @requires_module('concurrent.futures')
+    def test_futures_task_timeout(self):
+        from concurrent.futures import TimeoutError
+        tkp.distribute.Runner('futures', cores=2)
+        results = tkp.distribute.futures.imap_unordered(
+            sleep, [0, 3], [], timeout=0.5)
+        self.assertEqual(next(results), (0, 0))
+        self.assertRaises(TimeoutError, next, results)
+
     def test_set_cores(self):
         cores = 10
         tkp.distribute.Runner('serial', cores=cores)
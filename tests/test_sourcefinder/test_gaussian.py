@@ -5,7 +5,7 @@ import numpy
 
 import unittest
 
-from tkp.sourcefinder.gaussian import gaussian
+from tkp.sourcefinder.gaussian import gaussian, jacobian
 from tkp.sourcefinder.fitting import moments, fitgaussian, FIT_PARAMS
 from tkp.sourcefinder.extract import source_profile_and_errors
 
@@ -282,3 +282,40 @@ class NoisyGaussTest(unittest.TestCase):
         self.assertTrue( 0.9 < self.fit_w_errs.chisq / npix < 1.1)
 
 
+class JacobianTest(unittest.TestCase):
+    """The analytic derivatives should match finite differences"""
+    def testDerivatives(self):
+        params = [2.0, 10.3, 12.1, 4.0, 2.5, 0.7]
+        Xin, Yin = numpy.indices((25, 25), dtype=float)
+        derivatives = jacobian(*params)(Xin, Yin)
+        self.assertEqual(len(derivatives), len(FIT_PARAMS))
+        step = 1e-6
+        for i in range(len(params)):
+            shifted = list(params)
+            shifted[i] += step
+            numeric = (gaussian(*shifted)(Xin, Yin) -
+                       gaussian(*params)(Xin, Yin)) / step
+            self.assertTrue(numpy.allclose(numeric, derivatives[i], atol=1e-4))
+
+
+class FixedParamsFitTest(unittest.TestCase):
+    """Fit a masked Gaussian with some parameters held fixed"""
+    def setUp(self):
+        Xin, Yin = numpy.indices((40, 40))
+        self.params = dict(peak=5., xbar=20.3, ybar=18.7, semimajor=4.,
+                           semiminor=2., theta=0.4)
+        data = gaussian(*[self.params[p] for p in FIT_PARAMS])(Xin, Yin)
+        self.mygauss = numpy.ma.array(data, mask=(data < 0.5))
+        self.initial = dict(peak=6., xbar=20., ybar=19., semimajor=5.,
+                            semiminor=2.5, theta=0.5)
+
+    def testPosition(self):
+        fixed = {'xbar': self.params['xbar'], 'ybar': self.params['ybar']}
+        fit = fitgaussian(self.mygauss, self.initial, fixed=fixed)
+        for param in FIT_PARAMS:
+            self.assertAlmostEqual(fit[param], self.params[param], places=4)
+
+    def testPositionAndShape(self):
+        fixed = dict((p, self.params[p]) for p in FIT_PARAMS if p != 'peak')
+        fit = fitgaussian(self.mygauss, self.initial, fixed=fixed)
+        self.assertAlmostEqual(fit['peak'], self.params['peak'], places=4)
@@ -404,6 +404,29 @@ class TestMaskedBackground(unittest.TestCase):
         result = self.image.extract(det=10.0, anl=3.0)
         self.assertFalse(result)
 
+class TestFitProcesses(unittest.TestCase):
+    """Fitting islands in parallel should not change the results"""
+    @requires_data(os.path.join(DATAPATH, 'sourcefinder/NCP_sample_image_1.fits'))
+    def testSameResults(self):
+        path = os.path.join(DATAPATH, 'sourcefinder/NCP_sample_image_1.fits')
+        extractions = []
+        for fit_processes in (1, 4):
+            image = accessors.sourcefinder_image_from_accessor(
+                accessors.open(path))
+            results = image.extract(det=5, anl=3, deblend_nthresh=5,
+                                    fit_processes=fit_processes)
+            extractions.append((results, image))
+
+        (serial, serial_image), (parallel, parallel_image) = extractions
+        self.assertTrue(len(serial) > 1)
+        self.assertEqual([r.serialize(0, 0) for r in serial],
+                         [r.serialize(0, 0) for r in parallel])
+        self.assertTrue((serial_image.residuals_from_gauss_fitting ==
+                         parallel_image.residuals_from_gauss_fitting).all())
+        self.assertTrue((serial_image.residuals_from_deblending ==
+                         parallel_image.residuals_from_deblending).all())
+
+
 class TestFailureModes(unittest.TestCase):
     """
     If we get pathological data we should probably throw an exception
@@ -66,6 +66,15 @@ class UtilsTest(unittest.TestCase):
         for (semimajor, semiminor, theta, correction, variance) in self.correct_data:
             self.assertAlmostEqual(fudge_max_pix(semimajor, semiminor, theta), correction)
 
+    def testBeamCache(self):
+        # Repeated calls for the same beam are served from the cache.
+        semimajor, semiminor, theta = self.correct_data[0][:3]
+        fudge_max_pix.memo.clear()
+        first = fudge_max_pix(semimajor, semiminor, theta)
+        self.assertIn((semimajor, semiminor, theta), fudge_max_pix.memo)
+        self.assertEqual(fudge_max_pix(semimajor, semiminor, theta), first)
+        self.assertEqual(len(fudge_max_pix.memo), 1)
+
 
 class SubthresholdingTest(unittest.TestCase):
     def test_ranges(self):
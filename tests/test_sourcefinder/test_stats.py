@@ -0,0 +1,60 @@
+import numpy
+
+import unittest
+
+from tkp.sourcefinder.stats import sigma_clip, sigma_clip_stack
+
+
+BEAM = (2.7, 2.3, 1.7)
+
+
+class TestSigmaClip(unittest.TestCase):
+    def test_outlier_clipped(self):
+        numpy.random.seed(1)
+        data = numpy.random.normal(0, 1, 1000)
+        data[0] = 100
+        clipped, sigma, centre, iterations = sigma_clip(data, BEAM)
+        self.assertNotIn(100, clipped)
+        self.assertTrue(iterations >= 1)
+        self.assertAlmostEqual(sigma, 1, delta=0.2)
+
+    def test_too_small(self):
+        clipped, sigma, centre, iterations = sigma_clip(numpy.ones(2), BEAM)
+        self.assertEqual(len(clipped), 0)
+
+    def test_max_iter(self):
+        numpy.random.seed(1)
+        data = numpy.random.normal(0, 1, 1000)
+        data[:10] = 100
+        result = sigma_clip(data, BEAM, max_iter=0)
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[3], 0)
+
+
+class TestSigmaClipStack(unittest.TestCase):
+    def test_matches_sigma_clip(self):
+        numpy.random.seed(2)
+        stack = numpy.empty((20, 500))
+        stack.fill(numpy.nan)
+        for row in stack:
+            n = numpy.random.randint(10, 500)
+            row[:n] = numpy.random.normal(0, 1, n)
+            row[:n][numpy.random.rand(n) < 0.05] += 20
+        usable, sigma, centre, mean, iterations = sigma_clip_stack(stack, BEAM)
+
+        for i, row in enumerate(stack):
+            clipped, s, c, it = sigma_clip(row[~numpy.isnan(row)], BEAM)
+            self.assertEqual(usable[i], len(clipped) > 0)
+            if usable[i]:
+                self.assertAlmostEqual(sigma[i], s)
+                self.assertAlmostEqual(centre[i], c)
+                self.assertAlmostEqual(mean[i], numpy.mean(clipped))
+                self.assertEqual(iterations[i], it)
+
+    def test_unusable(self):
+        stack = numpy.zeros((3, 100))
+        stack[1] = numpy.nan
+        stack[2, :2] = 1, 2
+        stack[2, 2:] = numpy.nan
+        usable = sigma_clip_stack(stack, BEAM)[0]
+        self.assertFalse(usable.any())
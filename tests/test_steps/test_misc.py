@@ -0,0 +1,75 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from tkp.steps.misc import (prefetch, ImageMetadataForSort, image_signature,
+                            load_metadata_index, store_metadata_index)
+
+
+def square(x):
+    return x * x
+
+
+def fail_on_two(x):
+    if x == 2:
+        raise ValueError("two")
+    return x
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_order(self):
+        for depth in 0, 1, 3:
+            results = [r for _, r, _ in prefetch(square, range(10), depth)]
+            self.assertEqual(results, [x * x for x in range(10)])
+
+    def test_exception(self):
+        for depth in 0, 2:
+            entries = list(prefetch(fail_on_two, range(4), depth))
+            self.assertEqual([item for item, _, _ in entries], range(4))
+            item, result, error = entries[2]
+            self.assertEqual(result, None)
+            self.assertTrue(isinstance(error, ValueError))
+            self.assertEqual(entries[3][1], 3)
+
+    def test_empty(self):
+        self.assertEqual(list(prefetch(square, [], 1)), [])
+
+    def test_failing_iterable(self):
+        def items():
+            yield 1
+            yield 2
+            raise IOError("source failed")
+
+        for depth in 0, 1, 3:
+            results = []
+            with self.assertRaises(IOError):
+                for _, result, _ in prefetch(square, items(), depth):
+                    results.append(result)
+            self.assertEqual(results, [1, 4])
+
+
+class TestMetadataIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'image_metadata.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_roundtrip(self):
+        image = os.path.join(self.dir, 'image.fits')
+        open(image, 'w').write('not really an image')
+        metadata = ImageMetadataForSort(image,
+                                        datetime.datetime(2015, 1, 1, 12),
+                                        150e6)
+        index = {image: (image_signature(image), metadata)}
+        store_metadata_index(self.path, index)
+        self.assertEqual(load_metadata_index(self.path), index)
+
+    def test_missing(self):
+        self.assertEqual(load_metadata_index(self.path), {})
+
+    def test_unreadable(self):
+        open(self.path, 'w').write('{broken')
+        self.assertEqual(load_metadata_index(self.path), {})
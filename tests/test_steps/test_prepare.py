@@ -0,0 +1,23 @@
+import unittest
+from ConfigParser import SafeConfigParser
+from tkp.config import parse_to_dict
+from tkp.testutil.data import default_job_config, fits_file
+from tkp.testutil.decorators import requires_data
+import tkp.steps.prepare
+
+
+class TestPrepareImage(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        config = SafeConfigParser()
+        config.read(default_job_config)
+        cls.job_config = parse_to_dict(config)
+
+    @requires_data(fits_file)
+    def test_prepare_image(self):
+        prepared = tkp.steps.prepare.prepare_image(fits_file, self.job_config)
+        self.assertEqual(prepared.accessor.url, fits_file)
+        self.assertEqual(prepared.metadata['url'], fits_file)
+        self.assertIn('rms_qc', prepared.metadata)
+        self.assertFalse(prepared.rejected)
+        self.assertTrue(len(prepared.extraction.sources) > 0)
@@ -0,0 +1,123 @@
+import unittest
+import logging
+from collections import Counter
+from datetime import timedelta
+
+import tkp.db.model
+
+from tkp.testutil.alchemy import gen_band, gen_dataset, gen_skyregion,\
+    gen_lightcurve, gen_image, gen_extractedsource, gen_assocxtrsource
+
+import tkp.db
+
+from tkp.db.alchemy.rollup import truncate
+from tkp.db.model import LightcurveRollup, Assocxtrsource, Extractedsource
+from tkp.steps.rollup import execute_rollup
+
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+
+
+class TestRollup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = tkp.db.Database()
+        cls.db.connect()
+
+    def setUp(self):
+        self.session = self.db.Session()
+
+        self.dataset = gen_dataset('test rollup step')
+        self.band = gen_band(dataset=self.dataset, central=150**6)
+        self.skyregion = gen_skyregion(self.dataset)
+        lightcurve = gen_lightcurve(self.band, self.dataset, self.skyregion)
+        self.images = [o for o in lightcurve
+                       if isinstance(o, tkp.db.model.Image)]
+        self.runcat = [o for o in lightcurve
+                       if isinstance(o, tkp.db.model.Runningcatalog)][0]
+        self.session.add_all(lightcurve)
+        self.session.flush()
+        self.session.commit()
+        # two days after the lightcurve, so all bins are complete
+        self.later = self.images[-1].taustart_ts + timedelta(days=2)
+
+    def bins(self, resolution):
+        query = self.session.query(LightcurveRollup). \
+            filter(LightcurveRollup.runcat_id == self.runcat.id,
+                   LightcurveRollup.resolution == resolution)
+        return dict((b.bin_start, b) for b in query)
+
+    def expected(self, resolution, before):
+        return Counter(truncate(i.taustart_ts, resolution)
+                       for i in self.images
+                       if i.taustart_ts < truncate(before, resolution))
+
+    def test_rollup(self):
+        execute_rollup(self.dataset.id, self.later, session=self.session)
+        for resolution in ('minute', 'hour', 'day'):
+            bins = self.bins(resolution)
+            expected = self.expected(resolution, self.later)
+            self.assertEqual(sorted(bins.keys()), sorted(expected.keys()))
+            for bin_start, rollup in bins.items():
+                self.assertEqual(rollup.datapoints, expected[bin_start])
+                self.assertAlmostEqual(rollup.avg_f_int, 0.01)
+                self.assertAlmostEqual(rollup.max_f_int, 0.01)
+
+    def test_rollup_twice(self):
+        execute_rollup(self.dataset.id, self.later, session=self.session)
+        counts = execute_rollup(self.dataset.id, self.later,
+                                session=self.session)
+        self.assertEqual(counts, {'minute': 0, 'hour': 0, 'day': 0})
+        self.assertEqual(sum(b.datapoints for b in self.bins('day').values()),
+                         len(self.images))
+
+    def test_incomplete_bins(self):
+        # the bins containing the last image are not complete yet
+        before = self.images[-1].taustart_ts
+        execute_rollup(self.dataset.id, before, session=self.session)
+        for resolution in ('minute', 'hour', 'day'):
+            self.assertEqual(sorted(self.bins(resolution).keys()),
+                             sorted(self.expected(resolution, before).keys()))
+        self.assertEqual(self.bins('day'), {})
+
+    def test_prune(self):
+        counts = execute_rollup(self.dataset.id, self.later, prune=True,
+                                session=self.session)
+        self.assertEqual(counts['assocxtrsource'], len(self.images) - 1)
+        # the runcat and newsource sources and the one of the last
+        # assocxtrsource remain
+        xtrsrcs = self.session.query(Extractedsource). \
+            filter(Extractedsource.image_id.in_([i.id for i in self.images]))
+        self.assertEqual(xtrsrcs.count(), 3)
+        assocs = self.session.query(Assocxtrsource). \
+            filter(Assocxtrsource.runcat_id == self.runcat.id).all()
+        self.assertEqual(len(assocs), 1)
+        self.assertEqual(assocs[0].xtrsrc.image_id, self.images[-1].id)
+        # the lightcurve is still complete at day resolution
+        self.assertEqual(sum(b.datapoints for b in self.bins('day').values()),
+                         len(self.images))
+
+    def test_prune_late_image(self):
+        execute_rollup(self.dataset.id, self.later, session=self.session)
+        # an image that arrives for bins that have been rolled up already
+        taustart_ts = self.images[0].taustart_ts + timedelta(seconds=5)
+        late_image = gen_image(self.band, self.dataset, self.skyregion,
+                               taustart_ts)
+        late_xtrsrc = gen_extractedsource(late_image)
+        late_assoc = gen_assocxtrsource(self.runcat, late_xtrsrc)
+        self.session.add_all([late_image, late_xtrsrc, late_assoc])
+        self.session.commit()
+
+        counts = execute_rollup(self.dataset.id, self.later, prune=True,
+                                session=self.session)
+        # the late measurement isn't in the rollups, so it is kept
+        self.assertEqual(counts['assocxtrsource'], len(self.images) - 1)
+        assocs = self.session.query(Assocxtrsource). \
+            filter(Assocxtrsource.id == late_assoc.id)
+        self.assertEqual(assocs.count(), 1)
+        xtrsrcs = self.session.query(Extractedsource). \
+            filter(Extractedsource.id == late_xtrsrc.id)
+        self.assertEqual(xtrsrcs.count(), 1)
+        self.assertEqual(sum(b.datapoints for b in self.bins('day').values()),
+                         len(self.images))
@@ -8,7 +8,7 @@ from tkp.testutil.alchemy import gen_band, gen_dataset, gen_skyregion,\
 
 import tkp.db
 
-from tkp.steps.varmetric import execute_store_varmetric
+from tkp.steps.varmetric import execute_store_varmetric, check_varmetric
 
 
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +28,8 @@ class TestApi(unittest.TestCase):
         band = gen_band(dataset=self.dataset, central=150**6)
         skyregion = gen_skyregion(self.dataset)
         lightcurve = gen_lightcurve(band, self.dataset, skyregion)
+        self.images = [o for o in lightcurve
+                       if isinstance(o, tkp.db.model.Image)]
         self.session.add_all(lightcurve)
         self.session.flush()
         self.session.commit()
@@ -43,3 +45,28 @@ class TestApi(unittest.TestCase):
         self.session.flush()
         execute_store_varmetric(session=session, dataset_id=self.dataset.id)
         self.session.flush()
+
+    def test_incremental(self):
+        session = self.db.Session()
+        execute_store_varmetric(session=session, dataset_id=self.dataset.id,
+                                image_ids=[self.images[-1].id])
+        self.assertEqual(check_varmetric(self.dataset.id, session), [])
+
+    def test_incremental_untouched(self):
+        # no runcat is associated in an unknown image, nothing is stored
+        session = self.db.Session()
+        execute_store_varmetric(session=session, dataset_id=self.dataset.id,
+                                image_ids=[-1])
+        self.assertNotEqual(check_varmetric(self.dataset.id, session), [])
+
+    def test_check_detects_stale(self):
+        session = self.db.Session()
+        execute_store_varmetric(session=session, dataset_id=self.dataset.id)
+        self.assertEqual(check_varmetric(self.dataset.id, session), [])
+        varmetric = session.query(tkp.db.model.Varmetric).join(
+            tkp.db.model.Runningcatalog).filter(
+            tkp.db.model.Runningcatalog.dataset == self.dataset).one()
+        varmetric.lightcurve_max += 1
+        session.commit()
+        self.assertEqual(check_varmetric(self.dataset.id, session),
+                         [varmetric.runcat_id])
@@ -1,8 +1,26 @@
+import logging
+import os
+import select
+import shutil
+import socket
+import struct
+import tempfile
+import time
 import unittest
 from datetime import datetime
+from Queue import Queue
+from threading import Thread
 import dateutil
+import numpy as np
 import tkp.stream
+from tkp.testutil.decorators import duration
 from tkp.testutil.stream_emu import create_fits_hdu, serialize_hdu, make_window
+from tkp.testutil.stream_record import (StreamRecorder, StreamRecording,
+                                        Replayer, record)
+from tkp.utility.sharedmem import (SlotOverwritten, segment_directory,
+                                   remove_directory)
+
+logger = logging.getLogger(__name__)
 
 
 class TestStream(unittest.TestCase):
@@ -43,12 +61,350 @@ class TestStream(unittest.TestCase):
                 self2.counter += bytes
                 return data
 
+            def recv_into(self2, buffer_, bytes):
+                data = self2.recv(min(bytes, 1000))
+                buffer_[:len(data)] = data
+                return len(data)
+
         fits_bytes, image_bytes = tkp.stream.read_window(MockSocket())
         self.assertEqual(header, fits_bytes)
         self.assertEqual(data, image_bytes)
 
+    def test_read_window_reuse(self):
+        window = make_window(self.hdu)
+        sender, receiver = socket.socketpair()
+        sender.sendall(window * 2)
+        buffers = tkp.stream.WindowBuffers()
+        _, first = tkp.stream.read_window(receiver, buffers)
+        _, second = tkp.stream.read_window(receiver, buffers)
+        self.assertIs(first, second)
+        self.assertEqual(buffers.windows, 2)
+        self.assertEqual(buffers.bytes, 2 * len(window))
+        sender.close()
+        receiver.close()
+
     def test_reconstruct_fits(self):
         data, header = serialize_hdu(self.hdu)
         hdulist = tkp.stream.reconstruct_fits(header, data)
         self.assertEqual(self.hdu.data.all(), hdulist[0].data.all())
         self.assertEqual(self.hdu.header, hdulist[0].header)
+
+    def test_reconstruct_fits_view(self):
+        data, header = serialize_hdu(self.hdu)
+        image_bytes = bytearray(data)
+        hdulist = tkp.stream.reconstruct_fits(header, image_bytes)
+        self.assertEqual(hdulist[0].data.dtype, np.float32)
+        # the image is decoded without copying the buffer
+        image_bytes[:4] = struct.pack('=f', 42.)
+        self.assertEqual(hdulist[0].data.flat[0], 42.)
+
+    @duration(30)
+    def test_benchmark(self):
+        """
+        Decode throughput of the emulated stream, compared to assembling the
+        windows from recv() chunks and unpacking them into a tuple.
+        """
+        window = make_window(self.hdu)
+        windows = 50
+
+        def legacy(socket_):
+            header = tkp.stream.getbytes(socket_, tkp.stream.HEADER_LENGTH)
+            _, fits_length, array_length = struct.unpack('=QLL', header[:16])
+            fits_bytes = tkp.stream.getbytes(socket_, fits_length)
+            image_bytes = tkp.stream.getbytes(socket_, array_length)
+            image = struct.unpack(str(array_length / 4) + 'f', image_bytes)
+            return np.reshape(image, (self.hdu.header['NAXIS1'],
+                                      self.hdu.header['NAXIS2']))
+
+        buffers = tkp.stream.WindowBuffers()
+
+        def zero_copy(socket_):
+            fits_bytes, image_bytes = tkp.stream.read_window(socket_, buffers)
+            return tkp.stream.reconstruct_fits(fits_bytes, image_bytes)[0].data
+
+        results = {}
+        for name, read in (('legacy', legacy), ('zero-copy', zero_copy)):
+            sender, receiver = socket.socketpair()
+            thread = Thread(target=lambda: [sender.sendall(window)
+                                            for _ in range(windows)])
+            thread.daemon = True
+            thread.start()
+            start = time.time()
+            for _ in range(windows):
+                results[name] = read(receiver)
+            rate = windows * len(window) / (time.time() - start) / 1e6
+            logger.info("%s: %.1f MB/s" % (name, rate))
+            thread.join()
+            sender.close()
+            receiver.close()
+        self.assertTrue((results['legacy'] == results['zero-copy']).all())
+
+
+def serve(window, windows):
+    """
+    Listen on a free port and send the window a number of times to the first
+    client.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('localhost', 0))
+    server.listen(1)
+
+    def send():
+        conn, _ = server.accept()
+        for _ in range(windows):
+            conn.sendall(window)
+        conn.close()
+        server.close()
+    thread = Thread(target=send)
+    thread.daemon = True
+    thread.start()
+    return server.getsockname()[1]
+
+
+class TestIngest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        hdu = create_fits_hdu()
+        hdu.header['date-obs'] = datetime.now().isoformat()
+        cls.window = make_window(hdu)
+
+    def test_ingest(self):
+        ports = [serve(self.window, 3), serve(self.window, 2)]
+        connections = [tkp.stream.Connection('localhost', p) for p in ports]
+        image_queue = Queue()
+        thread = Thread(target=tkp.stream.ingest,
+                        args=(connections, image_queue))
+        thread.daemon = True
+        thread.start()
+        for _ in range(5):
+            image_queue.get(timeout=10)
+        self.assertEqual([c.windows for c in connections], [3, 2])
+        self.assertEqual(connections[0].bytes, 3 * len(self.window))
+
+    def test_ring(self):
+        directory = segment_directory()
+        self.addCleanup(remove_directory, directory)
+        ring = tkp.stream.StreamRing(directory, slots=2)
+        connection = tkp.stream.Connection('localhost', serve(self.window, 3), ring)
+        image_queue = Queue()
+        thread = Thread(target=tkp.stream.ingest,
+                        args=([connection], image_queue))
+        thread.daemon = True
+        thread.start()
+        images = [image_queue.get(timeout=10) for _ in range(3)]
+        for image in images:
+            self.assertIsInstance(image, tkp.stream.RingImage)
+        # the first slot was overwritten by the third window
+        self.assertEqual(ring.dropped, 1)
+        self.assertRaises(SlotOverwritten, images[0].verify)
+        data, header = serialize_hdu(create_fits_hdu())
+        expected = tkp.stream.reconstruct_fits(header, data)[0].data
+        self.assertTrue((images[2].hdulist()[0].data == expected).all())
+        images[2].release()
+
+    def test_ring_partial_window(self):
+        directory = segment_directory()
+        self.addCleanup(remove_directory, directory)
+        ring = tkp.stream.StreamRing(directory, slots=1, policy='drop-newest')
+        port = serve(self.window[:-100], 1)
+        connection = tkp.stream.Connection('localhost', port, ring)
+        thread = Thread(target=tkp.stream.ingest,
+                        args=([connection], Queue()))
+        thread.daemon = True
+        thread.start()
+        timeout = time.time() + 10
+        while not connection.reconnects and time.time() < timeout:
+            time.sleep(0.01)
+        self.assertEqual(connection.reconnects, 1)
+        # the slot of the incomplete image is free again
+        self.assertFalse(any(ring.ring.in_use))
+
+    def test_queue_full(self):
+        directory = segment_directory()
+        self.addCleanup(remove_directory, directory)
+        ring = tkp.stream.StreamRing(directory, slots=3, policy='drop-newest')
+        connection = tkp.stream.Connection('localhost', serve(self.window, 3), ring)
+        image_queue = Queue(maxsize=1)
+        metrics = tkp.stream.StreamMetrics()
+        thread = Thread(target=tkp.stream.ingest,
+                        args=([connection], image_queue, metrics))
+        thread.daemon = True
+        thread.start()
+        timeout = time.time() + 10
+        while metrics.dropped_images < 2 and time.time() < timeout:
+            time.sleep(0.01)
+        self.assertEqual(metrics.dropped_images, 2)
+        self.assertEqual(image_queue.qsize(), 1)
+        # only the slot of the queued image is in use
+        self.assertEqual(sum(ring.ring.in_use), 1)
+        image_queue.get().release()
+
+    def test_reconnect_backoff(self):
+        # a port nobody listens on
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('localhost', 0))
+        port = server.getsockname()[1]
+        server.close()
+
+        connection = tkp.stream.Connection('localhost', port)
+        connection.connect()
+        if connection.connecting:
+            select.select([], [connection], [], 5)
+            connection.connected()
+        self.assertIsNone(connection.socket)
+        self.assertEqual(connection.reconnects, 1)
+        self.assertEqual(connection.backoff, 2 * tkp.stream.MIN_BACKOFF)
+
+    def test_metrics(self):
+        metrics = tkp.stream.StreamMetrics()
+        metrics.connections = [tkp.stream.Connection('localhost', 1)]
+        summary = metrics.summary()
+        self.assertEqual(summary['queue_depth'], 0)
+        self.assertFalse(summary['connections']['localhost:1']['connected'])
+
+
+class FakeImage(object):
+    """
+    Looks like an HDUList to extract_timestamp().
+    """
+    def __init__(self, second):
+        self.header = {'date-obs': datetime(2016, 1, 1, 0, 0, second).isoformat()}
+
+    def __getitem__(self, index):
+        return self
+
+
+class FakeRing(object):
+    """
+    Records the slots released by RingImages.
+    """
+    def __init__(self):
+        self.released = []
+
+    def release(self, slot):
+        self.released.append(slot)
+
+
+class TestMerger(unittest.TestCase):
+    def start(self, backlog=0, **kwargs):
+        self.image_queue = Queue()
+        self.grouped_queue = Queue(maxsize=backlog)
+        self.ring = FakeRing()
+        self.metrics = tkp.stream.StreamMetrics()
+        thread = Thread(target=tkp.stream.merger,
+                        args=(self.image_queue, self.grouped_queue,
+                              self.metrics),
+                        kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+
+    def put(self, *seconds):
+        for second in seconds:
+            self.image_queue.put(FakeImage(second))
+
+    def put_ring(self, *seconds):
+        """
+        Put RingImages, with the second as slot.
+        """
+        for second in seconds:
+            image = tkp.stream.RingImage(None, second, self.ring)
+            image._header = FakeImage(second).header
+            self.image_queue.put(image)
+
+    def group(self, timeout=5):
+        images = self.grouped_queue.get(timeout=timeout)
+        return [tkp.stream.extract_timestamp(i).second for i in images]
+
+    def test_complete(self):
+        self.start(bands=2, deadline=60)
+        self.put(1, 1)
+        self.assertEqual(self.group(), [1, 1])
+
+    def test_deadline(self):
+        self.start(bands=2, deadline=0.2)
+        self.put(1)
+        self.assertEqual(self.group(), [1])
+        self.assertEqual(self.metrics.incomplete_groups, 1)
+
+    def test_out_of_order(self):
+        self.start(bands=2, deadline=60, reorder=2)
+        self.put(2, 1, 1)
+        self.assertEqual(self.group(), [1, 1])
+        self.put(2)
+        self.assertEqual(self.group(), [2, 2])
+        # too late, the group has been emitted
+        self.put(1, 3, 3)
+        self.assertEqual(self.group(), [3, 3])
+        self.assertEqual(self.metrics.late_images, 1)
+
+    def test_reorder_window(self):
+        self.start(bands=2, deadline=60, reorder=1)
+        self.put(1, 2)
+        self.assertEqual(self.group(), [1])
+        self.put(2)
+        self.assertEqual(self.group(), [2, 2])
+
+    def test_late_image_released(self):
+        self.start(bands=2, deadline=60)
+        self.put_ring(2, 2)
+        self.assertEqual(self.group(), [2, 2])
+        self.put_ring(1, 3, 3)
+        self.assertEqual(self.group(), [3, 3])
+        self.assertEqual(self.ring.released, [1])
+
+    def test_dropped_group_released(self):
+        self.start(backlog=1, bands=2, deadline=60)
+        self.put_ring(1, 1, 2, 2)
+        timeout = time.time() + 5
+        while len(self.ring.released) < 2 and time.time() < timeout:
+            time.sleep(0.01)
+        self.assertEqual(self.metrics.dropped_groups, 1)
+        self.assertEqual(self.ring.released, [2, 2])
+        self.assertEqual(self.group(), [1, 1])
+
+
+class TestRecordReplay(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        hdu = create_fits_hdu()
+        hdu.header['date-obs'] = datetime.now().isoformat()
+        cls.window = make_window(hdu)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'stream.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_record(self):
+        ports = [serve(self.window, 2), serve(self.window, 2)]
+        count = record(['localhost'] * 2, ports, self.path, windows=4,
+                       duration=30)
+        self.assertEqual(count, 4)
+        recording = StreamRecording(self.path)
+        self.assertEqual(len(recording), 4)
+        self.assertEqual(recording.ports, sorted(ports))
+        for entry, window in recording.windows():
+            self.assertEqual(window, self.window)
+
+    def test_replay(self):
+        recorder = StreamRecorder(self.path)
+        for port in (1, 2, 1):
+            recorder.append(port, self.window)
+        recorder.close()
+
+        replayer = Replayer(StreamRecording(self.path), ports=[0, 0], speed=0)
+        thread = Thread(target=replayer.run)
+        thread.daemon = True
+        thread.start()
+        connections = [tkp.stream.Connection('localhost', p)
+                       for p in replayer.ports]
+        image_queue = Queue()
+        ingest = Thread(target=tkp.stream.ingest,
+                        args=(connections, image_queue))
+        ingest.daemon = True
+        ingest.start()
+        for _ in range(3):
+            image_queue.get(timeout=10)
+        self.assertEqual([c.windows for c in connections], [2, 1])
@@ -2,6 +2,7 @@
 Test functions used for manipulating coordinates in the TKP pipeline.
 """
 
+import numpy
 import pytz
 
 import unittest
@@ -309,5 +310,60 @@ class UnixToMJDTestCase(unittest.TestCase):
         self.assertEqual(coordinates.unix2julian(0), coordinates.unix_epoch)
 
 
+class skyPixelTest(unittest.TestCase):
+    def in_ranges(self, pixel, ranges):
+        return any(first <= pixel <= last for first, last in ranges)
+
+    def check_cone(self, ra, decl, radius):
+        ranges = coordinates.sky_pixel_ranges(ra, decl, radius)
+        # sorted and disjoint
+        for (first, last), (next_first, _) in zip(ranges, ranges[1:]):
+            self.assertTrue(first <= last < next_first)
+        steps = numpy.linspace(-1, 1, 41)
+        for dd in steps * radius:
+            for dr in steps * coordinates.alpha_inflate(radius, decl):
+                p_ra = (ra + dr) % 360
+                p_decl = decl + dd
+                if abs(p_decl) > 90:
+                    continue
+                if coordinates.angsep(ra, decl, p_ra, p_decl) > 3600 * radius:
+                    continue
+                pixel = coordinates.sky_pixel(p_ra, p_decl)
+                self.assertTrue(self.in_ranges(pixel, ranges),
+                                "%s, %s not in cone around %s, %s" %
+                                (p_ra, p_decl, ra, decl))
+        return ranges
+
+    def testArray(self):
+        ra = numpy.array([0.0, 123.4, 359.999, 10.0])
+        decl = numpy.array([-90.0, 12.3, -0.001, 90.0])
+        pixels = coordinates.sky_pixel(ra, decl)
+        self.assertEqual(list(pixels),
+                         [coordinates.sky_pixel(r, d) for r, d in zip(ra, decl)])
+        self.assertEqual(pixels[0], 0)
+        self.assertEqual(pixels[-1], (coordinates.SKY_PIXEL_ROWS - 1) *
+                         coordinates.SKY_PIXEL_ROW_LENGTH)
+
+    def testCone(self):
+        ranges = self.check_cone(123.4, 45.6, 0.05)
+        self.assertTrue(len(ranges) <= 4)
+        self.check_cone(250.0, -30.0, 4.0)
+
+    def testMeridianWrap(self):
+        ranges = self.check_cone(359.95, 10.0, 0.2)
+        # both sides of the meridian, without the RA band in between
+        self.assertTrue(self.in_ranges(coordinates.sky_pixel(0.05, 10.0),
+                                       ranges))
+        self.assertFalse(self.in_ranges(coordinates.sky_pixel(180.0, 10.0),
+                                        ranges))
+        self.check_cone(0.01, -60.0, 3.0)
+
+    def testPole(self):
+        ranges = self.check_cone(45.0, 89.5, 1.0)
+        # the rows around the pole are covered completely
+        self.assertTrue(self.in_ranges(coordinates.sky_pixel(225.0, 89.8),
+                                       ranges))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+import os
+import unittest
+import cPickle
+import numpy
+from tkp.utility.sharedmem import (SharedArray, SharedRing, SlotOverwritten,
+                                   segment_directory, remove_directory)
+
+
+class TestSharedArray(unittest.TestCase):
+    def setUp(self):
+        self.directory = segment_directory()
+
+    def tearDown(self):
+        remove_directory(self.directory)
+
+    def test_roundtrip(self):
+        array = numpy.arange(12, dtype=numpy.float64).reshape(3, 4)
+        for original in array, array.transpose():
+            shared = SharedArray.create(original, self.directory)
+            unpickled = cPickle.loads(cPickle.dumps(shared))
+            attached = unpickled.attach()
+            self.assertEqual(attached.shape, original.shape)
+            self.assertTrue((attached == original).all())
+
+    def test_copy_on_write(self):
+        array = numpy.zeros((2, 2))
+        shared = SharedArray.create(array, self.directory)
+        first = shared.attach()
+        first[0, 0] = 1
+        self.assertEqual(shared.attach()[0, 0], 0)
+
+    def test_unlink(self):
+        shared = SharedArray.create(numpy.ones(3), self.directory)
+        attached = shared.attach()
+        shared.unlink()
+        self.assertFalse(os.path.exists(shared.path))
+        self.assertEqual(attached.sum(), 3)
+
+
+class TestSharedRing(unittest.TestCase):
+    def setUp(self):
+        self.directory = segment_directory()
+
+    def tearDown(self):
+        remove_directory(self.directory)
+
+    def write(self, ring, values):
+        slot = ring.reserve()
+        if slot is None:
+            return None
+        ring.view(slot)[:] = numpy.array(values, dtype=numpy.float32). \
+            view(numpy.uint8)
+        return ring.handle(slot, (len(values),), numpy.float32)
+
+    def test_roundtrip(self):
+        ring = SharedRing(self.directory, 12, 2)
+        handle = cPickle.loads(cPickle.dumps(self.write(ring, [1, 2, 3])))
+        attached = handle.attach()
+        self.assertEqual(list(attached), [1, 2, 3])
+        self.assertFalse(attached.flags.writeable)
+
+    def test_drop_oldest(self):
+        ring = SharedRing(self.directory, 4, 2, 'drop-oldest')
+        first = self.write(ring, [1])
+        second = self.write(ring, [2])
+        ring.release(second.slot, second.sequence)
+        # the free slot is used first
+        self.assertEqual(self.write(ring, [3]).slot, second.slot)
+        self.assertTrue(first.current())
+        self.write(ring, [4])
+        self.assertEqual(ring.dropped, 1)
+        # the handle maps the new data, which verify() detects
+        self.assertEqual(list(first.attach()), [4])
+        self.assertRaises(SlotOverwritten, first.verify)
+
+    def test_drop_newest(self):
+        ring = SharedRing(self.directory, 4, 1, 'drop-newest')
+        first = self.write(ring, [1])
+        self.assertIsNone(self.write(ring, [2]))
+        self.assertEqual(ring.dropped, 1)
+        self.assertEqual(list(first.attach()), [1])
+        ring.release(first.slot, first.sequence)
+        self.assertIsNotNone(self.write(ring, [3]))
+
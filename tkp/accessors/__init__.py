@@ -64,6 +64,12 @@ def open(path, *args, **kwargs):
     """
     if type(path) == HDUList:
         return FitsImageBlob(path, *args, **kwargs)
+    elif hasattr(path, 'hdulist') and hasattr(path, 'verify'):
+        # a tkp.stream.RingImage, the pixels are copied out of the ring slot
+        # after which we make sure the slot wasn't overwritten in the meantime
+        accessor = FitsImageBlob(path.hdulist(), *args, **kwargs)
+        path.verify()
+        return accessor
     elif type(path) == str:
         if not os.access(path, os.F_OK):
             raise IOError("%s does not exist!" % path)
@@ -74,4 +80,23 @@ def open(path, *args, **kwargs):
             raise IOError("no accessor found for %s" % path)
         return Accessor(path, *args, **kwargs)
     else:
-        raise Exception("image should be path or HDUlist, got " + str(path))
+        raise Exception("image should be path, HDUlist or RingImage, got " +
+                        str(path))
+
+
+def sort_metadata(path):
+    """
+    Returns the (taustart_ts, freq_eff) tuple used to order images, without
+    reading the pixel data where the accessor supports this.
+
+    See :meth:`tkp.accessors.dataaccessor.DataAccessor.sort_metadata`.
+    """
+    if type(path) != str:
+        accessor = open(path)
+        return accessor.taustart_ts, accessor.freq_eff
+    if not os.access(path, os.R_OK):
+        raise IOError("Can't read %s!" % path)
+    Accessor = tkp.accessors.detection.detect(path)
+    if not Accessor:
+        raise IOError("no accessor found for %s" % path)
+    return Accessor.sort_metadata(path)
@@ -40,6 +40,26 @@ class CasaImage(DataAccessor):
         self.beam = self.degrees2pixels(
             bmaj, bmin, bpa, self.pixelsize[0], self.pixelsize[1])
 
+    @classmethod
+    def sort_metadata(cls, url):
+        """
+        Parses taustart_ts and freq_eff from the table keywords only, the
+        map column is never read. See :meth:`DataAccessor.sort_metadata`.
+        """
+        # Skip __init__, the parsers below only need the url and table.
+        accessor = cls.__new__(cls)
+        accessor.url = url
+        table = casacore_table(url.encode(), ack=False)
+        freq_eff, _ = accessor.parse_frequency(table)
+        return accessor.sort_taustart_ts(table), freq_eff
+
+    def sort_taustart_ts(self, table):
+        """
+        Start time used by :meth:`sort_metadata`, subclasses which don't take
+        it from the coords record override this.
+        """
+        return self.parse_taustartts(table)
+
     def parse_data(self, table, plane=0):
         """extract and massage data from CASA table"""
         data = table[0]['map'].squeeze()
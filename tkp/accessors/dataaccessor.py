@@ -1,6 +1,7 @@
 import logging
 from tkp.quality.rms import rms_with_clipped_subregion
 from tkp.accessors.requiredatts import RequiredAttributesMetaclass
+from tkp.utility.sharedmem import SharedArray
 from math import degrees, sqrt, sin, pi, cos
 
 logger = logging.getLogger(__name__)
@@ -75,6 +76,57 @@ class DataAccessor(object):
         function which provides key info in a simple dict format.
         """
 
+    @classmethod
+    def sort_metadata(cls, url):
+        """
+        Return the start time and effective frequency of the image at url,
+        used for ordering images before processing.
+
+        Subclasses which can read these from the image headers override this
+        to avoid loading the pixel data; by default the image is opened.
+
+        returns:
+            tuple: (taustart_ts, freq_eff)
+        """
+        accessor = cls(url)
+        return accessor.taustart_ts, accessor.freq_eff
+
+    def share_data(self, directory):
+        """
+        Move the pixel data into a shared memory segment in directory.
+
+        After this only a handle to the segment is pickled with the accessor,
+        processes unpickling the accessor map the pixel data without copying.
+        The process that shared the data should call :meth:`release_data`
+        when the accessor is not needed anymore.
+
+        args:
+            directory (str): see :func:`tkp.utility.sharedmem.segment_directory`
+        """
+        if getattr(self, '_shared_data', None):
+            return
+        self._shared_data = SharedArray.create(self.data, directory)
+        self.data = self._shared_data.attach()
+
+    def release_data(self):
+        """
+        Free the shared memory segment created by :meth:`share_data`, if any.
+        """
+        shared = getattr(self, '_shared_data', None)
+        if shared:
+            shared.unlink()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if state.get('_shared_data'):
+            del state['data']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state.get('_shared_data'):
+            self.data = self._shared_data.attach()
+
     def extract_metadata(self):
         """
         Massage the class attributes into a flat dictionary with
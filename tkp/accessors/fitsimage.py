@@ -43,6 +43,20 @@ class FitsImage(DataAccessor):
         if 'TELESCOP' in self.header:
             self.telescope = self.header['TELESCOP']
 
+    @classmethod
+    def sort_metadata(cls, url, hdu_index=0):
+        """
+        Parses taustart_ts and freq_eff from the header only, see
+        :meth:`DataAccessor.sort_metadata`.
+        """
+        # Skip __init__, the parsers below only need the url and header.
+        accessor = cls.__new__(cls)
+        accessor.url = url
+        accessor.header = accessor._get_header(hdu_index)
+        taustart_ts, _ = accessor.parse_times()
+        freq_eff, _ = accessor.parse_frequency()
+        return taustart_ts, freq_eff
+
     def _get_header(self, hdu_index):
         with pyfits.open(self.url) as hdulist:
             hdu = hdulist[hdu_index]
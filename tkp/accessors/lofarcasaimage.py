@@ -53,6 +53,11 @@ class LofarCasaImage(CasaImage, LofarAccessor):
         self.subbandwidth = self.parse_subbandwidth(subtables)
         self.subbands = self.parse_subbands(subtables)
 
+    def sort_taustart_ts(self, table):
+        subtables = {'LOFAR_OBSERVATION': casacore_table(
+            table.getkeyword("ATTRGROUPS")['LOFAR_OBSERVATION'], ack=False)}
+        return self.parse_taustartts(subtables)
+
     def open_subtables(self, table):
         """open all subtables defined in the LOFAR format
         args:
@@ -54,7 +54,8 @@ def get_database_config(pipeline_config=None, apply=None):
     args:
         pipeline_config: Dict of db settings.
             Relevant keys: (engine, database, user, password, host, port,
-            passphrase )
+            passphrase, pool_size, prepared_statements, profile,
+            explain_threshold, explain_fraction )
         apply: apply settings (configure db connection) or not
     returns:
         dict: containing the resulting combined settings
@@ -71,7 +72,12 @@ def get_database_config(pipeline_config=None, apply=None):
         'password': None,
         'host': "localhost",
         'port': None,
-        'passphrase': None
+        'passphrase': None,
+        'pool_size': 0,
+        'prepared_statements': False,
+        'profile': False,
+        'explain_threshold': 0,
+        'explain_fraction': 1.0
     }
 
     if pipeline_config:
@@ -5,18 +5,21 @@ from tkp.db.orm import DataSet, Image, ExtractedSource
 
 logger = logging.getLogger(__name__)
 
-def execute(query, parameters={}, commit=False):
+def execute(query, parameters={}, commit=False, name=None):
     """
     A generic wrapper for doing any query to the database
 
     :param query: the query string
     :param parameters: The query parameters. These will be converted and escaped.
     :param commit: should a commit be performed afterwards, boolean
+    :param name: name of the query in the registry of prepared statements,
+                 see :meth:`tkp.db.database.Database.execute`
 
     :returns: a database cursor object
     """
     database = Database()
-    return database.execute(query, parameters=parameters, commit=commit)
+    return database.execute(query, parameters=parameters, commit=commit,
+                            name=name)
 
 
 def rollback():
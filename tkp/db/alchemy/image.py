@@ -1,11 +1,45 @@
 import math
+from collections import namedtuple
 from datetime import datetime
 from tkp.db.model import Frequencyband, Skyregion, Image, Dataset
-from tkp.utility.coordinates import eq_to_cart
+from tkp.db.cache import DatasetCache
+from tkp.db.generic import pixel_condition
+from tkp.utility.coordinates import eq_to_cart, sky_pixel, sky_pixel_ranges
 from sqlalchemy import func, cast
 from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION as Double
 
 
+# the bands (as BandLimits, in order of id) and the skyregion ids (by centre
+# and radius) of a dataset, extended when insert_image() or insert_images()
+# insert new ones
+band_cache = DatasetCache('frequencyband')
+skyregion_cache = DatasetCache('skyregion')
+
+BandLimits = namedtuple('BandLimits', ['id', 'freq_low', 'freq_high'])
+
+
+def _band_limits(freq_eff, freq_bw, freq_bw_max=.0):
+    """
+    The frequency range of an image used for the band association.
+    """
+    if freq_bw_max == .0:
+        bw_half = freq_bw / 2
+    else:
+        bw_half = freq_bw_max / 2
+    return freq_eff - bw_half, freq_eff + bw_half
+
+
+def _match_band(bands, low, high):
+    """
+    The first of the bands that overlaps with the frequency range, the same
+    criterion as get_band() but on already loaded bands.
+    """
+    for band in bands:
+        w1 = high - low
+        w2 = band.freq_high - band.freq_low
+        if max(high, band.freq_high) - min(low, band.freq_low) < w1 + w2:
+            return band
+
 
 def get_band(session, dataset, freq_eff, freq_bw, freq_bw_max=.0):
     """
@@ -23,14 +57,7 @@ def get_band(session, dataset, freq_eff, freq_bw, freq_bw_max=.0):
         tkp.db.model.Frequencyband: a frequency band object
     """
     
-    if freq_bw_max == .0:
-        bw_half = freq_bw / 2
-        low = freq_eff - bw_half
-        high = freq_eff + bw_half
-    else:
-        bw_half = freq_bw_max / 2
-        low = freq_eff - bw_half
-        high = freq_eff + bw_half
+    low, high = _band_limits(freq_eff, freq_bw, freq_bw_max)
 
     w1 = high - low
     w2 = Frequencyband.freq_high - Frequencyband.freq_low
@@ -62,12 +89,14 @@ def update_skyregion_members(session, skyregion):
     onto the unit sphere, so this does not have to be recalculated for every
     comparison.
 
-    Note 2. (To Do:) This distance check could be made more efficient by
-    restricting to a range of RA values, as we do with the Dec.
-    However, this optimization is complicated by the meridian wrap-around issue.
+    Note 2. The runningcatalog sources are first restricted to the sky pixels
+    of the skyregion (see :func:`tkp.utility.coordinates.sky_pixel_ranges`),
+    which also takes care of the meridian wrap-around.
         """
     inter = 2. * math.sin(math.radians(skyregion.xtr_radius) / 2.)
     inter_sq = inter * inter
+    ranges = sky_pixel_ranges(skyregion.centre_ra, skyregion.centre_decl,
+                              skyregion.xtr_radius)
 
     q = """
       INSERT INTO assocskyrgn
@@ -87,6 +116,7 @@ def update_skyregion_members(session, skyregion):
             ,runningcatalog rc
        WHERE sky.id = %(skyregion_id)s
          AND rc.dataset = sky.dataset
+         AND %(pixels)s
          AND rc.wm_decl BETWEEN sky.centre_decl - sky.xtr_radius
                             AND sky.centre_decl + sky.xtr_radius
          AND (  (rc.x - sky.x) * (rc.x - sky.x)
@@ -94,7 +124,8 @@ def update_skyregion_members(session, skyregion):
                 + (rc.z - sky.z) * (rc.z - sky.z)
              ) < %(inter_sq)s
       ;
-    """ % {'inter_sq': inter_sq, 'skyregion_id': skyregion.id}
+    """ % {'inter_sq': inter_sq, 'skyregion_id': skyregion.id,
+           'pixels': pixel_condition('rc.pixel', ranges)}
     session.execute(q)
     return inter
 
@@ -125,7 +156,8 @@ def get_skyregion(session, dataset, centre_ra, centre_decl, xtr_radius):
     if not skyregion:
         x, y, z = eq_to_cart(centre_ra, centre_decl)
         skyregion = Skyregion(dataset=dataset, centre_ra=centre_ra, centre_decl=centre_decl,
-                              xtr_radius=xtr_radius, x=x, y=y, z=z)
+                              xtr_radius=xtr_radius, x=x, y=y, z=z,
+                              pixel=sky_pixel(centre_ra, centre_decl))
         session.add(skyregion)
         session.flush()
         update_skyregion_members(session, skyregion)
@@ -136,7 +168,9 @@ def insert_image(session, dataset, freq_eff, freq_bw, taustart_ts, tau_time, bea
                  beam_pa_rad, deltax, deltay, url, centre_ra, centre_decl, xtr_radius, rms_qc, freq_bw_max=0.0,
                  rms_min=None, rms_max=None, detection_thresh=None, analysis_thresh=None):
     """
-    Insert an image for a given dataset.
+    Insert an image for a given dataset. The band and skyregion are found
+    or inserted like get_band() and get_skyregion() do, but using the
+    cached ones of the dataset.
 
     Args:
         session (sqlalchemy.orm.session.Session): A SQLalchemy sessions
@@ -164,20 +198,177 @@ def insert_image(session, dataset, freq_eff, freq_bw, taustart_ts, tau_time, bea
     dataset_id = dataset
     dataset = session.query(Dataset).filter(Dataset.id == dataset_id).one()
 
-    skyrgn = get_skyregion(session, dataset, centre_ra, centre_decl, xtr_radius)
-    band = get_band(session, dataset, freq_eff, freq_bw, freq_bw_max)
+    [(skyrgn_id, band_id)] = _resolve(session, dataset, [{
+        'centre_ra': centre_ra, 'centre_decl': centre_decl,
+        'xtr_radius': xtr_radius, 'freq_eff': freq_eff, 'freq_bw': freq_bw,
+        'freq_bw_max': freq_bw_max}])
+    rb_smaj, rb_smin, rb_pa = _restoring_beam(beam_smaj_pix, beam_smin_pix,
+                                              beam_pa_rad, deltax, deltay)
+
+    l = locals()
+    kwargs = {arg: l[arg] for arg in image_args if arg not in ('band', 'skyrgn')}
+    image = Image(band_id=band_id, skyrgn_id=skyrgn_id, **kwargs)
+    session.add(image)
+    return image
+
+
+# the Image attributes set by insert_image() and insert_images()
+image_args = ['dataset', 'band', 'tau_time', 'freq_eff', 'freq_bw', 'taustart_ts', 'skyrgn', 'rb_smaj', 'rb_smin',
+              'rb_pa', 'deltax', 'deltay', 'url', 'rms_qc', 'rms_min', 'rms_max', 'detection_thresh',
+              'analysis_thresh']
+
+
+def _restoring_beam(beam_smaj_pix, beam_smin_pix, beam_pa_rad, deltax, deltay):
+    """
+    The restoring beam in degrees, see insert_image().
+    """
     rb_smaj = beam_smaj_pix * math.fabs(deltax)
     rb_smin = beam_smin_pix * math.fabs(deltay)
     rb_pa = 180 * beam_pa_rad / math.pi
+    return rb_smaj, rb_smin, rb_pa
 
-    args = ['dataset', 'band', 'tau_time', 'freq_eff', 'freq_bw', 'taustart_ts', 'skyrgn', 'rb_smaj', 'rb_smin',
-            'rb_pa', 'deltax', 'deltay', 'url', 'rms_qc', 'rms_min', 'rms_max', 'detection_thresh', 'analysis_thresh']
 
-    l = locals()
-    kwargs = {arg: l[arg] for arg in args}
-    image = Image(**kwargs)
-    session.add(image)
-    return image
+def _cached_bands(session, dataset):
+    def load():
+        query = session.query(Frequencyband.id, Frequencyband.freq_low,
+                              Frequencyband.freq_high). \
+            filter(Frequencyband.dataset == dataset). \
+            order_by(Frequencyband.id)
+        return [BandLimits(*row) for row in query]
+    return band_cache.get(dataset.id, load)
+
+
+def _cached_skyregions(session, dataset):
+    def load():
+        query = session.query(Skyregion.centre_ra, Skyregion.centre_decl,
+                              Skyregion.xtr_radius, Skyregion.id). \
+            filter(Skyregion.dataset == dataset)
+        return dict(((ra, decl, radius), id_)
+                    for ra, decl, radius, id_ in query)
+    return skyregion_cache.get(dataset.id, load)
+
+
+def _resolve(session, dataset, images):
+    """
+    Find the skyregion and band of every image among the cached ones of the
+    dataset, the missing ones are inserted with a single flush, after which
+    the members of the new skyregions are updated and the caches extended.
+
+    Since the caches now contain uncommitted rows, they should be
+    invalidated if the session is rolled back.
+
+    args:
+        session (sqlalchemy.orm.session.Session): A SQLalchemy sessions
+        dataset (tkp.db.model.Dataset): the TraP dataset
+        images (list): dicts with at least centre_ra, centre_decl,
+            xtr_radius, freq_eff and freq_bw, and optionally freq_bw_max
+
+    returns:
+        list: tuples (skyregion id, band id), in the order of images
+    """
+    cached_bands = _cached_bands(session, dataset)
+    cached_skyregions = _cached_skyregions(session, dataset)
+    bands = list(cached_bands)
+    skyregions = dict(cached_skyregions)
+
+    new_bands = []
+    new_skyregions = []
+    resolved = []
+    for image in images:
+        key = (image['centre_ra'], image['centre_decl'], image['xtr_radius'])
+        if key not in skyregions:
+            centre_ra, centre_decl, xtr_radius = key
+            x, y, z = eq_to_cart(centre_ra, centre_decl)
+            skyrgn = Skyregion(dataset=dataset, centre_ra=centre_ra,
+                               centre_decl=centre_decl, xtr_radius=xtr_radius,
+                               x=x, y=y, z=z,
+                               pixel=sky_pixel(centre_ra, centre_decl))
+            session.add(skyrgn)
+            skyregions[key] = None
+            new_skyregions.append(skyrgn)
+
+        low, high = _band_limits(image['freq_eff'], image['freq_bw'],
+                                 image.get('freq_bw_max', 0.0))
+        band = _match_band(bands, low, high)
+        if not band:
+            band = Frequencyband(freq_central=image['freq_eff'], freq_low=low,
+                                 freq_high=high, dataset=dataset)
+            session.add(band)
+            bands.append(band)
+            new_bands.append(band)
+        resolved.append((key, band))
+
+    if new_bands or new_skyregions:
+        session.flush()
+        for skyrgn in new_skyregions:
+            update_skyregion_members(session, skyrgn)
+        cached_bands.extend(BandLimits(b.id, b.freq_low, b.freq_high)
+                            for b in new_bands)
+        new_ids = dict(((s.centre_ra, s.centre_decl, s.xtr_radius), s.id)
+                       for s in new_skyregions)
+        cached_skyregions.update(new_ids)
+        skyregions.update(new_ids)
+
+    return [(skyregions[key], band.id) for key, band in resolved]
+
+
+def insert_images(session, dataset, images):
+    """
+    Insert the images of a timestep for a given dataset in one go.
+
+    The bands and skyregions of the dataset are taken from the cache and
+    matched for all images together, new ones are inserted with a single
+    flush, after which the members of the new skyregions are updated. On
+    PostgreSQL the images are inserted with a single multi-row INSERT.
+
+    The caller should commit the session.
+
+    Args:
+        session (sqlalchemy.orm.session.Session): A SQLalchemy sessions
+        dataset (int): ID of parent dataset.
+        images (list): dicts with the keyword arguments of insert_image(),
+            except session and dataset, one per image.
+
+    Returns:
+        list: dicts with the columns of the inserted image rows, in the
+            order of images.
+    """
+    dataset = session.query(Dataset).filter(Dataset.id == dataset).one()
+    resolved = _resolve(session, dataset, images)
+
+    rows = []
+    for image, (skyrgn_id, band_id) in zip(images, resolved):
+        rb_smaj, rb_smin, rb_pa = _restoring_beam(
+            image['beam_smaj_pix'], image['beam_smin_pix'],
+            image['beam_pa_rad'], image['deltax'], image['deltay'])
+        row = {'dataset': dataset.id, 'band': band_id, 'skyrgn': skyrgn_id,
+               'rb_smaj': rb_smaj, 'rb_smin': rb_smin, 'rb_pa': rb_pa}
+        for arg in image_args:
+            if arg not in row:
+                row[arg] = image.get(arg)
+        rows.append(row)
+    if not rows:
+        return []
+
+    table = Image.__table__
+    if session.bind.dialect.name == 'postgresql':
+        # the ids are drawn from the sequence in the order of the VALUES
+        result = session.execute(table.insert().values(rows).
+                                 returning(*table.columns))
+        inserted = sorted((dict(r) for r in result), key=lambda r: r['id'])
+    else:
+        objects = []
+        for row in rows:
+            kwargs = dict(row)
+            kwargs['dataset_id'] = kwargs.pop('dataset')
+            kwargs['band_id'] = kwargs.pop('band')
+            kwargs['skyrgn_id'] = kwargs.pop('skyrgn')
+            objects.append(Image(**kwargs))
+        session.add_all(objects)
+        session.flush()
+        inserted = [dict((p.columns[0].name, getattr(o, p.key)) for p in
+                         Image.__mapper__.column_attrs) for o in objects]
+    return inserted
 
 
 def insert_dataset(session, description):
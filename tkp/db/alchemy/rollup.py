@@ -0,0 +1,194 @@
+"""
+Multi-resolution lightcurves: the fluxes of the extracted sources of a
+runningcatalog are aggregated per minute, hour and day into the
+lightcurve_rollup table, after which the individual measurements of old
+images can be pruned.
+"""
+from datetime import timedelta
+
+from sqlalchemy import and_, func, insert, delete, literal
+from sqlalchemy.orm import aliased
+from tkp.db.model import Assocxtrsource, Extractedsource, Runningcatalog,\
+    Image, Newsource, LightcurveRollup
+from tkp.db.alchemy.varmetric import _last_assoc_per_band
+
+# the resolutions from fine to coarse, with their bin length
+RESOLUTIONS = ('minute', 'hour', 'day')
+BIN_LENGTH = {'minute': timedelta(minutes=1),
+              'hour': timedelta(hours=1),
+              'day': timedelta(days=1)}
+
+# how long the bins of a resolution are kept before pruning, the coarsest
+# resolution is kept forever
+KEEP_BINS = {'minute': timedelta(days=7),
+             'hour': timedelta(days=365)}
+
+
+def truncate(timestamp, resolution):
+    """
+    The start of the bin of the resolution containing the timestamp, this
+    is the Python equivalent of the date_trunc() SQL function.
+    """
+    if resolution == 'minute':
+        return timestamp.replace(second=0, microsecond=0)
+    elif resolution == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    elif resolution == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError("unknown resolution %s" % resolution)
+
+
+def last_bin(session, dataset, resolution):
+    """
+    The start of the latest bin of a resolution rolled up for the dataset,
+    or None if nothing has been rolled up yet.
+    """
+    return session.query(func.max(LightcurveRollup.bin_start)). \
+        join(Runningcatalog, LightcurveRollup.runcat_id == Runningcatalog.id). \
+        filter(Runningcatalog.dataset == dataset,
+               LightcurveRollup.resolution == resolution). \
+        scalar()
+
+
+def rollup_lightcurves(session, dataset, resolution, before):
+    """
+    Aggregate the lightcurves of a dataset into bins of the resolution.
+
+    Only complete bins, that start before the bin containing ``before``, are
+    rolled up, and only those after the latest bin that was rolled up
+    before. The rollups are therefore never updated, an image that arrives
+    for a bin that has already been rolled up is not included in it. Every
+    bin records the highest image id it includes, so prune_lightcurves()
+    can tell these images apart.
+
+    The averages follow the definitions of the runningcatalog_flux table, so
+    the bins can be combined the same way.
+
+    args:
+        session: A SQLAlchemy session
+        dataset: a dataset model object
+        resolution (str): one of RESOLUTIONS
+        before (datetime.datetime): roll up the bins before this timestamp
+
+    returns: a SQLAlchemy insert statement
+    """
+    a = aliased(Assocxtrsource, name='a_rollup')
+    e = aliased(Extractedsource, name='e_rollup')
+    i = aliased(Image, name='i_rollup')
+
+    end = truncate(before, resolution)
+    start = last_bin(session, dataset, resolution)
+
+    bin_start = func.date_trunc(resolution, i.taustart_ts)
+    f_peak_weight = 1 / (e.f_peak_err * e.f_peak_err)
+    f_int_weight = 1 / (e.f_int_err * e.f_int_err)
+
+    query = session.query(
+        a.runcat_id.label('runcat'),
+        i.band_id.label('band'),
+        i.stokes.label('stokes'),
+        literal(resolution).label('resolution'),
+        bin_start.label('bin_start'),
+        func.count(e.id).label('datapoints'),
+        func.max(i.id).label('last_image'),
+        func.avg(e.f_peak).label('avg_f_peak'),
+        func.avg(e.f_peak * e.f_peak).label('avg_f_peak_sq'),
+        func.avg(f_peak_weight).label('avg_f_peak_weight'),
+        func.avg(e.f_peak * f_peak_weight).label('avg_weighted_f_peak'),
+        func.avg(e.f_peak * e.f_peak * f_peak_weight).
+            label('avg_weighted_f_peak_sq'),
+        func.avg(e.f_int).label('avg_f_int'),
+        func.avg(e.f_int * e.f_int).label('avg_f_int_sq'),
+        func.avg(f_int_weight).label('avg_f_int_weight'),
+        func.avg(e.f_int * f_int_weight).label('avg_weighted_f_int'),
+        func.avg(e.f_int * e.f_int * f_int_weight).
+            label('avg_weighted_f_int_sq'),
+        func.max(e.f_int).label('max_f_int'),
+    ). \
+        select_from(a). \
+        join(e, a.xtrsrc_id == e.id). \
+        join(i, e.image_id == i.id). \
+        filter(i.dataset == dataset,
+               i.taustart_ts < end). \
+        group_by(a.runcat_id, i.band_id, i.stokes, bin_start)
+
+    if start is not None:
+        query = query.filter(i.taustart_ts >= start + BIN_LENGTH[resolution])
+
+    fields = [c['name'] for c in query.column_descriptions]
+    return insert(LightcurveRollup).from_select(names=fields, select=query)
+
+
+def prune_lightcurves(session, dataset, before):
+    """
+    Delete the measurements of the images of a dataset that started before
+    ``before``, if they have been rolled up at every resolution.
+
+    A measurement is rolled up if the bins of its runcat, band and stokes
+    that contain its image exist and include the image. Images get
+    increasing ids as they are stored, so an image that arrived after its
+    bin was rolled up has a higher id than the last image of the bin. Such
+    late measurements are kept, the lightcurve is then made up of the
+    rollups and the remaining measurements.
+
+    The latest assocxtrsource of every runcat and band is kept, since the
+    variability indices are stored on it, and so are the extracted sources
+    still referenced by a runningcatalog, newsource or a remaining
+    assocxtrsource. The bins of the finer resolutions that are older than
+    KEEP_BINS are deleted as well.
+
+    args:
+        session: A SQLAlchemy session
+        dataset: a dataset model object
+        before (datetime.datetime): prune the images before this timestamp
+
+    returns: a list of SQLAlchemy delete statements, to be executed in order
+    """
+    old_images = session.query(Image.id). \
+        filter(Image.dataset == dataset,
+               Image.taustart_ts < before)
+
+    a = aliased(Assocxtrsource, name='a_prune')
+    e = aliased(Extractedsource, name='e_prune')
+    i = aliased(Image, name='i_prune')
+    rolled_up = session.query(a.id). \
+        join(e, a.xtrsrc_id == e.id). \
+        join(i, e.image_id == i.id). \
+        filter(i.dataset == dataset,
+               i.taustart_ts < before)
+    for resolution in RESOLUTIONS:
+        r = aliased(LightcurveRollup, name='r_' + resolution)
+        rolled_up = rolled_up.join(r, and_(
+            r.runcat_id == a.runcat_id,
+            r.band_id == i.band_id,
+            r.stokes == i.stokes,
+            r.resolution == resolution,
+            r.bin_start == func.date_trunc(resolution, i.taustart_ts),
+            r.last_image_id >= i.id))
+
+    last_assocs = _last_assoc_per_band(session, dataset)
+    del_assocs = delete(Assocxtrsource). \
+        where(Assocxtrsource.id.in_(rolled_up.subquery()) &
+              ~Assocxtrsource.id.in_(session.query(last_assocs.c.assoc_id).
+                                     subquery()))
+
+    referenced = [
+        session.query(Runningcatalog.xtrsrc_id),
+        session.query(Newsource.trigger_xtrsrc_id),
+        session.query(Assocxtrsource.xtrsrc_id).
+            filter(Assocxtrsource.xtrsrc_id != None),
+    ]
+    condition = Extractedsource.image_id.in_(old_images.subquery())
+    for query in referenced:
+        condition &= ~Extractedsource.id.in_(query.subquery())
+    del_xtrsrcs = delete(Extractedsource).where(condition)
+
+    statements = [del_assocs, del_xtrsrcs]
+    runcats = session.query(Runningcatalog.id). \
+        filter(Runningcatalog.dataset == dataset)
+    for resolution, keep in sorted(KEEP_BINS.items()):
+        statements.append(delete(LightcurveRollup).where(
+            (LightcurveRollup.resolution == resolution) &
+            (LightcurveRollup.bin_start < before - keep) &
+            LightcurveRollup.runcat_id.in_(runcats.subquery())))
+    return statements
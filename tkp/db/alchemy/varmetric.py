@@ -9,7 +9,28 @@ from tkp.db.model import Assocxtrsource, Extractedsource, Runningcatalog,\
     Image, Newsource, Varmetric
 
 
-def _last_assoc_timestamps(session, dataset):
+def touched_runcats(session, images):
+    """
+    Get the runningcatalogs associated with an extracted source in one of
+    the images, these are the only ones for which the varmetrics change when
+    the images are processed.
+
+    args:
+        session (session): A SQLAlchemy session
+        images (list): image ids
+
+    returns: a SQLAlchemy subquery containing runcat ids
+    """
+    a = aliased(Assocxtrsource, name='a_touched')
+    e = aliased(Extractedsource, name='e_touched')
+    return session.query(a.runcat_id.label('runcat')). \
+        join(e, a.xtrsrc_id == e.id). \
+        filter(e.image_id.in_(images)). \
+        distinct(). \
+        subquery(name='touched_runcats')
+
+
+def _last_assoc_timestamps(session, dataset, runcats=None):
     """
     Get the timestamps of the latest assocxtrc per runningcatalog and band.
 
@@ -20,6 +41,8 @@ def _last_assoc_timestamps(session, dataset):
     args:
         session (session): A SQLAlchemy session
         dataset (Dataset): A SQLALchemy dataset model
+        runcats: optional subquery of runcat ids to restrict to, see
+                 touched_runcats()
 
     returns: a SQLAlchemy subquery containing  runcat id, timestamp, band id
     """
@@ -27,7 +50,7 @@ def _last_assoc_timestamps(session, dataset):
     e = aliased(Extractedsource, name='e_timestamps')
     r = aliased(Runningcatalog, name='r_timestamps')
     i = aliased(Image, name='i_timestamps')
-    return session.query(r.id.label('runcat'),
+    query = session.query(r.id.label('runcat'),
                          func.max(i.taustart_ts).label('max_time'),
                          i.band_id.label('band')
                          ). \
@@ -36,11 +59,13 @@ def _last_assoc_timestamps(session, dataset):
         join(e, a.xtrsrc_id == e.id). \
         join(i, i.id == e.image_id). \
         group_by(r.id, i.band_id). \
-        filter(i.dataset == dataset). \
-        subquery(name='last_assoc_timestamps')
+        filter(i.dataset == dataset)
+    if runcats is not None:
+        query = query.filter(r.id.in_(runcats))
+    return query.subquery(name='last_assoc_timestamps')
 
 
-def _last_assoc_per_band(session, dataset):
+def _last_assoc_per_band(session, dataset, runcats=None):
     """
     Get the ID's of the latest assocxtrc per runningcatalog and band.
 
@@ -49,10 +74,11 @@ def _last_assoc_per_band(session, dataset):
     args:
         session: SQLalchemy session objects
         dataset: tkp.db.model.dataset object
+        runcats: optional subquery of runcat ids to restrict to
 
     returns: SQLAlchemy subquery
     """
-    l = _last_assoc_timestamps(session, dataset)
+    l = _last_assoc_timestamps(session, dataset, runcats)
     a = aliased(Assocxtrsource, name='a_laids')
     e = aliased(Extractedsource, name='e_laids')
     i = aliased(Image, name='i_laids')
@@ -66,20 +92,21 @@ def _last_assoc_per_band(session, dataset):
         subquery(name='last_assoc_per_band')
 
 
-def _last_ts_fmax(session, dataset):
+def _last_ts_fmax(session, dataset, runcats=None):
     """
     Select peak flux per runcat at last timestep (over all bands)
 
     args:
         session: SQLalchemy session objects
         dataset: tkp.db.model.dataset object
+        runcats: optional subquery of runcat ids to restrict to
 
     returns: SQLAlchemy subquery
     """
     a = aliased(Assocxtrsource, name='a_lt')
     e = aliased(Extractedsource, name='e_lt')
 
-    subquery = _last_assoc_per_band(session, dataset)
+    subquery = _last_assoc_per_band(session, dataset, runcats)
     return session.query(a.runcat_id.label('runcat_id'),
                          func.max(e.f_int).label('max_flux')
                          ). \
@@ -115,13 +142,15 @@ def _newsrc_trigger(session, dataset):
         subquery(name='newsrc_trigger')
 
 
-def _combined(session, dataset):
+def _combined(session, dataset, runcats=None):
     """
 
     args:
         session (Session): SQLAlchemy session
         runcat (Runningcatalog):  Running catalog model object
         dataset (Dataset): Dataset model object
+        runcats: optional subquery of runcat ids to restrict to, see
+                 touched_runcats()
 
     return: a SQLALchemy subquery
     """
@@ -134,9 +163,9 @@ def _combined(session, dataset):
     agg_ex = aliased(Extractedsource, name='agg_ex')
 
     newsrc_trigger_query = _newsrc_trigger(session, dataset)
-    last_ts_fmax_query = _last_ts_fmax(session, dataset)
+    last_ts_fmax_query = _last_ts_fmax(session, dataset, runcats)
 
-    return session.query(
+    query = session.query(
         runcat.id.label('runcat'),
         runcat.wm_ra.label('ra'),
         runcat.wm_decl.label('decl'),
@@ -182,28 +211,34 @@ def _combined(session, dataset):
                  newsrc_trigger_query.c.sigma_rms_max,
                  newsrc_trigger_query.c.sigma_rms_min,
                  ). \
-        filter(runcat.dataset == dataset). \
-        subquery()
+        filter(runcat.dataset == dataset)
+    if runcats is not None:
+        query = query.filter(runcat.id.in_(runcats))
+    return query.subquery()
 
 
-def del_duplicate_varmetric(session, dataset):
+def del_duplicate_varmetric(session, dataset, runcats=None):
     """
     can't figure out how to update in a simple way, for now just delete
-    the updated rows. This code should be rewritten anyway when we make it
-    optional to specify a list of runcat entries to update
+    the updated rows, optionally only those of the runcats in the runcats
+    subquery.
     """
     del_varmetrics = session.query(Varmetric.id).\
         filter(Varmetric.runcat_id == Runningcatalog.id,
-               Runningcatalog.dataset == dataset).subquery()
-    return delete(Varmetric).where(Varmetric.id.in_(del_varmetrics))
+               Runningcatalog.dataset == dataset)
+    if runcats is not None:
+        del_varmetrics = del_varmetrics.filter(Varmetric.runcat_id.in_(runcats))
+    return delete(Varmetric).where(Varmetric.id.in_(del_varmetrics.subquery()))
 
 
-def store_varmetric(session, dataset):
+def store_varmetric(session, dataset, runcats=None):
     """
     Stores the augmented runningcatalog values in the varmetric table.
     args:
         session: A SQLAlchemy session
         dataset: a dataset model object
+        runcats: optional subquery of runcat ids, only store the values of
+                 these runcats, see touched_runcats()
 
     :return: a SQLAlchemy query
     """
@@ -211,7 +246,7 @@ def store_varmetric(session, dataset):
               'sigma_rms_max', 'sigma_rms_min', 'lightcurve_max',
               'lightcurve_avg', 'lightcurve_median']
 
-    subquery = _combined(session=session, dataset=dataset)
+    subquery = _combined(session=session, dataset=dataset, runcats=runcats)
 
     # only select the columns we are going to insert
     filtered = session.query(*fields).select_from(subquery)
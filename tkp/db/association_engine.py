@@ -0,0 +1,467 @@
+"""
+An in-process association engine.
+
+The default association (:func:`tkp.db.associations.associate_extracted_sources`)
+matches the extractions of an image against the running catalogue with a
+join on the ``runningcatalog`` and ``runningcatalog_flux`` tables, which grow
+with every image of the dataset. The :class:`AssociationEngine` keeps the
+active part of the running catalogue of a single dataset in memory instead:
+the weighted mean positions, the flux accumulators per band and the
+``forcedfits_count``. The sources are kept in a declination zone index, so
+finding the De Ruiter radius counterparts of an extraction only looks at the
+neighbouring zones.
+
+The engine computes the candidate pairs, the updated weighted means and the
+many-to-many flags, and writes these in one bulk insert into
+``temprunningcatalog``. From there on the regular SQL statements take care of
+the 1-to-1, 1-to-many, many-to-1 and new source cases, so both code paths
+produce identical results. Afterwards only the running catalogue rows touched
+by the image are read back to bring the engine in sync.
+"""
+import itertools
+import logging
+import math
+from collections import defaultdict
+
+import tkp.db
+from tkp.utility.coordinates import alpha_inflate
+
+logger = logging.getLogger(__name__)
+
+
+# columns of runningcatalog held in memory
+RUNCAT_COLUMNS = ('id', 'datapoints', 'wm_ra', 'wm_decl',
+                  'wm_uncertainty_ew', 'wm_uncertainty_ns',
+                  'avg_ra_err', 'avg_decl_err', 'avg_wra', 'avg_wdecl',
+                  'avg_weight_ra', 'avg_weight_decl', 'x', 'y', 'z',
+                  'forcedfits_count')
+
+# flux accumulators of runningcatalog_flux held in memory
+FLUX_COLUMNS = ('f_datapoints',
+                'avg_f_peak', 'avg_f_peak_sq', 'avg_f_peak_weight',
+                'avg_weighted_f_peak', 'avg_weighted_f_peak_sq',
+                'avg_f_int', 'avg_f_int_sq', 'avg_f_int_weight',
+                'avg_weighted_f_int', 'avg_weighted_f_int_sq')
+
+# the columns we fill in temprunningcatalog, in order
+TEMPRUNCAT_COLUMNS = ('runcat', 'xtrsrc', 'distance_arcsec', 'r', 'dataset',
+                      'band', 'stokes', 'datapoints', 'zone', 'wm_ra',
+                      'wm_decl', 'wm_uncertainty_ew', 'wm_uncertainty_ns',
+                      'avg_ra_err', 'avg_decl_err', 'avg_wra', 'avg_wdecl',
+                      'avg_weight_ra', 'avg_weight_decl', 'x', 'y', 'z',
+                      'inactive') + FLUX_COLUMNS
+
+_runcat_query = """\
+SELECT %s
+  FROM runningcatalog
+ WHERE dataset = %%(dataset)s
+   AND mon_src = FALSE
+   AND inactive = FALSE
+""" % ",".join(RUNCAT_COLUMNS)
+
+_flux_query = """\
+SELECT rf.runcat
+      ,rf.band
+      ,rf.stokes
+      ,%s
+  FROM runningcatalog_flux rf
+      ,runningcatalog rc
+ WHERE rf.runcat = rc.id
+   AND rc.dataset = %%(dataset)s
+   AND rc.mon_src = FALSE
+   AND rc.inactive = FALSE
+""" % ",".join("rf." + c for c in FLUX_COLUMNS)
+
+_image_query = """\
+SELECT i.dataset
+      ,i.band
+      ,i.stokes
+      ,i.rb_smaj
+  FROM image i
+ WHERE i.id = %(image_id)s
+"""
+
+# columns of extractedsource needed for the association
+EXTRACTION_COLUMNS = ('id', 'ra', 'decl', 'ra_err', 'decl_err',
+                      'uncertainty_ew', 'uncertainty_ns', 'x', 'y', 'z',
+                      'f_peak', 'f_peak_err', 'f_int', 'f_int_err')
+
+_extractions_query = """\
+SELECT %s
+  FROM extractedsource
+ WHERE image = %%(image_id)s
+""" % ",".join(EXTRACTION_COLUMNS)
+
+# runcats touched by the association of an image: the ones which were created
+# for its extractions and, formatted in as {matched}, the ones which were
+# matched. IN with a tuple instead of ANY with a list, which works on MonetDB
+# too, but needs a non-empty tuple.
+_touched_runcat_query = """\
+SELECT %s
+  FROM runningcatalog
+ WHERE dataset = %%(dataset)s
+   AND mon_src = FALSE
+   AND inactive = FALSE
+   AND (xtrsrc IN (SELECT id
+                     FROM extractedsource
+                    WHERE image = %%(image_id)s
+                  )
+        {matched}
+       )
+""" % ",".join(RUNCAT_COLUMNS)
+
+_matched_runcat_clause = "OR id IN %(runcats)s"
+
+_touched_flux_query = """\
+SELECT runcat
+      ,band
+      ,stokes
+      ,%s
+  FROM runningcatalog_flux
+ WHERE runcat IN %%(runcats)s
+""" % ",".join(FLUX_COLUMNS)
+
+_forced_fit_runcat_query = """\
+SELECT rc.id
+      ,rc.forcedfits_count
+  FROM runningcatalog rc
+      ,extractedsource x
+ WHERE x.image = %(image_id)s
+   AND x.ff_runcat = rc.id
+"""
+
+
+def _deruiter(rc, ra_diff, decl, uncertainty_ew, uncertainty_ns):
+    """
+    The De Ruiter radius between a runcat and an extraction, given the RA
+    difference between the two.
+    """
+    ra_term = ra_diff * math.cos(math.radians((rc['wm_decl'] + decl) / 2))
+    return math.sqrt(ra_term * ra_term /
+                     (rc['wm_uncertainty_ew'] ** 2 + uncertainty_ew ** 2) +
+                     (rc['wm_decl'] - decl) ** 2 /
+                     (rc['wm_uncertainty_ns'] ** 2 + uncertainty_ns ** 2))
+
+
+def _mod360(value):
+    """
+    Emulates MOD(CAST(value AS NUMERIC(11,8)), 360) of the association query.
+    """
+    return math.fmod(round(value, 8), 360)
+
+
+def _flag_many_to_many(pairs):
+    """
+    Works out which of the association pairs are the many-to-many ones to
+    drop, the same way as
+    :func:`tkp.db.associations._flag_many_to_many_tempruncat`.
+
+    args:
+        pairs (list): (runcat, xtrsrc, r) tuples
+    returns:
+        set: (runcat, xtrsrc) tuples to flag inactive
+    """
+    xtrsrc_count = defaultdict(int)
+    runcat_count = defaultdict(int)
+    for runcat, xtrsrc, _ in pairs:
+        xtrsrc_count[xtrsrc] += 1
+        runcat_count[runcat] += 1
+
+    multi_xtrsrc = set(x for x, n in xtrsrc_count.items() if n > 1)
+    multi_runcat = set(rc for rc, x, _ in pairs if x in multi_xtrsrc
+                       and runcat_count[rc] > 1)
+
+    candidates = [(rc, x, r) for rc, x, r in pairs
+                  if rc in multi_runcat and x in multi_xtrsrc]
+    min_r = {}
+    for _, xtrsrc, r in candidates:
+        min_r[xtrsrc] = min(r, min_r.get(xtrsrc, r))
+    return set((rc, x) for rc, x, r in candidates if min_r[x] < r)
+
+
+class AssociationEngine(object):
+    """
+    Keeps the active running catalogue of a dataset in memory for the source
+    association.
+
+    Pass the engine to
+    :func:`tkp.db.associations.associate_extracted_sources`, and call
+    :meth:`update_forced_fits` after the forced fits of an image are
+    associated. If something goes wrong halfway an association the engine
+    reloads the dataset from the database before the next image.
+
+    args:
+        dataset_id (int): the dataset to associate
+    """
+    def __init__(self, dataset_id):
+        self.dataset_id = dataset_id
+        self.runcats = {}
+        self.fluxes = defaultdict(dict)
+        self.zones = defaultdict(set)
+        self._matched = None
+        self._stale = True
+
+    def load(self):
+        """
+        (Re)load the running catalogue of the dataset from the database.
+        """
+        self.runcats.clear()
+        self.fluxes.clear()
+        self.zones.clear()
+        args = {'dataset': self.dataset_id}
+        cursor = tkp.db.execute(_runcat_query, args)
+        for row in cursor.fetchall():
+            self._store_runcat(row)
+        cursor = tkp.db.execute(_flux_query, args)
+        for row in cursor.fetchall():
+            self._store_flux(row)
+        self._stale = False
+        logger.debug("loaded {} running catalogue sources of dataset {} in "
+                     "memory".format(len(self.runcats), self.dataset_id))
+
+    def _store_runcat(self, row):
+        rc = dict(zip(RUNCAT_COLUMNS, row))
+        self._remove_runcat(rc['id'])
+        self.runcats[rc['id']] = rc
+        self.zones[int(math.floor(rc['wm_decl']))].add(rc['id'])
+
+    def _remove_runcat(self, runcat_id):
+        rc = self.runcats.pop(runcat_id, None)
+        self.fluxes.pop(runcat_id, None)
+        if rc:
+            self.zones[int(math.floor(rc['wm_decl']))].discard(runcat_id)
+
+    def _store_flux(self, row):
+        runcat_id, band, stokes = row[:3]
+        self.fluxes[runcat_id][(band, stokes)] = dict(zip(FLUX_COLUMNS,
+                                                          row[3:]))
+
+    def candidates(self, xtr, limit, across_meridian):
+        """
+        Find the runcats within limit degrees of an extraction.
+
+        args:
+            xtr (dict): the extractedsource
+            limit (float): the search radius in degrees
+            across_meridian (bool): the image crosses RA 0/360, don't use
+                                    the RA range to prune the candidates.
+        returns:
+            generator: yielding runcat dicts
+        """
+        decl_min = xtr['decl'] - limit
+        decl_max = xtr['decl'] + limit
+        ra_range = alpha_inflate(limit, xtr['decl'])
+        min_dot = math.cos(math.radians(limit))
+        for zone in range(int(math.floor(decl_min)),
+                          int(math.floor(decl_max)) + 1):
+            for runcat_id in self.zones.get(zone, ()):
+                rc = self.runcats[runcat_id]
+                if not decl_min <= rc['wm_decl'] <= decl_max:
+                    continue
+                if not across_meridian and \
+                        abs(rc['wm_ra'] - xtr['ra']) > ra_range:
+                    continue
+                dot = rc['x'] * xtr['x'] + rc['y'] * xtr['y'] + \
+                    rc['z'] * xtr['z']
+                if dot > min_dot:
+                    yield rc
+
+    def associate(self, rc, xtr, image, across_meridian):
+        """
+        Compute the temprunningcatalog row for a runcat - extractedsource
+        pair, see :func:`tkp.db.associations._insert_temprunningcatalog`.
+
+        returns:
+            dict: the row, without the inactive column
+        """
+        n = rc['datapoints']
+        weight_ew = 1 / (xtr['uncertainty_ew'] * xtr['uncertainty_ew'])
+        weight_ns = 1 / (xtr['uncertainty_ns'] * xtr['uncertainty_ns'])
+        sum_weight_ra = n * rc['avg_weight_ra'] + weight_ew
+        sum_weight_decl = n * rc['avg_weight_decl'] + weight_ns
+
+        wrapped = across_meridian and (rc['wm_ra'] < 90 or rc['wm_ra'] > 270)
+        if wrapped:
+            # work on the other side of the sphere, away from RA 0
+            rc_ra = _mod360(rc['wm_ra'] + 180)
+            xtr_ra = _mod360(xtr['ra'] + 180)
+            r = _deruiter(rc, rc_ra - xtr_ra, xtr['decl'],
+                          xtr['uncertainty_ew'], xtr['uncertainty_ns'])
+            wm_ra = (n * rc['avg_weight_ra'] * rc_ra + xtr_ra * weight_ew) / \
+                sum_weight_ra - 180
+            a = (n * rc['avg_weight_ra'] * rc_ra + xtr_ra * weight_ew -
+                 n * rc['avg_weight_ra'] * 180 - 180 * weight_ew) / (n + 1)
+            b = 360 * sum_weight_ra / (n + 1)
+            avg_wra = a - b * math.floor(a / b)
+        else:
+            r = _deruiter(rc, rc['wm_ra'] - xtr['ra'], xtr['decl'],
+                          xtr['uncertainty_ew'], xtr['uncertainty_ns'])
+            wm_ra = (n * rc['avg_wra'] + xtr['ra'] * weight_ew) / sum_weight_ra
+            avg_wra = (n * rc['avg_wra'] + xtr['ra'] * weight_ew) / (n + 1)
+
+        if across_meridian and wm_ra < 0:
+            wm_ra = wm_ra + 360 if abs(wm_ra) > 8e-14 else 0.0
+
+        wm_decl = (n * rc['avg_wdecl'] + xtr['decl'] * weight_ns) / \
+            sum_weight_decl
+        distance = math.sqrt((rc['x'] - xtr['x']) ** 2 +
+                             (rc['y'] - xtr['y']) ** 2 +
+                             (rc['z'] - xtr['z']) ** 2)
+
+        row = {
+            'runcat': rc['id'],
+            'xtrsrc': xtr['id'],
+            'distance_arcsec': 3600 * math.degrees(2 * math.asin(distance / 2)),
+            'r': r,
+            'dataset': image['dataset'],
+            'band': image['band'],
+            'stokes': image['stokes'],
+            'datapoints': n + 1,
+            'zone': int(math.floor(wm_decl)),
+            'wm_ra': wm_ra,
+            'wm_decl': wm_decl,
+            'wm_uncertainty_ew': math.sqrt(1 / sum_weight_ra),
+            'wm_uncertainty_ns': math.sqrt(1 / sum_weight_decl),
+            'avg_ra_err': (n * rc['avg_ra_err'] + xtr['ra_err']) / (n + 1),
+            'avg_decl_err': (n * rc['avg_decl_err'] + xtr['decl_err']) / (n + 1),
+            'avg_wra': avg_wra,
+            'avg_wdecl': (n * rc['avg_wdecl'] + xtr['decl'] * weight_ns) / (n + 1),
+            'avg_weight_ra': sum_weight_ra / (n + 1),
+            'avg_weight_decl': sum_weight_decl / (n + 1),
+            'x': math.cos(math.radians(wm_decl)) * math.cos(math.radians(wm_ra)),
+            'y': math.cos(math.radians(wm_decl)) * math.sin(math.radians(wm_ra)),
+            'z': math.sin(math.radians(wm_decl)),
+        }
+        flux = self.fluxes[rc['id']].get((image['band'], image['stokes']))
+        row.update(self._accumulate_flux(flux, xtr))
+        return row
+
+    @staticmethod
+    def _accumulate_flux(flux, xtr):
+        """
+        Add the fluxes of an extraction to the flux accumulators of a runcat.
+        """
+        new = {}
+        n = flux['f_datapoints'] if flux else 0
+        for kind in ('peak', 'int'):
+            value = xtr['f_' + kind]
+            weight = 1 / (xtr['f_%s_err' % kind] * xtr['f_%s_err' % kind])
+            point = {
+                'avg_f_%s' % kind: value,
+                'avg_f_%s_sq' % kind: value * value,
+                'avg_f_%s_weight' % kind: weight,
+                'avg_weighted_f_%s' % kind: value * weight,
+                'avg_weighted_f_%s_sq' % kind: value * value * weight,
+            }
+            for key, val in point.items():
+                if flux:
+                    val = (n * flux[key] + val) / (n + 1)
+                new[key] = val
+        new['f_datapoints'] = n + 1
+        return new
+
+    def insert_temprunningcatalog(self, image_id, deRuiter_r,
+                                  beamwidths_limit=1):
+        """
+        Fill temprunningcatalog with the association candidates of an image,
+        with the many-to-many associations already flagged inactive.
+
+        This replaces :func:`tkp.db.associations._insert_temprunningcatalog`
+        and :func:`tkp.db.associations._flag_many_to_many_tempruncat`.
+
+        returns:
+            int: the number of inserted association pairs
+        """
+        # imported here, since the associations module imports us
+        from tkp.db.associations import _check_meridian_wrap
+
+        if self._stale:
+            self.load()
+        # until update() is done we can't trust our state
+        self._stale = True
+
+        cursor = tkp.db.execute(_image_query, {'image_id': image_id})
+        image = dict(zip(('dataset', 'band', 'stokes', 'rb_smaj'),
+                         cursor.fetchone()))
+        if image['dataset'] != self.dataset_id:
+            raise ValueError("image %s is not part of dataset %s" %
+                             (image_id, self.dataset_id))
+        across_meridian = _check_meridian_wrap(image_id)['q_across']
+        limit = beamwidths_limit * image['rb_smaj']
+
+        cursor = tkp.db.execute(_extractions_query, {'image_id': image_id})
+        rows = []
+        for values in cursor.fetchall():
+            xtr = dict(zip(EXTRACTION_COLUMNS, values))
+            for rc in self.candidates(xtr, limit, across_meridian):
+                row = self.associate(rc, xtr, image, across_meridian)
+                if row['r'] < deRuiter_r:
+                    rows.append(row)
+
+        inactive = _flag_many_to_many([(row['runcat'], row['xtrsrc'], row['r'])
+                                       for row in rows])
+        for row in rows:
+            row['inactive'] = (row['runcat'], row['xtrsrc']) in inactive
+        self._matched = list(set(row['runcat'] for row in rows))
+
+        if rows:
+            placeholder_per_row = '(' + ','.join(['%s'] * len(TEMPRUNCAT_COLUMNS)) + ')'
+            query = "INSERT INTO temprunningcatalog (%s) VALUES %s" % (
+                ",".join(TEMPRUNCAT_COLUMNS),
+                ",".join([placeholder_per_row] * len(rows)))
+            values = itertools.chain.from_iterable(
+                [row[c] for c in TEMPRUNCAT_COLUMNS] for row in rows)
+            tkp.db.execute(query, tuple(values), commit=True)
+        logger.debug("found {} association candidates in memory for image "
+                     "{}".format(len(rows), image_id))
+        return len(rows)
+
+    def update(self, image_id):
+        """
+        Sync the engine with the outcome of the association of an image.
+
+        Reads back the runcats that were matched or created by the
+        association, and forgets the ones that were replaced by 1-to-many
+        associations.
+        """
+        matched = self._matched or []
+        args = {'dataset': self.dataset_id, 'image_id': image_id,
+                'runcats': tuple(matched)}
+        query = _touched_runcat_query.format(
+            matched=_matched_runcat_clause if matched else "")
+        cursor = tkp.db.execute(query, args)
+        touched = []
+        for row in cursor.fetchall():
+            self._store_runcat(row)
+            touched.append(row[0])
+        for runcat_id in set(matched) - set(touched):
+            self._remove_runcat(runcat_id)
+
+        if touched:
+            cursor = tkp.db.execute(_touched_flux_query,
+                                    {'runcats': tuple(touched)})
+            for row in cursor.fetchall():
+                self._store_flux(row)
+        self._matched = None
+        self._stale = False
+
+    def update_forced_fits(self, image_id):
+        """
+        Sync the engine after the null detections of an image were associated,
+        which changes the flux accumulators and the forcedfits_count of the
+        runcats involved.
+        """
+        if self._stale:
+            return
+        cursor = tkp.db.execute(_forced_fit_runcat_query,
+                                {'image_id': image_id})
+        runcat_ids = []
+        for runcat_id, count in cursor.fetchall():
+            if runcat_id in self.runcats:
+                self.runcats[runcat_id]['forcedfits_count'] = count
+                runcat_ids.append(runcat_id)
+        if runcat_ids:
+            cursor = tkp.db.execute(_touched_flux_query,
+                                    {'runcats': tuple(runcat_ids)})
+            for row in cursor.fetchall():
+                self._store_flux(row)
@@ -5,13 +5,15 @@ deal with source association.
 import logging
 import tkp.db
 from sqlalchemy.exc import IntegrityError
+from tkp.db.generic import pixel_condition
+from tkp.utility.coordinates import sky_pixel_ranges
 
 
 logger = logging.getLogger(__name__)
 
 
 def associate_extracted_sources(image_id, deRuiter_r, beamwidths_limit=1,
-                                new_source_sigma_margin=3):
+                                new_source_sigma_margin=3, engine=None):
     """
     Associate extracted sources with sources detected in the running
     catalog.
@@ -21,6 +23,10 @@ def associate_extracted_sources(image_id, deRuiter_r, beamwidths_limit=1,
 
     The dimensionless distance between two sources is given by the
     "De Ruiter radius", see Chapters 2 & 3 of Scheers' thesis.
+
+    If an :class:`tkp.db.association_engine.AssociationEngine` is given the
+    association candidates are found in memory instead of with a query on the
+    running catalog.
     """
 
     logger.debug("Using a De Ruiter radius of %s" % (deRuiter_r,))
@@ -35,25 +41,59 @@ def associate_extracted_sources(image_id, deRuiter_r, beamwidths_limit=1,
     #| which may be matching one of the following cases:    |
     #| many-to-many, many-to-one, one-to-many, one-to-many  |
     #+------------------------------------------------------+
-    mw = _check_meridian_wrap(image_id)
-    _insert_temprunningcatalog(image_id, deRuiter_r, beamwidths_limit, mw)
+    if engine:
+        # the engine also flags the many-to-many associations
+        engine.insert_temprunningcatalog(image_id, deRuiter_r,
+                                         beamwidths_limit)
+    else:
+        mw = _check_meridian_wrap(image_id)
+
+    # All statements from here on don't need results from the database, they
+    # are sent as one script and run in a single transaction.
+    database = tkp.db.Database()
+    try:
+        with database.script() as script:
+            if not engine:
+                _insert_temprunningcatalog(image_id, deRuiter_r,
+                                           beamwidths_limit, mw)
+                _process_many_to_many()
+            _process_associations(image_id, new_source_sigma_margin)
+    except IntegrityError as e:
+        logger.error("Error caught associating image %s - possible "
+                     "'IntegrityError'. See Issue #4778. Will now re-raise."
+                     % image_id)
+        raise e
+
+    if script.counts is not None:
+        logger.debug("Association of image %s affected: %s" % (image_id,
+            ', '.join("%s %s" % (label, count) for label, count in
+                      zip(script.labels(), script.counts) if count)))
+
+    if engine:
+        engine.update(image_id)
+
+
+def _process_many_to_many():
     #+------------------------------------------------------+
     #| Here we process (flag) the many-to-many associations.|
     #+------------------------------------------------------+
-    database = tkp.db.Database()
+    # Because of the nested complexity of this query its cost explodes
+    # when temprunningcatalog contains dead rows. On postgresql the table
+    # is a connection private temporary table which is truncated before
+    # every association (see _empty_temprunningcatalog), so it only holds
+    # the rows just inserted. Autovacuum never analyzes temporary tables,
+    # so we give the planner statistics ourselves.
+    if tkp.db.Database().engine == 'postgresql':
+        tkp.db.execute("ANALYZE temprunningcatalog", commit=True)
 
-    # Since the _flag_many_to_many_tempruncat uses the temprunningcatalog table
-    # as a temporary use space the table will receive many writes and updates.
-    # On postgresql for speed up reasons rows are not directly deleted, but
-    # marked for deletion and eventually deleted by an auto vacuum process.
-    # Because of the nested complexity of this query it may happen the
-    # computational complexity of the query explodes, resulting in massive
-    # slowdowns. To make sure the temprunningcatalog table doesn't contain dead
-    # rows we force a manual vacuum here.
-    database.vacuum('temprunningcatalog')
-
-    # _process_many_to_many()
     _flag_many_to_many_tempruncat()
+
+
+def _process_associations(image_id, new_source_sigma_margin):
+    """
+    Process the association candidates in temprunningcatalog, after the
+    many-to-many associations have been flagged.
+    """
     #+------------------------------------------------------+
     #| After this, the assocs have been reduced to many-to-1|
     #| which are treated identical as 1-to-1, and 1-to-many.|
@@ -62,13 +102,7 @@ def associate_extracted_sources(image_id, deRuiter_r, beamwidths_limit=1,
     #+------------------------------------------------------+
     #| Here we process the one-to-many associations.        |
     #+------------------------------------------------------+
-    try:
-        _insert_1_to_many_runcat()
-    except IntegrityError as e:
-        logger.error("Error caught around _insert_1_to_many_runcat - "
-                 "possible 'IntegrityError'. See Issue #4778. Will now re-raise.")
-        raise e
-
+    _insert_1_to_many_runcat()
     _flag_1_to_many_inactive_runcat()
 
     _insert_1_to_many_runcat_flux()
@@ -87,6 +121,9 @@ def associate_extracted_sources(image_id, deRuiter_r, beamwidths_limit=1,
     _insert_1_to_many_varmetric()
     _delete_1_to_many_inactive_varmetric()
 
+    _insert_1_to_many_rollup()
+    _delete_1_to_many_inactive_rollup()
+
     _flag_1_to_many_inactive_tempruncat()
 
     #+-----------------------------------------------------+
@@ -95,12 +132,8 @@ def associate_extracted_sources(image_id, deRuiter_r, beamwidths_limit=1,
     # _process_1_to_1()
     _insert_1_to_1_assoc()
     _update_1_to_1_runcat()
-    n_updated_rf = _update_1_to_1_runcat_flux()  # update flux in existing band
-    if n_updated_rf:
-        logger.debug("Updated 1-to-1 fluxes for %s sources" % n_updated_rf)
-    n_new_rf = _insert_1_to_1_runcat_flux()  # insert flux for new band
-    if n_new_rf:
-        logger.debug("Inserted new fluxes for %s sources" % n_new_rf)
+    _update_1_to_1_runcat_flux()  # update flux in existing band
+    _insert_1_to_1_runcat_flux()  # insert flux for new band
     #+-------------------------------------------------------+
     #| Here we take care of the extracted sources that could |
     #| not be associated with any runningcatalog source      |
@@ -168,7 +201,8 @@ WHERE image = %(imgid)s
 """
 
     qry_params = {'imgid':image_id}
-    cursor = tkp.db.execute(query, qry_params, commit=True)
+    cursor = tkp.db.execute(query, qry_params, commit=True,
+                            name='assoc_delete_bad_blind_extractions')
     n_deleted = cursor.rowcount
     if n_deleted:
         logger.warn("Removed %s bad blind extractions for image %s"
@@ -182,8 +216,16 @@ def _empty_temprunningcatalog():
 
     Initialize the temporary table temprunningcatalog which contains
     the current observed sources.
+
+    On postgresql temprunningcatalog is replaced by a temporary table private
+    to the database connection, see
+    :meth:`tkp.db.database.Database.temporary_table`, which is truncated
+    rather than deleted from.
     """
-    query = "DELETE FROM temprunningcatalog"
+    if tkp.db.Database().temporary_table('temprunningcatalog'):
+        query = "TRUNCATE temprunningcatalog"
+    else:
+        query = "DELETE FROM temprunningcatalog"
     tkp.db.execute(query, commit=True)
 
 
@@ -229,6 +271,16 @@ def _check_meridian_wrap(image_id):
     but are merely reported to notice the search area.
     The cross-meridian association query uses the cartesian dot product,
     to get the search area.
+
+    To restrict the association to the runningcatalog sources around the
+    image, we also return:
+
+    centre_ra, centre_decl: the centre of the extraction region
+
+    xtr_distance: the largest distance (in degrees) of an extracted source
+                  of the image to the centre, NULL if there are none
+
+    rb_smaj:      the restoring beam semi-major axis of the image
     """
 
     meridian_wrap_query = """\
@@ -271,13 +323,24 @@ SELECT CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0 OR
                       ELSE NULL
                  END
        END AS ra_max2
+      ,s.centre_ra
+      ,s.centre_decl
+      ,(SELECT MAX(DEGREES(2 * ASIN(SQRT( (x.x - s.x) * (x.x - s.x)
+                                        + (x.y - s.y) * (x.y - s.y)
+                                        + (x.z - s.z) * (x.z - s.z)
+                                        ) / 2)))
+          FROM extractedsource x
+         WHERE x.image = i.id
+       ) AS xtr_distance
+      ,i.rb_smaj
   FROM image i
       ,skyregion s
  WHERE i.skyrgn = s.id
    AND i.id = %(image_id)s
 """
     args = {'image_id': image_id}
-    cursor = tkp.db.execute(meridian_wrap_query, args, commit=True)
+    cursor = tkp.db.execute(meridian_wrap_query, args, commit=True,
+                            name='assoc_check_meridian_wrap')
     results = zip(*cursor.fetchall())
 
     if len(results) != 0:
@@ -288,6 +351,10 @@ SELECT CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0 OR
         ra_max1 = results[4]
         ra_min2 = results[5]
         ra_max2 = results[6]
+        centre_ra = results[7]
+        centre_decl = results[8]
+        xtr_distance = results[9]
+        rb_smaj = results[10]
         if len(q_across) != 1:
             raise ValueError("More than one FoVs for image '%s'" % image_id)
     else:
@@ -300,7 +367,11 @@ SELECT CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0 OR
         'ra_min1': ra_min1[0],
         'ra_max1': ra_max1[0],
         'ra_min2': ra_min2[0],
-        'ra_max2': ra_max2[0]
+        'ra_max2': ra_max2[0],
+        'centre_ra': centre_ra[0],
+        'centre_decl': centre_decl[0],
+        'xtr_distance': xtr_distance[0],
+        'rb_smaj': rb_smaj[0]
     }
 
 
@@ -333,6 +404,12 @@ def _insert_temprunningcatalog(image_id, deRuiter_r, beamwidths_limit,
 
     NOTE: Beware of the extra condition on x0.image in the WHERE clause,
     preventing the query to grow exponentially in response time
+
+    The runningcatalog sources are first restricted to the sky pixels
+    around the extracted sources of the image (see
+    :func:`tkp.utility.coordinates.sky_pixel_ranges`), so they are found
+    with range scans on the pixel index instead of a scan of the
+    declination band. The pixel ranges wrap around the meridian.
     """
 
     # The cross-meridian differs slightly from the normal association query.
@@ -564,6 +641,7 @@ INSERT INTO temprunningcatalog
              AND x0.image = %(image_id)s
              AND i0.dataset = rc0.dataset
              AND rc0.mon_src = FALSE
+             AND {pixels}
              AND rc0.zone BETWEEN CAST(FLOOR(x0.decl - %(beamwidths_limit)s * i0.rb_smaj) as INTEGER)
                               AND CAST(FLOOR(x0.decl + %(beamwidths_limit)s * i0.rb_smaj) as INTEGER)
              AND rc0.wm_decl BETWEEN x0.decl - %(beamwidths_limit)s * i0.rb_smaj
@@ -770,6 +848,7 @@ INSERT INTO temprunningcatalog
              AND x0.image = %(image_id)s
              AND i0.dataset = rc0.dataset
              AND rc0.mon_src = FALSE
+             AND {pixels}
              AND rc0.zone BETWEEN CAST(FLOOR(x0.decl - %(beamwidths_limit)s * i0.rb_smaj) AS INTEGER)
                               AND CAST(FLOOR(x0.decl + %(beamwidths_limit)s * i0.rb_smaj) AS INTEGER)
              AND rc0.wm_decl BETWEEN x0.decl - %(beamwidths_limit)s * i0.rb_smaj
@@ -794,6 +873,16 @@ INSERT INTO temprunningcatalog
         logger.debug("Search across 0/360 meridian: %s" % meridian_wrap)
         query = q_across_ra0
 
+    if meridian_wrap['xtr_distance'] is None:
+        # no extracted sources, so nothing to match
+        ranges = []
+    else:
+        ranges = sky_pixel_ranges(
+            meridian_wrap['centre_ra'], meridian_wrap['centre_decl'],
+            meridian_wrap['xtr_distance'] +
+            beamwidths_limit * meridian_wrap['rb_smaj'])
+    query = query.format(pixels=pixel_condition('rc0.pixel', ranges))
+
     args = {'image_id': image_id, 'deRuiter': deRuiter_r,
             'beamwidths_limit' : beamwidths_limit}
     tkp.db.execute(query, args, commit=True)
@@ -895,6 +984,7 @@ INSERT INTO runningcatalog
   ,dataset
   ,datapoints
   ,zone
+  ,pixel
   ,wm_ra
   ,wm_decl
   ,wm_uncertainty_ew
@@ -913,6 +1003,7 @@ INSERT INTO runningcatalog
         ,dataset
         ,datapoints
         ,zone
+        ,sky_pixel(wm_ra, wm_decl)
         ,wm_ra
         ,wm_decl
         ,wm_uncertainty_ew
@@ -1267,12 +1358,87 @@ DELETE
                        HAVING COUNT(*) > 1
                     )
 """
-    cursor = tkp.db.execute(query, commit=True)
-    ins = cursor.rowcount
-    if ins > 0:
-        logger.debug(
-            "delete_1_to_many_inactive_varmetric "
-            "affected {} rows".format(cursor.rowcount))
+    tkp.db.execute(query, commit=True)
+
+
+def _insert_1_to_many_rollup():
+    """Copy the lightcurve rollups of the old runcat to the new runcats
+
+    The rolled up bins are part of the lightcurve of every source that
+    splits off the old runcat, just like the basepoint assocxtrsources.
+    """
+    query = """\
+INSERT INTO lightcurve_rollup
+  (runcat
+  ,band
+  ,stokes
+  ,resolution
+  ,bin_start
+  ,datapoints
+  ,last_image
+  ,avg_f_peak
+  ,avg_f_peak_sq
+  ,avg_f_peak_weight
+  ,avg_weighted_f_peak
+  ,avg_weighted_f_peak_sq
+  ,avg_f_int
+  ,avg_f_int_sq
+  ,avg_f_int_weight
+  ,avg_weighted_f_int
+  ,avg_weighted_f_int_sq
+  ,max_f_int
+  )
+  SELECT r.id as new_runcat_id
+        ,lr.band
+        ,lr.stokes
+        ,lr.resolution
+        ,lr.bin_start
+        ,lr.datapoints
+        ,lr.last_image
+        ,lr.avg_f_peak
+        ,lr.avg_f_peak_sq
+        ,lr.avg_f_peak_weight
+        ,lr.avg_weighted_f_peak
+        ,lr.avg_weighted_f_peak_sq
+        ,lr.avg_f_int
+        ,lr.avg_f_int_sq
+        ,lr.avg_f_int_weight
+        ,lr.avg_weighted_f_int
+        ,lr.avg_weighted_f_int_sq
+        ,lr.max_f_int
+    FROM (SELECT runcat as old_runcat_id
+            FROM temprunningcatalog
+           WHERE inactive = FALSE
+          GROUP BY runcat
+          HAVING COUNT(*) > 1
+         ) one_to_many
+        ,temprunningcatalog tmprc
+        ,runningcatalog r
+        ,lightcurve_rollup lr
+   WHERE tmprc.runcat = one_to_many.old_runcat_id
+     AND tmprc.inactive = FALSE
+     AND lr.runcat = one_to_many.old_runcat_id
+     AND r.xtrsrc = tmprc.xtrsrc
+"""
+    tkp.db.execute(query, commit=True)
+
+
+def _delete_1_to_many_inactive_rollup():
+    """Delete the lightcurve rollups of the old runcat
+
+    They have been copied to the new runcats by _insert_1_to_many_rollup().
+    """
+    query = """\
+DELETE
+    FROM lightcurve_rollup
+    WHERE runcat IN (SELECT runcat
+                       FROM temprunningcatalog
+                       WHERE inactive = FALSE
+                       GROUP BY runcat
+                       HAVING COUNT(*) > 1
+                    )
+"""
+    tkp.db.execute(query, commit=True)
 
 
 def _delete_1_to_many_inactive_assocskyrgn():
@@ -1422,7 +1588,7 @@ INSERT INTO assocxtrsource
   )
   SELECT t0.runcat
         ,t0.xtrsrc
-        ,%(type)s
+        ,CAST(%(type)s AS SMALLINT)
         ,t0.distance_arcsec
         ,t0.r
         ,t0.v_int_inter / t0.avg_f_int
@@ -1467,7 +1633,8 @@ def _insert_1_to_1_assoc():
     We also calculate the variability indices at the timestamp of the
     the current image.
     """
-    tkp.db.execute(ONE_TO_ONE_ASSOC_QUERY, {'type': 3}, commit=True)
+    tkp.db.execute(ONE_TO_ONE_ASSOC_QUERY, {'type': 3}, commit=True,
+                   name='one_to_one_assoc')
 
 
 def _update_1_to_1_runcat():
@@ -1484,6 +1651,11 @@ def _update_1_to_1_runcat():
                         WHERE temprunningcatalog.runcat = runningcatalog.id
                           AND temprunningcatalog.inactive = FALSE
                       )
+              ,pixel = (SELECT sky_pixel(wm_ra, wm_decl)
+                          FROM temprunningcatalog
+                         WHERE temprunningcatalog.runcat = runningcatalog.id
+                          AND temprunningcatalog.inactive = FALSE
+                       )
               ,wm_ra = (SELECT wm_ra
                           FROM temprunningcatalog
                          WHERE temprunningcatalog.runcat = runningcatalog.id
@@ -1556,7 +1728,7 @@ def _update_1_to_1_runcat():
                           AND temprunningcatalog.inactive = FALSE
                       )
 """
-    tkp.db.execute(query, commit=True)
+    tkp.db.execute(query, commit=True, name='assoc_update_1_to_1_runcat')
 
 def _update_1_to_1_runcat_flux():
     """Updates the fluxes in runningcatalog_flux of an existing band
@@ -1564,6 +1736,9 @@ def _update_1_to_1_runcat_flux():
 
     If the runcat, band, stokes entry does exist in runcat_flux,
     it will be updated with the values from tempruncat.
+
+    Returns the number of updated rows, or None if the query was queued in
+    a script.
     """
     query = """\
 UPDATE runningcatalog_flux
@@ -1653,7 +1828,8 @@ UPDATE runningcatalog_flux
                   AND temprunningcatalog.f_datapoints > 1
               )
 """
-    cursor = tkp.db.execute(query, commit=True)
+    cursor = tkp.db.execute(query, commit=True,
+                            name='assoc_update_1_to_1_runcat_flux')
     return cursor.rowcount
 
 
@@ -1668,6 +1844,8 @@ def _insert_1_to_1_runcat_flux():
     but not in the current band, so there does not exist an entry
     for this band.
 
+    Returns the number of inserted rows, or None if the query was queued in
+    a script.
     """
 
     query = """\
@@ -1705,7 +1883,8 @@ INSERT INTO runningcatalog_flux
    WHERE inactive = FALSE
      AND f_datapoints=1
 """
-    cursor = tkp.db.execute(query, commit=True)
+    cursor = tkp.db.execute(query, commit=True,
+                            name='assoc_insert_1_to_1_runcat_flux')
     return cursor.rowcount
 
 
@@ -1728,6 +1907,7 @@ INSERT INTO runningcatalog
   ,dataset
   ,datapoints
   ,zone
+  ,pixel
   ,wm_ra
   ,wm_decl
   ,avg_ra_err
@@ -1746,6 +1926,7 @@ INSERT INTO runningcatalog
         ,new_src.dataset
         ,new_src.datapoints
         ,new_src.zone
+        ,new_src.pixel
         ,new_src.wm_ra
         ,new_src.wm_decl
         ,new_src.avg_ra_err
@@ -1763,6 +1944,7 @@ INSERT INTO runningcatalog
                 ,i0.dataset
                 ,1 AS datapoints
                 ,x0.zone
+                ,x0.pixel
                 ,x0.ra AS wm_ra
                 ,x0.decl AS wm_decl
                 ,x0.ra_err AS avg_ra_err
@@ -1786,10 +1968,7 @@ INSERT INTO runningcatalog
          ON new_src.xtrsrc = tmprc.xtrsrc
    WHERE tmprc.xtrsrc IS NULL
 """
-    cursor = tkp.db.execute(query, (image_id,), True)
-    ins = cursor.rowcount
-    if ins > 0:
-        logger.debug("Added %s new sources to runningcatalog" % ins)
+    tkp.db.execute(query, (image_id,), True)
 
 
 
@@ -2116,10 +2295,7 @@ INSERT INTO newsource
 """
     params = {'image_id': image_id,
               'sigma_margin': new_source_sigma_margin}
-    cursor = tkp.db.execute(query, params, commit=True)
-    ins = cursor.rowcount
-    if ins > 0:
-        logger.debug("Added %s new sources to newsource table" % (ins,))
+    tkp.db.execute(query, params, commit=True)
 
 
 def _update_ff_runcat_extractedsource():
@@ -2136,10 +2312,7 @@ UPDATE extractedsource
                   AND runningcatalog.inactive = TRUE
               )
 """
-    cursor = tkp.db.execute(query, commit=True)
-    cnt = cursor.rowcount
-    if cnt > 0:
-        logger.debug("Unset ff_runcat for %s extractedsources" % cnt)
+    tkp.db.execute(query, commit=True)
 
 def _delete_inactive_runcat():
     """Delete the one-to-many associations from temprunningcatalog,
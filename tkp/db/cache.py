@@ -0,0 +1,85 @@
+"""
+In-process caches of the rows of a dataset that rarely change while it is
+processed, like the frequency bands and skyregions, so they are not selected
+again for every image.
+
+A cache is only valid as long as the rows are inserted through the functions
+that keep it up to date, these invalidate or extend the cache of the dataset
+on insert. Call :func:`invalidate` after a rollback, or when the rows are
+changed by another process.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# all caches by name, see stats()
+caches = {}
+
+
+class DatasetCache(object):
+    """
+    A value per dataset id, loaded on the first lookup, with hit and miss
+    counters.
+
+    args:
+        name (str): name of the cache in the statistics
+    """
+    def __init__(self, name):
+        self.name = name
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+        caches[name] = self
+
+    def get(self, dataset_id, load):
+        """
+        The cached value of the dataset, or the result of load() which is
+        cached.
+
+        args:
+            dataset_id (int): the dataset ID
+            load: function without arguments that loads the value
+        """
+        try:
+            value = self.values[dataset_id]
+        except KeyError:
+            self.misses += 1
+            value = self.values[dataset_id] = load()
+        else:
+            self.hits += 1
+        return value
+
+    def invalidate(self, dataset_id=None):
+        """
+        Forget the value of a dataset, or of all datasets if None.
+        """
+        if dataset_id is None:
+            self.values.clear()
+        else:
+            self.values.pop(dataset_id, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'datasets': len(self.values)}
+
+
+def invalidate(dataset_id=None):
+    """
+    Forget the values of a dataset in all caches, or of all datasets if None.
+    """
+    for cache in caches.values():
+        cache.invalidate(dataset_id)
+
+
+def stats():
+    """
+    returns:
+        dict: the hit and miss counters per cache name
+    """
+    return dict((name, cache.stats()) for name, cache in caches.items())
+
+
+def log_stats():
+    logger.debug("dataset caches: " + ", ".join(
+        "%s %d hits %d misses" % (name, s['hits'], s['misses'])
+        for name, s in sorted(stats().items())))
@@ -1,17 +1,28 @@
 
 import logging
+import math
+import os
+import re
 import numpy
+from contextlib import contextmanager
+from cStringIO import StringIO
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 
 import tkp.config
 from tkp.utility import substitute_inf
 from tkp.db.model import SCHEMA_VERSION
+from tkp.db.profile import QueryProfile, caller_name
 
 logger = logging.getLogger(__name__)
 
+# the statements SQLAlchemy commits automatically outside a transaction. An
+# EXECUTE of a prepared statement doesn't match, so it is flagged explicitly.
+AUTOCOMMIT_REGEXP = re.compile(r'\s*(?:UPDATE|INSERT|CREATE|DELETE|DROP|ALTER)',
+                               re.I | re.UNICODE)
+
 
 def sanitize_db_inputs(params):
     """
@@ -44,12 +55,138 @@ def sanitize_db_inputs(params):
     return cleaned
 
 
+def copy_text(value):
+    """
+    Format value for the text format of COPY FROM: None becomes NULL,
+    floats keep their full precision and infs become Infinity.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, (float, numpy.floating)):
+        if math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return repr(float(value))
+    if isinstance(value, basestring):
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+    return str(value)
+
+
+# pyformat placeholders and escaped percent signs in a query
+placeholder = re.compile(r'%\((\w+)\)s|%s|%%')
+
+
+def prepare_query(query):
+    """
+    Convert a query with pyformat placeholders to the text of a server side
+    prepared statement, with numbered $1, $2, ... parameters.
+
+    args:
+        query (str): query with %(name)s or %s placeholders
+
+    returns:
+        tuple: the statement text and the names of its parameters, in order,
+               or their number for positional %s placeholders
+    """
+    names = []
+    positional = [0]
+
+    def number(match):
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(1) is None:
+            positional[0] += 1
+            return '$%d' % positional[0]
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return '$%d' % (names.index(match.group(1)) + 1)
+
+    text = placeholder.sub(number, query)
+    if names and positional[0]:
+        raise ValueError("can't mix named and positional placeholders")
+    return text, names or positional[0]
+
+
+def _fork_safe(engine):
+    """
+    Never hand out pooled connections of the parent process in a forked
+    child, see "Using Connection Pools with Multiprocessing" in the
+    SQLAlchemy documentation. The child opens its own connections instead.
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info['pid'] != pid:
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                "Connection record belongs to pid %s, attempting to check out"
+                " in pid %s" % (connection_record.info['pid'], pid))
+
+
+# Anonymous code block running the statements of a Script in one round trip.
+# The row counts are reported with a single notice.
+script_block = """\
+SET LOCAL client_min_messages TO notice;
+DO $tkp_script$
+DECLARE
+    tkp_row_count integer;
+    tkp_counts integer[] := '{}';
+BEGIN
+%s
+    RAISE NOTICE 'tkp_script_counts %%', tkp_counts;
+END
+$tkp_script$"""
+
+script_statement = """\
+%s;
+GET DIAGNOSTICS tkp_row_count = ROW_COUNT;
+tkp_counts := tkp_counts || tkp_row_count;
+"""
+
+
+class Script(object):
+    """
+    The queries collected by :meth:`Database.script`. After the block,
+    counts holds the number of rows affected by each of them.
+    """
+    def __init__(self):
+        self.queries = []
+        # calling function per query, only collected when profiling
+        self.phases = []
+        self.counts = None
+
+    def labels(self):
+        """
+        Short descriptions of the queries, like 'DELETE FROM varmetric'.
+        """
+        return [' '.join(query.split()[:3]) for query, _ in self.queries]
+
+
+class QueuedCursor(object):
+    """
+    Returned by :meth:`Database.execute` for a query queued in a script,
+    which did not run yet.
+    """
+    rowcount = None
+
+    def _unavailable(self, *args):
+        raise RuntimeError("query is queued in a script, its results are not"
+                           " available")
+    fetchone = fetchall = fetchmany = _unavailable
+
+
 class Database(object):
     """
     An object representing a database connection.
     """
     _connection = None
     _configured = False
+    _script = None
+    _pid = None
     transaction = None
     cursor = None
     session = None
@@ -76,6 +213,16 @@ class Database(object):
         self.password = kwargs['password']
         self.host = kwargs['host']
         self.port = kwargs['port']
+        # 0 doesn't keep connections open, see pipeline.cfg
+        self.pool_size = int(kwargs.get('pool_size') or 0)
+        self.prepared_statements = bool(kwargs.get('prepared_statements'))
+        # named queries of the prepared statements, see execute()
+        self.prepared = {}
+        self.profile = None
+        if kwargs.get('profile'):
+            self.profile = QueryProfile(
+                explain_threshold=float(kwargs.get('explain_threshold') or 0),
+                explain_fraction=float(kwargs.get('explain_fraction', 1.0)))
         logger.info("Database config: %s://%s@%s:%s/%s" % (self.engine,
                                                            self.user,
                                                            self.host,
@@ -83,6 +230,10 @@ class Database(object):
                                                            self.database))
         self._configured = True
 
+        if self.pool_size:
+            pool_args = {'pool_size': self.pool_size}
+        else:
+            pool_args = {'poolclass': NullPool}
         self.alchemy_engine = create_engine('%s://%s:%s@%s:%s/%s' %
                                             (self.engine,
                                              self.user,
@@ -91,10 +242,29 @@ class Database(object):
                                              self.port,
                                              self.database),
                                             echo=False,
-                                            poolclass=NullPool,
+                                            **pool_args
                                             )
+        if self.pool_size:
+            _fork_safe(self.alchemy_engine)
+        if self.profile:
+            self.profile.attach(self.alchemy_engine)
         self.Session = sessionmaker(bind=self.alchemy_engine)
         self.session = self.Session()
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        """
+        After a fork the child inherits the connection and session of its
+        parent, which it must not use or close. Forget them, so the child
+        connects by itself.
+        """
+        if self._pid == os.getpid():
+            return
+        logger.debug("reinitialising database connection in forked process")
+        self._pid = os.getpid()
+        self._connection = None
+        self.transaction = None
+        self.session = self.Session()
 
     def connect(self, check=True):
         """
@@ -107,6 +277,8 @@ class Database(object):
 
         self._connection = self.alchemy_engine.connect()
         self._connection.execution_options(autocommit=False)
+        # temporary tables don't survive the connection
+        self._temporary_tables = set()
 
         if check:
             # Check that our database revision matches that expected by the
@@ -137,6 +309,7 @@ class Database(object):
 
         :return: a database connection
         """
+        self._check_fork()
         if not self._connection:
             self.connect()
 
@@ -156,6 +329,34 @@ class Database(object):
 
         self._connection = None
 
+    def temporary_table(self, table):
+        """
+        Shadow table with a temporary table of the same layout, private to
+        the current connection (Postgres only).
+
+        Temporary tables come first in the search path, so from then on the
+        unqualified name refers to the copy. It isn't WAL logged, isn't seen
+        by other connections and is dropped when the connection closes. Use
+        it for scratch tables which would otherwise collect dead rows from
+        every connection.
+
+        args:
+            table: name of the table in the database to shadow
+
+        returns:
+            bool: True if table is shadowed, False for other engines
+        """
+        if self.engine != "postgresql":
+            return False
+        # make sure we are connected, connect() resets the bookkeeping
+        self.connection
+        if table not in self._temporary_tables:
+            query = "CREATE TEMPORARY TABLE IF NOT EXISTS %s " \
+                    "(LIKE %s INCLUDING ALL)" % (table, table)
+            self.execute(query, commit=True)
+            self._temporary_tables.add(table)
+        return True
+
     def vacuum(self, table):
         """
         Force a vacuum on a table, which removes dead rows. (Postgres only)
@@ -181,12 +382,42 @@ class Database(object):
         # reset settings
         self.connection.connection.set_isolation_level(ISOLATION_LEVEL_READ_COMMITTED)
 
-    def execute(self, query, parameters={}, commit=False):
+    def execute(self, query, parameters={}, commit=False, name=None):
+        """
+        Execute a query, optionally as a server side prepared statement.
+
+        args:
+            query (str): the query, with pyformat placeholders
+            parameters: the query parameters
+            commit (bool): should a commit be performed afterwards
+            name (str): name of the query in the prepared statement
+                        registry. If prepared statements are enabled, the
+                        query is prepared once per connection and executed
+                        by name after that. Only name queries of which the
+                        text never changes.
+
+        returns:
+            a database cursor object
+        """
+        if self._script is not None:
+            self._script.queries.append((query, parameters))
+            if self.profile:
+                self._script.phases.append(caller_name())
+            return QueuedCursor()
+
+        connection = self.connection
+        if name and self.prepared_statements and self.engine == "postgresql":
+            original = query
+            query, parameters = self._prepared(name, query, parameters)
+            if (not commit and query is not original and
+                    AUTOCOMMIT_REGEXP.match(original)):
+                connection = connection.execution_options(autocommit=True)
+
         if commit:
            self.transaction = self.connection.begin()
 
         try:
-            cursor = self.connection.execute(query, parameters)
+            cursor = connection.execute(query, parameters)
             if commit:
                 self.transaction.commit()
             return cursor
@@ -194,6 +425,173 @@ class Database(object):
             logger.error("Query failed: %s. Query: %s." % (e, query % parameters))
             raise
 
+    def _prepared(self, name, query, parameters):
+        """
+        The EXECUTE query and parameters of the prepared statement of a
+        named query. Prepares the statement on the current connection if it
+        wasn't yet. Queries that can't be prepared (for example because the
+        type of a parameter can't be determined) are executed as is.
+
+        The PREPARE and its SAVEPOINT run on the raw DBAPI cursor, outside
+        the transaction tracking of SQLAlchemy. They are committed or rolled
+        back together with the query that follows on the connection.
+        """
+        if name not in self.prepared:
+            self.prepared[name] = (query,) + prepare_query(query)
+        registered, text, parameter_names = self.prepared[name]
+        if registered != query:
+            raise ValueError("prepared statement %s is registered for "
+                             "another query" % name)
+        if text is None:
+            return query, parameters
+
+        # prepared statements are kept per connection, also in the pool
+        info = self.connection.connection.info
+        prepared = info.setdefault('tkp_prepared', set())
+        if name not in prepared:
+            cursor = self.connection.connection.cursor()
+            cursor.execute("SAVEPOINT tkp_prepare")
+            try:
+                cursor.execute("PREPARE %s AS %s" % (name, text))
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT tkp_prepare")
+                logger.warning("can't prepare statement %s, executing it "
+                               "unprepared: %s" % (name, e))
+                self.prepared[name] = (query, None, None)
+                return query, parameters
+            finally:
+                cursor.execute("RELEASE SAVEPOINT tkp_prepare")
+            prepared.add(name)
+
+        if isinstance(parameter_names, list):
+            arguments = ', '.join('%%(%s)s' % p for p in parameter_names)
+        else:
+            arguments = ', '.join(['%s'] * parameter_names)
+        if arguments:
+            return "EXECUTE %s (%s)" % (name, arguments), parameters
+        return "EXECUTE %s" % name, parameters
+
+    def copy_from(self, table, columns, rows, commit=False):
+        """
+        Bulk load rows into table with COPY FROM STDIN (Postgres only).
+
+        args:
+            table (str): name of the table
+            columns (tuple): column names, in the order of the row values
+            rows (list): sequences of values, see copy_text()
+            commit (bool): should a commit be performed afterwards
+
+        returns:
+            int: the number of rows loaded
+        """
+        if self.engine != "postgresql":
+            raise NotImplementedError("COPY is only supported on postgresql")
+
+        data = StringIO()
+        for row in rows:
+            data.write('\t'.join(copy_text(value) for value in row))
+            data.write('\n')
+        data.seek(0)
+        query = "COPY %s (%s) FROM STDIN" % (table, ', '.join(columns))
+
+        if commit:
+            self.transaction = self.connection.begin()
+        try:
+            cursor = self.connection.connection.cursor()
+            if self.profile:
+                with self.profile.measure(len(rows)):
+                    cursor.copy_expert(query, data)
+            else:
+                cursor.copy_expert(query, data)
+            if commit:
+                self.transaction.commit()
+        except Exception as e:
+            logger.error("Copy failed: %s. Query: %s." % (e, query))
+            raise
+        return len(rows)
+
+    @contextmanager
+    def script(self):
+        """
+        Queue the queries passed to :meth:`execute` in the block, and run
+        them at the end of the block in one transaction. On postgresql they
+        are sent in a single round trip as an anonymous code block.
+
+        Only use this for statements of which the results aren't needed
+        within the block (so no plain SELECTs), execute() returns a
+        :class:`QueuedCursor`. The
+        number of affected rows per query is in the counts of the yielded
+        :class:`Script` afterwards. Nested blocks join the outer script.
+
+        When profiling, the queries are sent one by one (still in one
+        transaction), so they are timed separately.
+        """
+        if self._script is not None:
+            yield self._script
+            return
+
+        script = self._script = Script()
+        try:
+            yield script
+        finally:
+            self._script = None
+
+        if not script.queries:
+            script.counts = []
+            return
+        self.transaction = self.connection.begin()
+        try:
+            if self.profile:
+                script.counts = self._run_profiled(script)
+            elif self.engine == "postgresql":
+                script.counts = self._run_code_block(script.queries)
+            else:
+                script.counts = [self.connection.execute(q, p).rowcount
+                                 for q, p in script.queries]
+            self.transaction.commit()
+        except Exception as e:
+            logger.error("Script failed: %s. Queries: %s." %
+                         (e, ', '.join(script.labels())))
+            raise
+
+    def _run_profiled(self, script):
+        """
+        Run the queries of a script one by one, attributed to the functions
+        that queued them.
+
+        returns:
+            list: the number of rows affected by each query
+        """
+        counts = []
+        try:
+            for (query, parameters), phase in zip(script.queries,
+                                                  script.phases):
+                self.profile.phase = phase
+                counts.append(self.connection.execute(query,
+                                                      parameters).rowcount)
+        finally:
+            self.profile.phase = None
+        return counts
+
+    def _run_code_block(self, queries):
+        """
+        Run queries as one anonymous code block (Postgres only).
+
+        returns:
+            list: the number of rows affected by each query
+        """
+        dbapi_connection = self.connection.connection
+        cursor = dbapi_connection.cursor()
+        statements = [script_statement % cursor.mogrify(q, p).strip().rstrip(';')
+                      for q, p in queries]
+        del dbapi_connection.notices[:]
+        cursor.execute(script_block % ''.join(statements))
+        for notice in reversed(dbapi_connection.notices):
+            if 'tkp_script_counts' in notice:
+                counts = notice.split('tkp_script_counts', 1)[1].strip()
+                return [int(c) for c in counts.strip('{}').split(',') if c]
+        raise RuntimeError("script didn't report its row counts")
+
     def rollback(self):
         if self.transaction:
             self.transaction.rollback()
@@ -7,15 +7,15 @@ that don't fit into a more specific collection.
 
 import itertools
 import logging
-import math
+
+import numpy
 
 import tkp.db
+import tkp.db.cache
 from datetime import datetime
 from tkp.db.alchemy.image import insert_dataset as alchemy_insert_dataset
 from tkp.db.generic import columns_from_table
-from tkp.utility import substitute_inf
-from tkp.utility.coordinates import alpha_inflate
-from tkp.utility.coordinates import eq_to_cart
+from tkp.utility.coordinates import alpha_inflate_array, sky_pixel
 
 logger = logging.getLogger(__name__)
 
@@ -99,12 +99,64 @@ VALUES {placeholder}
         query, tuple(itertools.chain.from_iterable(monitor_entries)),
         commit=True)
     insert_num = cursor.rowcount
+    # the cached monitor entries, see tkp.db.monitoringlist.monitor_cache
+    tkp.db.cache.invalidate(dataset_id)
     logger.info("Inserted %d sources in monitor table for dataset %s" %
                     (insert_num, dataset_id))
 
 
+extract_types = {
+    'blind': 0,
+    'ff_nd': 1,
+    'ff_ms': 2,
+}
+
+extractedsource_columns = (
+    'ra',
+    'decl',
+    'ra_fit_err',
+    'decl_fit_err',
+    'f_peak',
+    'f_peak_err',
+    'f_int',
+    'f_int_err',
+    'det_sigma',
+    'semimajor',
+    'semiminor',
+    'pa',
+    'ew_sys_err',
+    'ns_sys_err',
+    'error_radius',
+    'fit_type',
+    'chisq',
+    'reduced_chisq',
+    'ra_err',
+    'decl_err',
+    'uncertainty_ew',
+    'uncertainty_ns',
+    'image',
+    'zone',
+    'pixel',
+    'x',
+    'y',
+    'z',
+    'racosdecl',
+    'extract_type',
+    'ff_runcat',
+    'ff_monitor',
+)
+
+insert_extracted_sources_query = """\
+INSERT INTO extractedsource
+  (%s
+  )
+VALUES {placeholder}
+""" % '\n  ,'.join(extractedsource_columns)
+
+
 def insert_extracted_sources(image_id, results, extract_type='blind',
-                             ff_runcat_ids=None, ff_monitor_ids=None):
+                             ff_runcat_ids=None, ff_monitor_ids=None,
+                             use_copy=None):
     """
     Insert all detections from sourcefinder into the extractedsource table.
 
@@ -162,124 +214,137 @@ def insert_extracted_sources(image_id, results, extract_type='blind',
         - the zone in which an extracted source falls is calculated, based
           on its declination. We adopt a zoneheight of 1 degree, so
           the floor of the declination represents the zone.
+        - the sky pixel of the source position, see
+          :func:`tkp.utility.coordinates.sky_pixel`
         - the positional errors are converted from degrees to arcsecs
         - the Cartesian coordinates of the source position
         - ra * cos(radians(decl)), this is very often being used in
           source-distance calculations
+
+    The additional attributes are calculated with NumPy for all sources at
+    once. On PostgreSQL the rows are loaded with COPY FROM STDIN, other
+    engines use a multi row INSERT. Set use_copy to force either path.
     """
     if not len(results):
         logger.debug("No extract_type=%s sources added to extractedsource for"
                     " image %s" % (extract_type, image_id))
         return
 
-    xtrsrc = []
-    for i, src in enumerate(results):
-        r = list(src)
-        # Drop any fits with infinite flux errors
-        if math.isinf(r[5]) or math.isinf(r[7]):
-            logger.warn("Dropped source fit with infinite flux errors "
-                        "at position {} {} in image {}".format(
-                r[0], r[1], image_id))
-            continue
-        # Use 360 degree rather than infinite uncertainty for
-        # unconstrained positions.
-        r[14] = substitute_inf(r[14], 360.0)
-        r[15] = int(r[15])
-        # ra_err: sqrt of quadratic sum of fitted and systematic errors.
-        r.append(math.sqrt(r[2]**2 + alpha_inflate(r[12]/3600., r[1])**2))
-        # decl_err: sqrt of quadratic sum of fitted and systematic errors.
-        r.append(math.sqrt(r[3]**2 + (r[13]/3600.)**2))
-        # uncertainty_ew: sqrt of quadratic sum of systematic error and error_radius
-        # divided by 3600 because uncertainty in degrees and others in arcsec.
-        r.append(math.sqrt(r[12]**2 + r[14]**2)/3600.)
-        # uncertainty_ns: sqrt of quadratic sum of systematic error and error_radius
-        # divided by 3600 because uncertainty in degrees and others in arcsec.
-        r.append(math.sqrt(r[13]**2 + r[14]**2)/3600.)
-        r.append(image_id) # id of the image
-        r.append(int(math.floor(r[1]))) # zone
-        r.extend(eq_to_cart(r[0], r[1])) # Cartesian x,y,z
-        r.append(r[0] * math.cos(math.radians(r[1]))) # ra * cos(radians(decl))
-        if extract_type == 'blind':
-            r.append(0)
-        elif extract_type == 'ff_nd':
-            r.append(1)
-        elif extract_type == 'ff_ms':
-            r.append(2)
-        else:
-            raise ValueError("Not a valid extractedsource insert type: '%s'"
-                             % extract_type)
-        if ff_runcat_ids is not None:
-            assert len(results)==len(ff_runcat_ids)
-            r.append(ff_runcat_ids[i])
-        else:
-            r.append(None)
-
-        if ff_monitor_ids is not None:
-            assert len(results)==len(ff_monitor_ids)
-            r.append(ff_monitor_ids[i])
-        else:
-            r.append(None)
+    xtrsrc = extractedsource_rows(image_id, results, extract_type,
+                                  ff_runcat_ids, ff_monitor_ids)
+    if not xtrsrc:
+        return
 
-        xtrsrc.append(r)
+    database = tkp.db.Database()
+    if use_copy is None:
+        use_copy = database.engine == 'postgresql'
 
-    insertion_query = """\
-INSERT INTO extractedsource
-  (ra
-  ,decl
-  ,ra_fit_err
-  ,decl_fit_err
-  ,f_peak
-  ,f_peak_err
-  ,f_int
-  ,f_int_err
-  ,det_sigma
-  ,semimajor
-  ,semiminor
-  ,pa
-  ,ew_sys_err
-  ,ns_sys_err
-  ,error_radius
-  ,fit_type
-  ,chisq
-  ,reduced_chisq
-  ,ra_err
-  ,decl_err
-  ,uncertainty_ew
-  ,uncertainty_ns
-  ,image
-  ,zone
-  ,x
-  ,y
-  ,z
-  ,racosdecl
-  ,extract_type
-  ,ff_runcat
-  ,ff_monitor
-  )
-VALUES {placeholder}
-"""
-    if xtrsrc:
+    if use_copy:
+        insert_num = database.copy_from('extractedsource',
+                                        extractedsource_columns, xtrsrc,
+                                        commit=True)
+    else:
         cols_per_row = len(xtrsrc[0])
         placeholder_per_row = '('+ ','.join(['%s']*cols_per_row) +')'
 
         placeholder_full = ','.join([placeholder_per_row]*len(xtrsrc))
 
-        query = insertion_query.format(placeholder= placeholder_full)
+        query = insert_extracted_sources_query.format(
+            placeholder=placeholder_full)
         cursor = tkp.db.execute(query, tuple(itertools.chain.from_iterable(xtrsrc)),
                                 commit=True)
         insert_num = cursor.rowcount
-        #if insert_num == 0:
-        #    logger.info("No forced-fit sources added to extractedsource for "
-        #                "image %s" % (image_id,))
-        if extract_type == 'blind':
-            logger.debug("Inserted %d sources in extractedsource for image %s" %
-                        (insert_num, image_id))
-        elif extract_type == 'ff_nd':
-            logger.debug("Inserted %d forced-fit null detections in extractedsource"
-                        " for image %s" % (insert_num, image_id))
-        elif extract_type == 'ff_ms':
-            logger.debug("Inserted %d forced-fit for monitoring in extractedsource"
-                        " for image %s" % (insert_num, image_id))
+
+    if extract_type == 'blind':
+        logger.debug("Inserted %d sources in extractedsource for image %s" %
+                    (insert_num, image_id))
+    elif extract_type == 'ff_nd':
+        logger.debug("Inserted %d forced-fit null detections in extractedsource"
+                    " for image %s" % (insert_num, image_id))
+    elif extract_type == 'ff_ms':
+        logger.debug("Inserted %d forced-fit for monitoring in extractedsource"
+                    " for image %s" % (insert_num, image_id))
+
+
+def extractedsource_rows(image_id, results, extract_type='blind',
+                         ff_runcat_ids=None, ff_monitor_ids=None):
+    """
+    Build the extractedsource rows for the sourcefinder results, in the order
+    of extractedsource_columns. See insert_extracted_sources() for the
+    arguments and the calculated columns.
+
+    Returns:
+        list: a list of row lists, sources with infinite flux errors are
+            dropped
+    """
+    try:
+        extract_type_code = extract_types[extract_type]
+    except KeyError:
+        raise ValueError("Not a valid extractedsource insert type: '%s'"
+                         % extract_type)
+    if ff_runcat_ids is not None:
+        assert len(results)==len(ff_runcat_ids)
+    if ff_monitor_ids is not None:
+        assert len(results)==len(ff_monitor_ids)
+
+    data = numpy.array([src[:15] for src in results], dtype=float)
+    ra = data[:, 0]
+    decl = data[:, 1]
+    ew_sys_err = data[:, 12]
+    ns_sys_err = data[:, 13]
+
+    # Drop any fits with infinite flux errors
+    keep = ~(numpy.isinf(data[:, 5]) | numpy.isinf(data[:, 7]))
+    for i in numpy.flatnonzero(~keep):
+        logger.warn("Dropped source fit with infinite flux errors "
+                    "at position {} {} in image {}".format(
+            ra[i], decl[i], image_id))
+
+    # Use 360 degree rather than infinite uncertainty for
+    # unconstrained positions.
+    error_radius = numpy.where(numpy.isinf(data[:, 14]), 360.0, data[:, 14])
+    decl_rad = numpy.radians(decl)
+    ra_rad = numpy.radians(ra)
+    cos_decl = numpy.cos(decl_rad)
+
+    derived = numpy.column_stack((
+        # ra_err: sqrt of quadratic sum of fitted and systematic errors.
+        numpy.sqrt(data[:, 2]**2 + alpha_inflate_array(ew_sys_err/3600., decl)**2),
+        # decl_err: sqrt of quadratic sum of fitted and systematic errors.
+        numpy.sqrt(data[:, 3]**2 + (ns_sys_err/3600.)**2),
+        # uncertainty_ew: sqrt of quadratic sum of systematic error and error_radius
+        # divided by 3600 because uncertainty in degrees and others in arcsec.
+        numpy.sqrt(ew_sys_err**2 + error_radius**2)/3600.,
+        # uncertainty_ns: sqrt of quadratic sum of systematic error and error_radius
+        # divided by 3600 because uncertainty in degrees and others in arcsec.
+        numpy.sqrt(ns_sys_err**2 + error_radius**2)/3600.,
+    )).tolist()
+    zone = numpy.floor(decl).astype(int).tolist()
+    pixel = sky_pixel(ra, decl).tolist()
+    # Cartesian x, y, z and ra * cos(radians(decl))
+    cartesian = numpy.column_stack((
+        cos_decl * numpy.cos(ra_rad),
+        cos_decl * numpy.sin(ra_rad),
+        numpy.sin(decl_rad),
+        ra * cos_decl,
+    )).tolist()
+    error_radius = error_radius.tolist()
+
+    xtrsrc = []
+    for i in numpy.flatnonzero(keep):
+        r = list(results[i])
+        r[14] = error_radius[i]
+        r[15] = int(r[15])
+        r.extend(derived[i])
+        r.append(image_id)
+        r.append(zone[i])
+        r.append(pixel[i])
+        r.extend(cartesian[i])
+        r.append(extract_type_code)
+        r.append(ff_runcat_ids[i] if ff_runcat_ids is not None else None)
+        r.append(ff_monitor_ids[i] if ff_monitor_ids is not None else None)
+        xtrsrc.append(r)
+    return xtrsrc
 
 
 def lightcurve(xtrsrcid):
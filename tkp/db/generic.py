@@ -138,3 +138,21 @@ def set_columns_for_table(table, data=None, where=None):
         query += " WHERE " + where
 
     tkp.db.execute(query, values + where_args, commit=True)
+
+
+def pixel_condition(column, ranges):
+    """Build an SQL condition restricting a sky pixel column to ranges.
+
+    Example:
+
+        >>> pixel_condition('rc.pixel', [(10, 12), (3610, 3612)])
+        '(rc.pixel BETWEEN 10 AND 12 OR rc.pixel BETWEEN 3610 AND 3612)'
+
+    ranges is a list of (first, last) pixels, as returned by
+    :func:`tkp.utility.coordinates.sky_pixel_ranges`. An empty list gives
+    a condition which is always false.
+    """
+    if not ranges:
+        return "1 = 0"
+    return "(%s)" % " OR ".join("%s BETWEEN %d AND %d" % (column, first, last)
+                                for first, last in ranges)
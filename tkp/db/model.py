@@ -3,6 +3,8 @@ The SQLAlchemy model definition.
 
 revision history:
 
+ 42 - add lightcurve_rollup table
+ 41 - add sky pixel index to extractedsource, runningcatalog and skyregion
  40 - Move image data to seperate table for speed
  39 - Remove SQL insert functions, add dataset row to frequencyband table. Add image data.
  38 - add varmetric table
@@ -18,7 +20,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION as Double
 
 
-SCHEMA_VERSION = 40
+SCHEMA_VERSION = 42
 
 Base = declarative_base()
 metadata = Base.metadata
@@ -125,6 +127,7 @@ class Extractedsource(Base):
     ff_monitor = relationship('Monitor')
 
     zone = Column(Integer, nullable=False)
+    pixel = Column(Integer, nullable=False, index=True)
     ra = Column(Double, nullable=False, index=True)
     decl = Column(Double, nullable=False, index=True)
     uncertainty_ew = Column(Double, nullable=False)
@@ -227,6 +230,42 @@ class ImageData(Base):
     fits_data = Column(LargeBinary)
 
 
+class LightcurveRollup(Base):
+    __tablename__ = 'lightcurve_rollup'
+    __table_args__ = (
+        Index('lightcurve_rollup_runcat_band_stokes_resolution_bin_start_key',
+              'runcat', 'band', 'stokes', 'resolution', 'bin_start',
+              unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    runcat_id = Column('runcat', ForeignKey('runningcatalog.id'), nullable=False)
+    runcat = relationship('Runningcatalog',
+                          backref=backref('lightcurverollups',
+                                          cascade="all,delete"))
+
+    band_id = Column('band', ForeignKey('frequencyband.id'), nullable=False, index=True)
+    band = relationship('Frequencyband')
+
+    stokes = Column(SmallInteger, nullable=False, server_default=text("1"))
+    resolution = Column(String(8), nullable=False)
+    bin_start = Column(DateTime, nullable=False, index=True)
+    datapoints = Column(Integer, nullable=False)
+    last_image_id = Column('last_image', Integer, nullable=False)
+    avg_f_peak = Column(Double)
+    avg_f_peak_sq = Column(Double)
+    avg_f_peak_weight = Column(Double)
+    avg_weighted_f_peak = Column(Double)
+    avg_weighted_f_peak_sq = Column(Double)
+    avg_f_int = Column(Double)
+    avg_f_int_sq = Column(Double)
+    avg_f_int_weight = Column(Double)
+    avg_weighted_f_int = Column(Double)
+    avg_weighted_f_int_sq = Column(Double)
+    max_f_int = Column(Double)
+
+
 class Monitor(Base):
     __tablename__ = 'monitor'
 
@@ -317,6 +356,7 @@ class Runningcatalog(Base):
 
     datapoints = Column(Integer, nullable=False)
     zone = Column(Integer, nullable=False, index=True)
+    pixel = Column(Integer, nullable=False, index=True)
     wm_ra = Column(Double, nullable=False, index=True)
     wm_decl = Column(Double, nullable=False, index=True)
     wm_uncertainty_ew = Column(Double, nullable=False, index=True)
@@ -414,6 +454,7 @@ class Skyregion(Base):
     x = Column(Double, nullable=False)
     y = Column(Double, nullable=False)
     z = Column(Double, nullable=False)
+    pixel = Column(Integer, nullable=False, index=True)
 
 
 class Temprunningcatalog(Base):
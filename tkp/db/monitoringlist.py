@@ -7,6 +7,7 @@ sources, provided by the user via the command line.
 import logging, sys
 
 from tkp.db import execute as execute
+from tkp.db.cache import DatasetCache
 from tkp.db.associations import _empty_temprunningcatalog as _del_tempruncat
 from tkp.db.associations import (
     _update_1_to_1_runcat,
@@ -16,9 +17,14 @@ from tkp.db.associations import (
 
 logger = logging.getLogger(__name__)
 
+# the monitor entries of a dataset, invalidated by
+# tkp.db.general.insert_monitor_positions()
+monitor_cache = DatasetCache('monitor')
+
 def get_monitor_entries(dataset_id):
     """
-    Returns the ``monitor`` entries relevant to this dataset.
+    Returns the ``monitor`` entries relevant to this dataset. They are
+    selected once and cached, see :data:`monitor_cache`.
 
     Args:
         dataset_id (int): Parent dataset.
@@ -26,7 +32,11 @@ def get_monitor_entries(dataset_id):
     Returns:
         list of tuples [(monitor_id, ra, decl)]
     """
+    return monitor_cache.get(dataset_id,
+                             lambda: _select_monitor_entries(dataset_id))
+
 
+def _select_monitor_entries(dataset_id):
     query = """\
 SELECT id
       ,ra
@@ -35,7 +45,7 @@ SELECT id
  WHERE dataset = %(dataset_id)s
 """
     qry_params = {'dataset_id': dataset_id}
-    cursor = execute(query, qry_params)
+    cursor = execute(query, qry_params, name='ms_get_monitor_entries')
     res = cursor.fetchall()
     return res
 
@@ -273,7 +283,8 @@ INSERT INTO temprunningcatalog
          AND t0.stokes = rf.stokes
 """
     qry_params = {'image_id': image_id}
-    cursor = execute(query, qry_params, commit=True)
+    cursor = execute(query, qry_params, commit=True,
+                     name='ms_insert_tempruncat')
     cnt = cursor.rowcount
     logger.debug("Inserted %s monitoring-runcat pairs in tempruncat" % cnt)
 
@@ -317,7 +328,7 @@ INSERT INTO runningcatalog_flux
     FROM temprunningcatalog
    WHERE f_datapoints = 1
     """
-    cursor = execute(query, commit=True)
+    cursor = execute(query, commit=True, name='ms_insert_runcat_flux')
     cnt = cursor.rowcount
     if cnt > 0:
         logger.debug("Inserted new-band fluxes for %s monitoring sources in runcat_flux" % cnt)
@@ -335,6 +346,7 @@ INSERT INTO runningcatalog
   ,dataset
   ,datapoints
   ,zone
+  ,pixel
   ,wm_ra
   ,wm_decl
   ,avg_ra_err
@@ -354,6 +366,7 @@ INSERT INTO runningcatalog
         ,i.dataset
         ,1 AS datapoints
         ,x.zone
+        ,x.pixel
         ,x.ra AS wm_ra
         ,x.decl AS wm_decl
         ,x.ra_err AS avg_ra_err
@@ -377,7 +390,8 @@ INSERT INTO runningcatalog
      AND x.extract_type = 2
      AND mon.runcat IS NULL
 """
-    cursor = execute(query, {'image_id': image_id}, commit=True)
+    cursor = execute(query, {'image_id': image_id}, commit=True,
+                     name='ms_insert_new_runcat')
     ins = cursor.rowcount
     if ins > 0:
         logger.debug("Added %s new monitoring sources to runningcatalog" % ins)
@@ -407,7 +421,8 @@ UPDATE monitor
 
     """
 
-    cursor = execute(query, {'image_id': image_id}, commit=True)
+    cursor = execute(query, {'image_id': image_id}, commit=True,
+                     name='ms_update_monitor_runcats')
     up = cursor.rowcount
     logger.debug("Updated runcat cols for %s newly monitored sources" % up)
 
@@ -465,7 +480,8 @@ INSERT INTO runningcatalog_flux
      AND x.extract_type = 2
      AND mon.runcat IS NULL
 """
-    cursor = execute(query, {'image_id': image_id}, commit=True)
+    cursor = execute(query, {'image_id': image_id}, commit=True,
+                     name='ms_insert_new_runcat_flux')
     ins = cursor.rowcount
     if ins > 0:
         logger.debug("Added %s new monitoring fluxes to runningcatalog_flux" % ins)
@@ -509,7 +525,8 @@ INSERT INTO assocxtrsource
     AND mon.runcat IS NULL
     AND x.extract_type = 2
     """
-    cursor = execute(query, {'image_id': image_id}, commit=True)
+    cursor = execute(query, {'image_id': image_id}, commit=True,
+                     name='ms_insert_new_1_to_1_assoc')
     cnt = cursor.rowcount
     if cnt > 0:
         logger.debug("Inserted %s new runcat-monitoring source pairs in assocxtrsource" % cnt)
@@ -519,7 +536,8 @@ def _insert_1_to_1_assoc():
     The runcat-monitoring pairs are appended to the assocxtrsource
     (light-curve) table as a type = 9 datapoint.
     """
-    cursor = execute(ONE_TO_ONE_ASSOC_QUERY, {'type': 9}, commit=True)
+    cursor = execute(ONE_TO_ONE_ASSOC_QUERY, {'type': 9}, commit=True,
+                     name='one_to_one_assoc')
     cnt = cursor.rowcount
     logger.debug("Inserted %s runcat-monitoring source pairs in assocxtrsource" % cnt)
 
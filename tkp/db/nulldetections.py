@@ -76,7 +76,7 @@ SELECT t0.id
  WHERE t1.runcat IS NULL
 """
     qry_params = {'image_id': image_id, 'expiration': expiration}
-    cursor = execute(query, qry_params)
+    cursor = execute(query, qry_params, name='nd_get_nulldetections')
     res = cursor.fetchall()
     return res
 
@@ -129,7 +129,7 @@ WHERE id IN (
         t.runcat = r.id
 )
 """
-    execute(query)
+    execute(query, name='nd_increment_forcedfits_count')
 
 
 def _insert_tempruncat(image_id):
@@ -310,7 +310,8 @@ INSERT INTO temprunningcatalog
          AND t0.stokes = rf.stokes
 """
     qry_params = {'image_id': image_id}
-    cursor = execute(query, qry_params, commit=True)
+    cursor = execute(query, qry_params, commit=True,
+                     name='nd_insert_tempruncat')
     cnt = cursor.rowcount
     logger.debug("Inserted %s null detections in tempruncat" % cnt)
 
@@ -323,6 +324,7 @@ def _insert_1_to_1_assoc():
     differences might get too small to cause divisions by zero.
 
     """
-    cursor = execute(ONE_TO_ONE_ASSOC_QUERY, {'type': 7}, commit=True)
+    cursor = execute(ONE_TO_ONE_ASSOC_QUERY, {'type': 7}, commit=True,
+                     name='one_to_one_assoc')
     cnt = cursor.rowcount
     logger.debug("Inserted %s 1-to-1 null detections in assocxtrsource" % cnt)
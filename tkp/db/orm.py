@@ -117,6 +117,7 @@ from tkp.db.generic import columns_from_table, set_columns_for_table
 from tkp.db.general import insert_dataset
 from tkp.db.alchemy.image import insert_image
 import tkp.db
+import tkp.db.cache
 import tkp.db.quality
 from tkp.db.database import Database
 
@@ -357,6 +358,26 @@ class Image(DBObject):
         if not self.dataset:
             self.dataset = DataSet(id=self._data['dataset'], database=self.database)
 
+    @classmethod
+    def from_row(cls, row, dataset):
+        """
+        An Image for a row that was just inserted, for example by
+        :func:`tkp.db.alchemy.image.insert_images`, without reading it back
+        from the database.
+
+        Args:
+            row (dict): the columns of the image row
+            dataset (DataSet): the dataset of the image
+        """
+        image = cls.__new__(cls)
+        DBObject.__init__(image, data=row, database=dataset.database,
+                          id=row['id'])
+        image.dataset = dataset
+        image.rejected = False
+        image.sources = set()
+        dataset.images.add(image)
+        return image
+
     @property
     def id(self):
         """Add or obtain an id to/from the table
@@ -376,6 +397,7 @@ class Image(DBObject):
             except Exception as e:
                 logger.error("ORM: error inserting image,  %s: %s" %
                                 (type(e).__name__, str(e)))
+                tkp.db.cache.invalidate(args['dataset'])
                 raise
         return self._id
 
@@ -407,7 +429,7 @@ class ExtractedSource(DBObject):
 
     TABLE = 'extractedsource'
     ID = 'id'
-    REQUIRED = ('image', 'zone',
+    REQUIRED = ('image', 'zone', 'pixel',
                 'ra', 'decl', 'ra_err', 'decl_err',
                 'uncertainty_ew', 'uncertainty_ns',
                 'ra_fit_err', 'decl_fit_err', 'ew_sys_err', 'ns_sys_err',
@@ -0,0 +1,187 @@
+"""
+Timing of the database queries per calling function, enabled with the
+``profile`` setting in the database section of *pipeline.cfg*.
+
+All statements sent through the SQLAlchemy engine are timed, so both
+:meth:`tkp.db.database.Database.execute` and the SQLAlchemy sessions. A
+statement is attributed to the first function up the stack outside of
+SQLAlchemy and the database wrappers, for example
+``_flag_many_to_many_tempruncat``.
+"""
+import json
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# modules of which the functions are never reported as the caller
+wrapper_modules = ('tkp.db', 'tkp.db.database', 'tkp.db.profile',
+                   'contextlib')
+
+# statements that can be explained
+explainable = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'EXECUTE')
+
+
+def caller_name():
+    """
+    The name of the function that issued the current query.
+    """
+    frame = sys._getframe(1)
+    while frame:
+        module = frame.f_globals.get('__name__', '')
+        if not (module in wrapper_modules or module.startswith('sqlalchemy')):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return 'unknown'
+
+
+class QueryProfile(object):
+    """
+    Collects the query timings per phase (calling function) until they are
+    reported with :meth:`report`.
+
+    Statements that take longer than explain_threshold seconds are run
+    again with ``EXPLAIN (ANALYZE, BUFFERS)`` in a savepoint which is rolled
+    back, for a fraction explain_fraction of them (PostgreSQL only). Note
+    that this runs after the statement itself, so for data modifying
+    statements the plan is of the changed state.
+
+    args:
+        explain_threshold (float): seconds, 0 disables explaining
+        explain_fraction (float): fraction of the slow statements explained
+        path (str): if set, :meth:`report` appends a JSON line per report
+                    to this file
+    """
+    def __init__(self, explain_threshold=0, explain_fraction=1.0, path=None):
+        self.explain_threshold = explain_threshold
+        self.explain_fraction = explain_fraction
+        self.path = path
+        # set to attribute the statements to a fixed phase
+        self.phase = None
+        self._listeners = []
+        self.reset()
+
+    def reset(self):
+        self.timings = defaultdict(list)
+        self.explained = []
+
+    def attach(self, engine):
+        """
+        Time all statements of the SQLAlchemy engine.
+        """
+        @event.listens_for(engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            context._tkp_start = time.time()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.time() - context._tkp_start
+            phase = self.phase or caller_name()
+            self.record(phase, elapsed, cursor.rowcount)
+            if self.explain_threshold and elapsed > self.explain_threshold \
+                    and conn.dialect.name == 'postgresql' \
+                    and random.random() < self.explain_fraction:
+                self.explain(cursor, phase, elapsed, statement, parameters)
+
+        self._listeners = [(engine, "before_cursor_execute", before),
+                           (engine, "after_cursor_execute", after)]
+
+    def detach(self):
+        """
+        Stop timing the statements of the engine.
+        """
+        for listener in self._listeners:
+            event.remove(*listener)
+        self._listeners = []
+
+    def record(self, phase, seconds, rows=None):
+        self.timings[phase].append((seconds, rows))
+
+    @contextmanager
+    def measure(self, rows=None):
+        """
+        Time the statements in the block that bypass SQLAlchemy as one.
+        """
+        phase = self.phase or caller_name()
+        start = time.time()
+        yield
+        self.record(phase, time.time() - start, rows)
+
+    def explain(self, cursor, phase, elapsed, statement, parameters):
+        """
+        Collect the EXPLAIN (ANALYZE, BUFFERS) output of a slow statement.
+        """
+        if not statement.lstrip().upper().startswith(explainable):
+            return
+        explain = cursor.connection.cursor()
+        query = "EXPLAIN (ANALYZE, BUFFERS) " + \
+                cursor.mogrify(statement, parameters)
+        try:
+            explain.execute("SAVEPOINT tkp_explain")
+            try:
+                explain.execute(query)
+                plan = '\n'.join(row[0] for row in explain.fetchall())
+            finally:
+                explain.execute("ROLLBACK TO SAVEPOINT tkp_explain")
+                explain.execute("RELEASE SAVEPOINT tkp_explain")
+        except Exception as e:
+            logger.warning("can't explain slow statement of %s: %s" %
+                           (phase, e))
+            return
+        logger.info("%s took %.3f s:\n%s" % (phase, elapsed, plan))
+        self.explained.append({'phase': phase, 'seconds': elapsed,
+                               'plan': plan})
+
+    def summary(self):
+        """
+        returns:
+            list: a dict per phase with the number of statements, the rows
+                  they affected and the total, mean and maximum time,
+                  slowest phase first
+        """
+        phases = []
+        for phase, timings in self.timings.items():
+            seconds = [s for s, _ in timings]
+            rows = [r for _, r in timings if r is not None and r >= 0]
+            phases.append({'phase': phase,
+                           'count': len(timings),
+                           'rows': sum(rows),
+                           'total': sum(seconds),
+                           'mean': sum(seconds) / len(seconds),
+                           'max': max(seconds)})
+        return sorted(phases, key=lambda p: p['total'], reverse=True)
+
+    def report(self, **labels):
+        """
+        Log the summary of the timings since the last report, append it to
+        the profile file and start over.
+
+        args:
+            labels: extra fields of the JSON line, like the image ids
+        """
+        summary = self.summary()
+        lines = ["%-45s %6s %8s %9s %9s %9s" % ('phase', 'count', 'rows',
+                                                 'total (s)', 'mean (s)',
+                                                 'max (s)')]
+        for p in summary:
+            lines.append("%-45s %6d %8d %9.4f %9.4f %9.4f" %
+                         (p['phase'], p['count'], p['rows'], p['total'],
+                          p['mean'], p['max']))
+        logger.info("database query profile:\n" + '\n'.join(lines))
+
+        if self.path:
+            entry = dict(labels)
+            entry.update({'time': datetime.utcnow().isoformat(),
+                          'phases': summary,
+                          'explained': self.explained})
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        self.reset()
+        return summary
@@ -76,5 +76,16 @@ def isrejected(imageid, session):
     """
     image_rejections = session.query(Rejection).filter(
         Rejection.image_id == imageid).all()
-    return ["{}: {}".format(ir.rejectreason.description, ir.comment)
+    return ["{}: {}".format(_description(ir), ir.comment)
             for ir in image_rejections]
+
+
+def _description(rejection):
+    """
+    The description of the reason of a rejection, from reject_reasons unless
+    the reason was added to the database otherwise.
+    """
+    for r in reject_reasons.values():
+        if r.id == rejection.rejectreason_id:
+            return r.description
+    return rejection.rejectreason.description
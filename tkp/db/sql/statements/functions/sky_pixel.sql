@@ -0,0 +1,41 @@
+--DROP FUNCTION sky_pixel;
+
+/**
+ * This function computes the sky pixel of a position, used to index
+ * positions. The sky is cut in declination rows of 0.1 degree, which
+ * are divided in RA cells about as wide as a row is high.
+ * ra and decl are both in degrees.
+ *
+ * Must match tkp.utility.coordinates.sky_pixel().
+ */
+CREATE FUNCTION sky_pixel(ra DOUBLE PRECISION, decl DOUBLE PRECISION)
+RETURNS INTEGER
+
+{% ifdb postgresql %}
+AS $$
+DECLARE
+  irow INTEGER;
+  cells INTEGER;
+BEGIN
+  irow := LEAST(1799, GREATEST(0, CAST(FLOOR((decl + 90) * 10) AS INTEGER)));
+  cells := GREATEST(1, CAST(FLOOR(3600 * COS(RADIANS(GREATEST(
+             ABS(CAST(irow AS DOUBLE PRECISION) / 10 - 90),
+             ABS(CAST(irow + 1 AS DOUBLE PRECISION) / 10 - 90))))) AS INTEGER));
+  RETURN irow * 3600
+         + LEAST(cells - 1, GREATEST(0, CAST(FLOOR(ra * cells / 360) AS INTEGER)));
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+{% endifdb %}
+
+{% ifdb monetdb %}
+BEGIN
+  DECLARE irow INTEGER;
+  DECLARE cells INTEGER;
+  SET irow = LEAST(1799, GREATEST(0, CAST(FLOOR((decl + 90) * 10) AS INTEGER)));
+  SET cells = GREATEST(1, CAST(FLOOR(3600 * COS(RADIANS(GREATEST(
+                ABS(CAST(irow AS DOUBLE PRECISION) / 10 - 90),
+                ABS(CAST(irow + 1 AS DOUBLE PRECISION) / 10 - 90))))) AS INTEGER));
+  RETURN irow * 3600
+         + LEAST(cells - 1, GREATEST(0, CAST(FLOOR(ra * cells / 360) AS INTEGER)));
+END;
+{% endifdb %}
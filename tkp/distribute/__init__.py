@@ -41,6 +41,30 @@ class Runner(object):
         func = self.get_func(func_name)
         return self.module.map(func, iterable, args)
 
+    def imap_unordered(self, func_name, iterable, args=[], timeout=None):
+        """
+        Like map, but yields the results as soon as they are available, so
+        the caller can start working on the first result while the others
+        are still being computed.
+
+        args:
+            func: The function to be called
+            iterable: a list of objects to iterate over
+            arguments: list of arguments to give to the function
+            timeout (float): maximum number of seconds a task may run, None
+                             waits forever. Raises a TimeoutError if
+                             exceeded, the task itself is not stopped. Not
+                             all methods support this.
+        returns:
+            generator: yielding (index, result) tuples in order of
+                completion, where index is the position of the object in
+                iterable.
+        """
+        func = self.get_func(func_name)
+        if hasattr(self.module, 'imap_unordered'):
+            return self.module.imap_unordered(func, iterable, args, timeout)
+        return enumerate(self.module.map(func, iterable, args))
+
     def get_func(self, func_name):
         try:
             return getattr(self.tasks, func_name)
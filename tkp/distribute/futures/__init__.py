@@ -0,0 +1,77 @@
+"""
+A computation distribution implementation using a
+``concurrent.futures.ProcessPoolExecutor``. On Python 2 this requires the
+``futures`` backport. The tasks are shared with the serial method, since
+the executor can call them with the same (item, *arguments) signature.
+"""
+from __future__ import absolute_import
+
+import logging
+import time
+from multiprocessing import cpu_count
+
+from concurrent.futures import (ProcessPoolExecutor, TimeoutError, wait,
+                                FIRST_COMPLETED)
+
+logger = logging.getLogger(__name__)
+
+executor = None
+workers = 0
+
+
+def set_cores(cores=0):
+    """
+    set the number of cores to use. 0 = autodetect
+    """
+    global executor, workers
+    if not cores:
+        cores = cpu_count()
+    if executor:
+        executor.shutdown(wait=False)
+    logger.info("initialising futures executor with {} cores".format(cores))
+    executor = ProcessPoolExecutor(max_workers=cores)
+    workers = cores
+
+
+def map(func, iterable, args):
+    futures = [executor.submit(func, i, *args) for i in iterable]
+    return [f.result() for f in futures]
+
+
+def imap_unordered(func, iterable, args, timeout=None):
+    """
+    yields (index, result) tuples as soon as a task finishes.
+
+    At most one task per core is submitted at a time, so a task starts
+    running when it is submitted and its timeout counts from then.
+
+    args:
+        timeout (float): maximum number of seconds a task may run, raises
+                         concurrent.futures.TimeoutError if exceeded. The
+                         task is not stopped, its worker stays busy until
+                         the task returns. None waits forever.
+    """
+    items = enumerate(iterable)
+    # deadline and index per running task
+    pending = {}
+    while True:
+        while len(pending) < workers:
+            try:
+                index, item = next(items)
+            except StopIteration:
+                break
+            deadline = time.time() + timeout if timeout is not None else None
+            pending[executor.submit(func, item, *args)] = (deadline, index)
+        if not pending:
+            return
+        wait_for = None
+        if timeout is not None:
+            wait_for = max(0, min(pending.values())[0] - time.time())
+        done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+        if not done:
+            raise TimeoutError("task {} did not finish within {} "
+                               "seconds".format(min(pending.values())[1],
+                                                timeout))
+        for future in done:
+            _, index = pending.pop(future)
+            yield index, future.result()
@@ -0,0 +1,6 @@
+"""
+The futures method calls the tasks with the same signature as the serial
+method.
+"""
+from __future__ import absolute_import
+from tkp.distribute.serial.tasks import *
@@ -4,7 +4,9 @@ module. the Pool.map function only accepts one argument, so we need to
 zip the iterable together with the arguments.
 """
 import sys
-from multiprocessing import Pool, cpu_count, log_to_stderr
+import time
+from multiprocessing import Pool, TimeoutError, cpu_count, log_to_stderr
+from Queue import Queue, Empty
 
 import logging
 import atexit
@@ -12,11 +14,13 @@ import atexit
 # use this for debugging. Will not fork processes but run everything threaded
 THREADED = False
 
+workers = cpu_count()
+
 if THREADED:
     from multiprocessing.pool import ThreadPool
-    pool = ThreadPool(processes=cpu_count())
+    pool = ThreadPool(processes=workers)
 else:
-    pool = Pool(processes=cpu_count())
+    pool = Pool(processes=workers)
 
 atexit.register(lambda: pool.terminate())
 
@@ -30,10 +34,11 @@ def set_cores(cores=0):
     """
     set the number of cores to use. 0 = autodetect
     """
-    global pool
+    global pool, workers
     if not cores:
         cores = cpu_count()
     pool = Pool(cores)
+    workers = cores
 
 
 def map(func, iterable, args):
@@ -44,3 +49,66 @@ def map(func, iterable, args):
         pool.terminate()
         print "You pressed CTRL-C, exiting"
         sys.exit(1)
+
+
+def _call_indexed(packed):
+    """
+    returns (index, result, exception), so the callback of apply_async also
+    gets the failed tasks.
+    """
+    func, index, item, args = packed
+    try:
+        return index, func((item, args)), None
+    except Exception as e:
+        return index, None, e
+
+
+def imap_unordered(func, iterable, args, timeout=None):
+    """
+    Like map, but yields (index, result) tuples as soon as a task finishes.
+
+    At most one task per core is submitted at a time, so a task starts
+    running when it is submitted and its timeout counts from then.
+
+    args:
+        timeout (float): maximum number of seconds a task may run, raises
+                         multiprocessing.TimeoutError if exceeded. The task
+                         is not stopped, its worker stays busy until the
+                         task returns. None waits forever.
+    """
+    items = enumerate(iterable)
+    finished = Queue()
+    # deadline per index of the running tasks
+    pending = {}
+    try:
+        while True:
+            while len(pending) < workers:
+                try:
+                    index, item = next(items)
+                except StopIteration:
+                    break
+                pending[index] = time.time() + timeout \
+                    if timeout is not None else None
+                pool.apply_async(_call_indexed, [(func, index, item, args)],
+                                 callback=finished.put)
+            if not pending:
+                return
+            # a get without timeout can't be interrupted with CTRL-C
+            wait_for = 9999999
+            if timeout is not None:
+                wait_for = max(0, min(pending.values()) - time.time())
+            try:
+                index, result, error = finished.get(timeout=wait_for)
+            except Empty:
+                raise TimeoutError("task {} did not finish within {} "
+                                   "seconds".format(min(pending,
+                                                        key=pending.get),
+                                                    timeout))
+            del pending[index]
+            if error is not None:
+                raise error
+            yield index, result
+    except KeyboardInterrupt:
+        pool.terminate()
+        print "You pressed CTRL-C, exiting"
+        sys.exit(1)
@@ -3,6 +3,7 @@ Parallisable tasks used with python multiprocessing
 """
 from __future__ import absolute_import
 import logging
+import tkp.accessors
 import tkp.steps
 from tkp.steps.misc import ImageMetadataForSort
 from tkp.steps.forced_fitting import perform_forced_fits
@@ -47,17 +48,24 @@ def forced_fits(zipped):
     return successful_fits, successful_ids, db_image_id
 
 
+def prepare_image(zipped):
+    logger.debug("running fused image preparation task")
+    image, args = zipped
+    return tkp.steps.prepare.prepare_image(image, *args)
+
+
 def get_accessors(zipped):
     logger.debug("Creating accessors for images")
     images, args = zipped
-    return tkp.steps.persistence.get_accessors(images)
+    return tkp.steps.persistence.get_accessors(images, *args)
 
 
 def get_metadata_for_ordering(zipped):
-    logger.debug("Retrieving ordering metadata from accessors")
+    logger.debug("Retrieving ordering metadata from image headers")
     images, args = zipped
     l = []
-    for a in tkp.steps.persistence.get_accessors(images):
-        l.append(ImageMetadataForSort(url=a.url, timestamp=a.taustart_ts,
-                                      frequency=a.freq_eff))
+    for image in images:
+        timestamp, frequency = tkp.accessors.sort_metadata(image)
+        l.append(ImageMetadataForSort(url=image, timestamp=timestamp,
+                                      frequency=frequency))
     return l
@@ -4,6 +4,15 @@ def map(func, iterable, arguments=[]):
     return x
 
 
+def imap_unordered(func, iterable, arguments=[], timeout=None):
+    """
+    yields (index, result) tuples, for serial this is simply in order. timeout
+    is ignored.
+    """
+    for index, item in enumerate(iterable):
+        yield index, func(item, *arguments)
+
+
 def set_cores(cores=0):
     """
     doesn't do anything for serial
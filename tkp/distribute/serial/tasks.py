@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import logging
+import tkp.accessors
 import tkp.steps
 from tkp.steps.misc import ImageMetadataForSort
 from tkp.steps.forced_fitting import perform_forced_fits
@@ -28,9 +29,14 @@ def extract_sources(accessor, extraction_params):
                                                        extraction_params)
 
 
-def get_accessors(images):
+def prepare_image(image, job_config, shm_dir=None):
+    logger.debug("running fused image preparation task")
+    return tkp.steps.prepare.prepare_image(image, job_config, shm_dir)
+
+
+def get_accessors(images, shm_dir=None):
     logger.debug("Creating accessors for images")
-    return tkp.steps.persistence.get_accessors(images)
+    return tkp.steps.persistence.get_accessors(images, shm_dir)
 
 
 def get_metadata_for_ordering(images):
@@ -40,11 +46,12 @@ def get_metadata_for_ordering(images):
     returns:
         list: of ImageMetadataForSort
     """
-    logger.debug("Retrieving ordering metadata from accessors")
+    logger.debug("Retrieving ordering metadata from image headers")
     l = []
-    for a in tkp.steps.persistence.get_accessors(images):
-        l.append(ImageMetadataForSort(url=a.url, timestamp=a.taustart_ts,
-                                      frequency=a.freq_eff))
+    for image in images:
+        timestamp, frequency = tkp.accessors.sort_metadata(image)
+        l.append(ImageMetadataForSort(url=image, timestamp=timestamp,
+                                      frequency=frequency))
     return l
 
 
@@ -5,34 +5,49 @@ import imp
 import logging
 import atexit
 import os
+import numpy
 from tkp import steps
 from tkp.config import initialize_pipeline_config, get_database_config
 import tkp.db
+import tkp.db.cache
 from tkp.db.image_store import store_fits
 from astropy.io.fits.hdu import HDUList
 from itertools import chain
+from collections import namedtuple
 from tkp.db import consistency as dbconsistency
-from tkp.db import Image
 from tkp.db import general as dbgen
 from tkp.db import associations as dbass
+from tkp.db.association_engine import AssociationEngine
 from tkp.db.quality import sync_rejectreasons
 from tkp.distribute import Runner
 from tkp.steps.misc import (load_job_config, dump_configs_to_logdir,
                             check_job_configs_match,
                             setup_logging, dump_database_backup,
-                            group_per_timestep
-                            )
+                            group_per_timestep, prefetch,
+                            image_signature, load_metadata_index,
+                            store_metadata_index)
 from tkp.db.configstore import store_config, fetch_config
-from tkp.steps.persistence import create_dataset, store_images_in_db
+from tkp.steps.persistence import create_dataset, register_images
 import tkp.steps.forced_fitting as steps_ff
-from tkp.steps.varmetric import execute_store_varmetric
-from tkp.stream import stream_generator
+from tkp.steps.varmetric import execute_store_varmetric, check_varmetric
+from tkp.stream import (stream_generator, StreamMetrics, StreamRing,
+                        RingImage, release_images)
 from tkp.quality.rms import reject_historical_rms
+from tkp.utility.sharedmem import segment_directory, remove_directory
 
 
 logger = logging.getLogger(__name__)
 
 
+# Result of all database independent work for a timestep, see
+# prepare_timestep()
+PreparedTimestep = namedtuple('PreparedTimestep', ['accessors',
+                                                   'metadatas',
+                                                   'rejecteds',
+                                                   'extraction_results',
+                                                   'fits'])
+
+
 def get_pipe_config(job_name):
     return initialize_pipeline_config(os.path.join(os.getcwd(), "pipeline.cfg"),
                                       job_name)
@@ -59,6 +74,9 @@ def setup(pipe_config, supplied_mon_coords=None):
 
     db_config = get_database_config(pipe_config.database, apply=True)
     dump_database_backup(db_config, job_dir)
+    profile = tkp.db.Database().profile
+    if profile:
+        profile.path = os.path.join(log_dir, 'query_profile.json')
 
     job_config = load_job_config(pipe_config)
     dump_configs_to_logdir(log_dir, job_config, pipe_config)
@@ -146,34 +164,11 @@ def initialise_dataset(job_config, supplied_mon_coords):
     return job_config, dataset_id
 
 
-def extract_metadata(job_config, accessors, runner):
-    """
-
-    args:
-        job_config: a TKP config object
-        accessors (tuple): list of tkp.Accessor objects
-        runner (tkp.distribute.Runner): the runner to use
-
-    returns:
-        tuple: a list of metadata dicts
-    """
-    logger.debug("Extracting metadata from images")
-    imgs = [[a] for a in accessors]
-    metadatas = runner.map("extract_metadatas",
-                           imgs,
-                           [job_config.persistence.rms_est_sigma,
-                            job_config.persistence.rms_est_fraction])
-    metadatas = [m[0] for m in metadatas if m]
-    return metadatas
-
-
 def store_image_metadata(metadatas, job_config, dataset_id):
     logger.debug("Storing image metadata in SQL database")
     r = job_config.source_extraction.extraction_radius_pix
-    image_ids = store_images_in_db(metadatas, r, dataset_id,
-                                   job_config.persistence.bandwidth_max)
-    db_images = [Image(id=image_id) for image_id in image_ids]
-    return db_images
+    return register_images(metadatas, r, dataset_id,
+                           job_config.persistence.bandwidth_max)
 
 
 def extract_fits_from_files(runner, paths):
@@ -183,26 +178,40 @@ def extract_fits_from_files(runner, paths):
         return zip(*list(chain.from_iterable(fitss)))
     elif type(paths[0]) == HDUList:
         return [f[0].data for f in paths], [str(f[0].header) for f in paths]
+    elif type(paths[0]) == RingImage:
+        # the pixels are copied out of the ring slots, which are verified
+        # afterwards since they can be written again once released
+        hdulists = [p.hdulist() for p in paths]
+        data = [numpy.array(f[0].data) for f in hdulists]
+        for p in paths:
+            p.verify()
+        return data, [str(f[0].header) for f in hdulists]
     else:
         logging.error('unknown type')
 
 
-def quality_check(db_images, accessors, job_config, runner):
+def quality_check(db_images, accessors, rejecteds, job_config):
     """
+    args:
+        db_images (tuple): list of tkp.db.Image objects
+        accessors (tuple): list of accessors, one per db_image
+        rejecteds (tuple): the outcome of the quality_reject_check task per
+                           image, which are extended with the database side
+                           (historical RMS) check.
     returns:
-        tuple: a list of db_image and accessor tuples
+        tuple: a list of (db_image, accessor, index) tuples, where index is the
+            position of the image in db_images
     """
     logger.debug("performing quality check")
-    arguments = [job_config]
-    rejecteds = runner.map("quality_reject_check", accessors, arguments)
-
     db = tkp.db.Database()
     history = job_config.persistence.rms_est_history
     rms_max = job_config.persistence.rms_est_max
     rms_min = job_config.persistence.rms_est_min
     est_sigma = job_config.persistence.rms_est_sigma
     good_images = []
-    for db_image, rejected, accessor in zip(db_images, rejecteds, accessors):
+    for index, (db_image, rejected, accessor) in enumerate(zip(db_images,
+                                                               rejecteds,
+                                                               accessors)):
         if not rejected:
             rejected = reject_historical_rms(db_image.id, db.session,
                                              history, est_sigma, rms_max, rms_min)
@@ -211,7 +220,7 @@ def quality_check(db_images, accessors, job_config, runner):
             reason, comment = rejected
             steps.quality.reject_image(db_image.id, reason, comment)
         else:
-            good_images.append((db_image, accessor))
+            good_images.append((db_image, accessor, index))
 
     if not good_images:
         msg = "No good images under these quality checking criteria"
@@ -219,21 +228,22 @@ def quality_check(db_images, accessors, job_config, runner):
     return good_images
 
 
-def source_extraction(accessors, job_config, runner):
-    logger.debug("performing source extraction")
-    arguments = [job_config.source_extraction]
-    extraction_results = runner.map("extract_sources", accessors, arguments)
-    total = sum(len(i[0]) for i in extraction_results)
-    logger.info('found {} blind sources in {} images'.format(total, len(extraction_results)))
-    return extraction_results
-
-
 def do_forced_fits(runner, all_forced_fits):
+    """
+    Performs the forced fits, yielding the results per image as soon as they
+    are available.
+
+    returns:
+        generator: of (successful_fits, successful_ids, db_image_id) tuples,
+            in order of completion
+    """
     logger.debug('performing forced fitting')
-    returned = runner.map("forced_fits", all_forced_fits)
-    total = sum(len(i[0]) for i in returned)
-    logger.info('performed {} forced fits in {} images'.format(total, len(returned)))
-    return returned
+    total = images = 0
+    for _, result in runner.imap_unordered("forced_fits", all_forced_fits):
+        total += len(result[0])
+        images += 1
+        yield result
+    logger.info('performed {} forced fits in {} images'.format(total, images))
 
 
 def store_extractions(images, extraction_results, job_config):
@@ -242,21 +252,22 @@ def store_extractions(images, extraction_results, job_config):
     # source extraction
     detection_thresh = job_config.source_extraction['detection_threshold']
     analysis_thresh = job_config.source_extraction['analysis_threshold']
-    for (db_image, accessor), results in zip(images, extraction_results):
+    for (db_image, accessor, _), results in zip(images, extraction_results):
         db_image.update(rms_min=results.rms_min, rms_max=results.rms_max,
                         detection_thresh=detection_thresh,
                         analysis_thresh=analysis_thresh)
         dbgen.insert_extracted_sources(db_image.id, results.sources, 'blind')
 
 
-def assocate_and_get_force_fits(db_image, job_config):
+def assocate_and_get_force_fits(db_image, job_config, engine=None):
     logger.debug("performing DB operations for image {} ({})".format(db_image.id,
                                                                     db_image.url))
 
     r = job_config.association.deruiter_radius
     s = job_config.transient_search.new_source_sigma_margin
     dbass.associate_extracted_sources(db_image.id, deRuiter_r=r,
-                                      new_source_sigma_margin=s)
+                                      new_source_sigma_margin=s,
+                                      engine=engine)
 
     expiration = job_config.source_extraction.expiration
     all_fit_posns, all_fit_ids = steps_ff.get_forced_fit_requests(db_image,
@@ -264,9 +275,40 @@ def assocate_and_get_force_fits(db_image, job_config):
     return all_fit_posns, all_fit_ids
 
 
-def varmetric(dataset_id):
+def get_association_engine(job_config, dataset_id):
+    """
+    Returns an in memory association engine for the dataset if enabled in
+    the job config (association.engine = 'memory'), otherwise None.
+    """
+    engine = job_config.association.get('engine', 'database')
+    if engine == 'memory':
+        logger.info("using the in memory association engine")
+        return AssociationEngine(dataset_id)
+    elif engine != 'database':
+        raise ValueError("unknown association engine: %s" % engine)
+
+
+def varmetric(dataset_id, job_config=None, image_ids=None):
+    """
+    Update the variability metrics of the dataset. In incremental mode
+    (transient_search.varmetric = 'incremental') only those of the runcats
+    associated in image_ids are recalculated, optionally followed by a check
+    against a full recalculation (transient_search.varmetric_check).
+    """
     logger.info("calculating variability metrics")
-    execute_store_varmetric(dataset_id)
+    search = job_config.transient_search if job_config else {}
+    mode = search.get('varmetric', 'full')
+    if mode == 'incremental' and image_ids is not None:
+        execute_store_varmetric(dataset_id, image_ids=image_ids)
+        if search.get('varmetric_check', False):
+            inconsistent = check_varmetric(dataset_id)
+            if inconsistent:
+                logger.error("incremental varmetrics differ from the full "
+                             "calculation for runcats %s" % inconsistent)
+    elif mode in ('full', 'incremental'):
+        execute_store_varmetric(dataset_id)
+    else:
+        raise ValueError("unknown varmetric mode: %s" % mode)
 
 
 def close_database(dataset_id):
@@ -276,30 +318,62 @@ def close_database(dataset_id):
     db.close()
 
 
-def get_accessors(runner, all_images):
-    imgs = [[img] for img in all_images]
-    accessors = runner.map("get_accessors", imgs)
-    return [a[0] for a in accessors if a]
+def release_accessors(accessors):
+    """
+    Free the shared memory used by the accessors of a prepared timestep.
+    """
+    for accessor in accessors:
+        accessor.release_data()
 
 
-def get_metadata_for_sorting(runner, image_paths):
+def get_metadata_for_sorting(runner, image_paths, index_path=None):
     """
-    Group images per timestamp. Will open all images in parallel using runner.
+    Get the ordering metadata of all images. Will read the image headers in
+    parallel using runner.
+
+    If index_path is given, the metadata of images which did not change since
+    they were last read is taken from the index file there, and the index is
+    updated afterwards.
 
     args:
         runner (tkp.distribute.Runner): Runner to use for distribution
         image_paths (tuple): list of image paths
+        index_path (str): location of the metadata index
     returns:
-        tuple: list of tuples, (timestamp, [list_of_images])
+        list: of ImageMetadataForSort, in the order of image_paths
     """
-    nested_img = [[i] for i in image_paths]
-    results = runner.map("get_metadata_for_ordering", nested_img)
-    if results and results[0]:
-        metadatas = [t[0] for t in results]
-        return metadatas
-    else:
-        logger.warning("no images to process!")
-        return []
+    index = load_metadata_index(index_path) if index_path else {}
+    signatures = {}
+    known = {}
+    for path in image_paths:
+        try:
+            signatures[path] = image_signature(path)
+        except (OSError, TypeError):
+            # not a readable file, the task will report it
+            continue
+        entry = index.get(path)
+        if entry and entry[0] == signatures[path]:
+            known[path] = entry[1]
+
+    missing = [[i] for i in image_paths if i not in known]
+    if known:
+        logger.info("ordering metadata of %s images taken from index" %
+                    len(known))
+    if missing:
+        results = runner.map("get_metadata_for_ordering", missing)
+        if not (results and results[0]):
+            logger.warning("no images to process!")
+            return []
+        for t in results:
+            known[t[0].url] = t[0]
+
+    if index_path:
+        for path, metadata in known.items():
+            if path in signatures:
+                index[path] = (signatures[path], metadata)
+        store_metadata_index(index_path, index)
+
+    return [known[path] for path in image_paths]
 
 
 def store_image_data(db_images, fits_datas, fits_headers):
@@ -307,62 +381,165 @@ def store_image_data(db_images, fits_datas, fits_headers):
     store_fits(db_images, fits_datas, fits_headers)
 
 
-def timestamp_step(runner, images, job_config, dataset_id, copy_images):
+def prepare_timestep(runner, images, job_config, copy_images, shm_dir=None):
     """
-    Called from the main loop with all images in a certain timestep
+    Does all the work for a timestep which doesn't need the database: opening
+    the images, extracting the metadata, the telescope specific quality checks
+    and the blind source extraction. This is done with one fused task per
+    image, see :py:func:`tkp.steps.prepare.prepare_image`.
+
+    Since nothing here depends on the database state this can run for the
+    next timestep(s) while the database operations of the current timestep
+    are still in progress. Images rejected by the database side historical RMS
+    check are extracted anyway, their results are discarded later on.
 
     args:
          runner (tkp.distribute.Runner): Runner to use for distribution
          images (tuple): list of things tkp.accessors can handle, like image
                         paths or fits objects
          job_config: a tkp job config object
-         dataset_id (int): The ``tkp.db.model.Dataset`` id
+         copy_images (bool): also read the image data for storing in the
+                             database
+         shm_dir (str): if set the pixel data is kept in shared memory in this
+                        directory, so it isn't copied to the workers for every
+                        task. Use release_accessors() to free it again.
 
     returns:
-        tuple: of tuples (rms_qc, band)
+        PreparedTimestep: the intermediate results of the timestep
     """
-    # gather all image info
-    accessors = get_accessors(runner, images)
-    metadatas = extract_metadata(job_config, accessors, runner)
-    db_images = store_image_metadata(metadatas, job_config, dataset_id)
-    error = "%s != %s != %s" % (len(accessors), len(metadatas), len(db_images))
-    assert len(accessors) == len(metadatas) == len(db_images), error
+    logger.debug("opening, quality checking and extracting sources from "
+                 "{} images".format(len(images)))
+    prepared = runner.map("prepare_image", images, [job_config, shm_dir])
+
+    extractions = [p.extraction for p in prepared if p.extraction]
+    total = sum(len(e.sources) for e in extractions)
+    logger.info('found {} blind sources in {} images'.format(total,
+                                                            len(extractions)))
+    fits = None
+    if copy_images:
+        fits = extract_fits_from_files(runner, images)
+
+    return PreparedTimestep(accessors=[p.accessor for p in prepared],
+                            metadatas=[p.metadata for p in prepared],
+                            rejecteds=[p.rejected for p in prepared],
+                            extraction_results=[p.extraction for p in prepared],
+                            fits=fits)
+
+
+def process_timestep(runner, prepared, job_config, dataset_id, engine=None):
+    """
+    Does the database part of a timestep: storing the images, the
+    historical quality check, association, forced fitting and variability
+    metrics. These should run in timestep order.
+
+    args:
+         runner (tkp.distribute.Runner): Runner to use for distribution
+         prepared (PreparedTimestep): output of prepare_timestep()
+         job_config: a tkp job config object
+         dataset_id (int): The ``tkp.db.model.Dataset`` id
+         engine (AssociationEngine): if set, use this in memory association
+                                     engine, see get_association_engine()
+    """
+    accessors = prepared.accessors
+    db_images = store_image_metadata(prepared.metadatas, job_config,
+                                     dataset_id)
+    error = "%s != %s" % (len(accessors), len(db_images))
+    assert len(accessors) == len(db_images), error
 
     # store copy of image data in database
-    if copy_images:
-        fits_datas, fits_headers = extract_fits_from_files(runner, images)
+    if prepared.fits:
+        fits_datas, fits_headers = prepared.fits
         store_image_data(db_images, fits_datas, fits_headers)
 
     # filter out the bad ones
-    good_images = quality_check(db_images, accessors, job_config, runner)
-    good_accessors = [i[1] for i in good_images]
-
-    # do the source extractions
-    extraction_results = source_extraction(good_accessors, job_config, runner)
+    good_images = quality_check(db_images, accessors, prepared.rejecteds,
+                                job_config)
+    extraction_results = [prepared.extraction_results[i]
+                          for (_, _, i) in good_images]
 
     store_extractions(good_images, extraction_results, job_config)
 
     all_forced_fits = []
     # assocate the sources
-    for (db_image, accessor) in good_images:
-        fit_poss, fit_ids = assocate_and_get_force_fits(db_image, job_config)
+    for (db_image, accessor, _) in good_images:
+        fit_poss, fit_ids = assocate_and_get_force_fits(db_image, job_config,
+                                                        engine)
         all_forced_fits.append((accessor, db_image.id, fit_poss, fit_ids,
                                job_config.source_extraction))
 
-    # do the forced fitting
-    all_forced_fits_results = do_forced_fits(runner, all_forced_fits)
-
-    # store and associate the forced fits
-    for (successful_fits, successful_ids, db_image_id) in all_forced_fits_results:
+    # do the forced fitting, and store and associate the fits of an image
+    # while the other images are still being fitted
+    for (successful_fits, successful_ids, db_image_id) in do_forced_fits(
+            runner, all_forced_fits):
         steps_ff.insert_and_associate_forced_fits(db_image_id,
                                                   successful_fits,
                                                   successful_ids)
+        if engine:
+            engine.update_forced_fits(db_image_id)
 
     # update the variable metrics for running catalogs
-    varmetric(dataset_id)
+    image_ids = [db_image.id for db_image in db_images]
+    varmetric(dataset_id, job_config, image_ids)
+
+    tkp.db.cache.log_stats()
+    profile = tkp.db.Database().profile
+    if profile:
+        profile.report(dataset=dataset_id, images=image_ids,
+                       caches=tkp.db.cache.stats())
+
+
+def timestamp_step(runner, images, job_config, dataset_id, copy_images,
+                   shm_dir=None, engine=None):
+    """
+    Called from the main loop with all images in a certain timestep
+
+    args:
+         runner (tkp.distribute.Runner): Runner to use for distribution
+         images (tuple): list of things tkp.accessors can handle, like image
+                        paths or fits objects
+         job_config: a tkp job config object
+         dataset_id (int): The ``tkp.db.model.Dataset`` id
+         copy_images (bool): store the image data in the database
+         shm_dir (str): directory for shared memory pixel data, see
+                        prepare_timestep()
+         engine (AssociationEngine): in memory association engine, see
+                                     get_association_engine()
+    """
+    prepared = prepare_timestep(runner, images, job_config, copy_images,
+                                shm_dir)
+    try:
+        process_timestep(runner, prepared, job_config, dataset_id, engine)
+    finally:
+        release_accessors(prepared.accessors)
+
+
+def pipelined_timesteps(runner, image_groups, job_config, copy_images,
+                        depth, shm_dir=None):
+    """
+    Runs prepare_timestep() on the image groups in a background thread, at
+    most depth timesteps ahead of the consumer.
+
+    args:
+         runner (tkp.distribute.Runner): Runner to use for distribution
+         image_groups (iterable): yields lists of images, one per timestep
+         job_config: a tkp job config object
+         copy_images (bool): also read the image data for storing in the
+                             database
+         depth (int): how many timesteps can be prepared ahead, 0 disables
+         shm_dir (str): directory for shared memory pixel data, see
+                        prepare_timestep()
 
+    returns:
+        generator: yielding (images, PreparedTimestep, exception) tuples
+    """
+    def prepare(images):
+        return prepare_timestep(runner, images, job_config, copy_images,
+                                shm_dir)
+    return prefetch(prepare, image_groups, depth)
 
-def run_stream(runner, job_config, dataset_id, copy_images):
+
+def run_stream(runner, job_config, dataset_id, copy_images, prefetch=0,
+               shm_dir=None, engine=None):
     """
     Run the pipeline in stream mode.
 
@@ -372,24 +549,56 @@ def run_stream(runner, job_config, dataset_id, copy_images):
          runner (tkp.distribute.Runner): Runner to use for distribution
          job_config: a job configuration object
          dataset_id (int): The dataset ID to use
+         prefetch (int): number of timesteps to prepare ahead of the database
+                         operations
+         shm_dir (str): directory for shared memory pixel data, see
+                        prepare_timestep(), also used for the ring of stream
+                        images if pipeline.ring_slots is set
+         engine (AssociationEngine): in memory association engine, see
+                                     get_association_engine()
     """
     hosts = job_config.pipeline.hosts.split(',')
     ports = [int(p) for p in job_config.pipeline.ports.split(',')]
     from datetime import datetime
-    for images in stream_generator(hosts=hosts, ports=ports):
+    metrics = StreamMetrics()
+    pipeline = job_config.pipeline
+    ring = None
+    ring_slots = pipeline.get('ring_slots', 0)
+    if ring_slots:
+        ring_dir = shm_dir
+        if not ring_dir:
+            ring_dir = segment_directory()
+            atexit.register(remove_directory, ring_dir)
+        ring = StreamRing(ring_dir, ring_slots,
+                          pipeline.get('ring_policy', 'drop-oldest'))
+    groups = stream_generator(hosts=hosts, ports=ports, metrics=metrics,
+                              deadline=pipeline.get('deadline', 1.0),
+                              reorder=pipeline.get('reorder', 2), ring=ring)
+    for images, prepared, error in pipelined_timesteps(runner, groups,
+                                                       job_config, copy_images,
+                                                       prefetch, shm_dir):
         logger.info("processing {} stream images...".format(len(images)))
+        logger.debug("stream metrics: {}".format(metrics.summary()))
         trap_start = datetime.now()
         try:
-            timestamp_step(runner, images, job_config, dataset_id, copy_images)
+            if error:
+                raise error
+            process_timestep(runner, prepared, job_config, dataset_id,
+                             engine)
         except Exception as e:
             logger.error("timestep raised {} exception: {}".format(type(e), str(e)))
         else:
             trap_end = datetime.now()
             delta = (trap_end - trap_start).microseconds/1000
             logging.info("trap iteration took {} ms".format(delta))
+        finally:
+            if prepared:
+                release_accessors(prepared.accessors)
+            release_images(images)
 
 
-def run_batch(image_paths, job_config, runner, dataset_id, copy_images):
+def run_batch(image_paths, job_config, runner, dataset_id, copy_images,
+              prefetch=0, shm_dir=None, engine=None, metadata_index=None):
     """
     Run the pipeline in batch mode.
 
@@ -399,17 +608,36 @@ def run_batch(image_paths, job_config, runner, dataset_id, copy_images):
         job_config: a job configuration object
         runner (tkp.distribute.Runner): Runner to use for distribution
         dataset_id (int): The dataset ID to use
+        prefetch (int): number of timesteps to prepare ahead of the database
+                        operations
+        shm_dir (str): directory for shared memory pixel data, see
+                       prepare_timestep()
+        engine (AssociationEngine): in memory association engine, see
+                                    get_association_engine()
+        metadata_index (str): location of the image metadata index, see
+                              get_metadata_for_sorting()
     """
-    sorting_metadata = get_metadata_for_sorting(runner, image_paths)
+    sorting_metadata = get_metadata_for_sorting(runner, image_paths,
+                                                metadata_index)
     grouped_images = group_per_timestep(sorting_metadata)
+    timesteps = [timestep for timestep, _ in grouped_images]
+    groups = (images for _, images in grouped_images)
 
-    for n, (timestep, images) in enumerate(grouped_images):
+    for n, (images, prepared, error) in enumerate(
+            pipelined_timesteps(runner, groups, job_config, copy_images,
+                                prefetch, shm_dir)):
         msg = "processing %s images in timestep %s (%s/%s)"
-        logger.info(msg % (len(images), timestep, n + 1, len(grouped_images)))
+        logger.info(msg % (len(images), timesteps[n], n + 1, len(grouped_images)))
         try:
-            timestamp_step(runner, images, job_config, dataset_id, copy_images)
+            if error:
+                raise error
+            process_timestep(runner, prepared, job_config, dataset_id,
+                             engine)
         except Exception as e:
             logger.error("timestep raised {} exception: {}".format(type(e), str(e)))
+        finally:
+            if prepared:
+                release_accessors(prepared.accessors)
 
 
 def run(job_name, supplied_mon_coords=None):
@@ -428,10 +656,22 @@ def run(job_name, supplied_mon_coords=None):
     atexit.register(close_database, dataset_id)
 
     copy_images = pipe_config.image_cache['copy_images']
+    prefetch = pipe_config.parallelise.get('prefetch', 0)
+
+    shm_dir = None
+    if pipe_config.parallelise.get('shared_memory', False):
+        shm_dir = segment_directory()
+        atexit.register(remove_directory, shm_dir)
+
+    engine = get_association_engine(job_config, dataset_id)
+
     if job_config.pipeline.mode == 'stream':
-        run_stream(runner, job_config, dataset_id, copy_images)
+        run_stream(runner, job_config, dataset_id, copy_images, prefetch,
+                   shm_dir, engine)
     elif job_config.pipeline.mode == 'batch':
         image_paths = load_images(job_name, job_dir)
-        run_batch(image_paths, job_config, runner, dataset_id, copy_images)
+        metadata_index = os.path.join(job_dir, 'image_metadata.json')
+        run_batch(image_paths, job_config, runner, dataset_id, copy_images,
+                  prefetch, shm_dir, engine, metadata_index)
 
 
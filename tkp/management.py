@@ -278,6 +278,35 @@ def deldataset(options):
     db.close()
 
 
+def rollup(options):
+    from datetime import timedelta
+    from sqlalchemy import func
+    from tkp.db.database import Database
+    from tkp.db.model import Image
+    from tkp.steps.rollup import execute_rollup
+    dbconfig = get_db_config()
+
+    db = Database(**dbconfig)
+    latest = db.session.query(func.max(Image.taustart_ts)).\
+        filter(Image.dataset_id == options.id).scalar()
+    if latest is None:
+        print("\ndataset {} has no images!\n".format(options.id))
+        sys.exit(1)
+    before = latest - timedelta(days=options.age)
+
+    if options.prune and not options.yes:
+        answer = raw_input("\nAre you sure you want to delete the "
+                           "measurements of dataset {} before {}? "
+                           "[y/N]: ".format(options.id, before))
+        if answer.lower() != 'y':
+            sys.stderr.write("Aborting.\n")
+            sys.exit(1)
+    counts = execute_rollup(options.id, before, prune=options.prune,
+                            session=db.session)
+    print("\nrolled up dataset {}: {}\n".format(options.id, counts))
+    db.close()
+
+
 def get_parser():
     trap_manage_note = """
         A tool for managing TKP projects.
@@ -367,6 +396,21 @@ def get_parser():
                                    help="don't ask for confirmation",
                                    action="store_true")
     deldataset_parser.set_defaults(func=deldataset)
+
+    # rollup
+    rollup_parser = parser_subparsers.add_parser(
+        'rollup', help="Roll up the lightcurves of a dataset per minute, "
+                       "hour and day")
+    rollup_parser.add_argument('id', help='dataset id', type=int)
+    rollup_parser.add_argument('--age', type=float, default=0,
+                               help="only roll up the measurements older than "
+                                    "this many days before the latest image")
+    rollup_parser.add_argument('--prune', action="store_true",
+                               help="delete the rolled up measurements")
+    rollup_parser.add_argument('-y', '--yes',
+                               help="don't ask for confirmation",
+                               action="store_true")
+    rollup_parser.set_defaults(func=rollup)
     return parser
 
 
@@ -5,7 +5,7 @@ Source fitting routines.
 import math
 import numpy
 import scipy.optimize
-from .gaussian import gaussian
+from .gaussian import gaussian, jacobian
 from .stats import indep_pixels
 import utils
 
@@ -150,44 +150,59 @@ def fitgaussian(pixels, params, fixed=None, maxfev=0):
             else:
                 initial.append(params[param])
 
-    def residuals(paramlist):
-        """Error function to be used in chi-squared fitting
+    # Only the unmasked pixels take part in the fit, which is essential so
+    # the Gaussian fit will not take account of the masked values (=below
+    # threshold) at the edges and corners of pixels (=(masked) array, so
+    # rectangular in shape). Their coordinates are collected once here, so
+    # every iteration only evaluates the Gaussian at those points.
+    unmasked = ~numpy.ma.getmaskarray(pixels)
+    x, y = numpy.indices(pixels.shape, dtype=float)
+    x, y = x[unmasked], y[unmasked]
+    values = numpy.ma.getdata(pixels)[unmasked]
+    free = [param not in fixed for param in FIT_PARAMS]
+
+    def gaussian_args(paramlist):
+        """Merge the fitting parameters with the fixed ones
 
         :argument paramlist: fitting parameters
         :type paramlist: numpy.ndarray
-        :argument fixed: parameters to be held frozen
-        :type fixed: dict
 
-        :returns: 2d-array of difference between estimated Gaussian function
-            and the actual pixels
+        :returns: list of arguments for gaussian()
         """
         paramlist = list(paramlist)
-        gaussian_args = []
+        args = []
         for param in FIT_PARAMS:
             if param in fixed:
-                gaussian_args.append(fixed[param])
+                args.append(fixed[param])
             else:
-                gaussian_args.append(paramlist.pop(0))
+                args.append(paramlist.pop(0))
+        return args
+
+    def residuals(paramlist):
+        """Error function to be used in chi-squared fitting
 
+        :returns: 1d-array of difference between estimated Gaussian function
+            and the actual unmasked pixels
+        """
         # gaussian() returns a function which takes arguments x, y and returns
-        # a Gaussian with parameters gaussian_args evaluated at that point.
-        g = gaussian(*gaussian_args)
-
-        # The .compressed() below is essential so the Gaussian fit will not
-        # take account of the masked values (=below threshold) at the edges
-        # and corners of pixels (=(masked) array, so rectangular in shape).
-        pixel_resids = numpy.ma.MaskedArray(
-            data = numpy.fromfunction(g, pixels.shape) - pixels,
-            mask = pixels.mask)
-        return pixel_resids.compressed()
-
-    # maxfev=0, the default, corresponds to 200*(N+1) (NB, not 100*(N+1) as
-    # the scipy docs state!) function evaluations, where N is the number of
+        # a Gaussian with the given parameters evaluated at that point.
+        return gaussian(*gaussian_args(paramlist))(x, y) - values
+
+    def derivatives(paramlist):
+        """Analytic derivatives of the error function to the fitting
+        parameters, one row per parameter.
+        """
+        columns = jacobian(*gaussian_args(paramlist))(x, y)
+        return numpy.array([c for c, f in zip(columns, free) if f])
+
+    # maxfev=0, the default, corresponds to 100*(N+1) evaluations of the
+    # error function when the derivatives are given, N being the number of
     # parameters in the solution.
     # Convergence tolerances xtol and ftol established by experiment on images
     # from Paul Hancock's simulations.
     soln, success = scipy.optimize.leastsq(
-        residuals, initial, maxfev=maxfev, xtol=1e-4, ftol=1e-4
+        residuals, initial, Dfun=derivatives, col_deriv=1, maxfev=maxfev,
+        xtol=1e-4, ftol=1e-4
     )
 
     if success > 4:
@@ -34,3 +34,35 @@ def gaussian(height, center_x, center_y, semimajor, semiminor, theta):
                           ((cos(theta) * (y - center_y) -
                             sin(theta) * (x - center_x)) /
                            semimajor)**2.))
+
+
+def jacobian(height, center_x, center_y, semimajor, semiminor, theta):
+    """Return the partial derivatives of a 2D Gaussian.
+
+    Takes the same arguments as :func:`gaussian`.
+
+    Returns:
+        lambda: function of pixel coords ``(x,y)`` returning a list with the
+        derivatives of the Gaussian to height, center_x, center_y,
+        semimajor, semiminor and theta, in that order.
+    """
+    def derivatives(x, y):
+        dx = x - center_x
+        dy = y - center_y
+        # coordinates along the minor (u) and major (v) axes
+        u = cos(theta) * dx + sin(theta) * dy
+        v = cos(theta) * dy - sin(theta) * dx
+        shape = exp(-log(2.0) * ((u / semiminor)**2. + (v / semimajor)**2.))
+        value = height * shape
+        # d(exponent)/d(u) and d(exponent)/d(v), up to the value
+        du = 2 * log(2.0) * value * u / semiminor**2.
+        dv = 2 * log(2.0) * value * v / semimajor**2.
+        return [
+            shape,
+            du * cos(theta) - dv * sin(theta),
+            du * sin(theta) + dv * cos(theta),
+            dv * v / semimajor,
+            du * u / semiminor,
+            (dv * u - du * v),
+        ]
+    return derivatives
@@ -5,6 +5,7 @@ calculating (specific) variances
 
 import logging
 import itertools
+import multiprocessing
 import numpy
 from tkp.utility import containers
 from tkp.utility.memoize import Memoize
@@ -32,6 +33,32 @@ MF_THRESHOLD = 0        # If MEDIAN_FILTER is non-zero, only use the filtered
 DEBLEND_MINCONT = 0.005 # Min. fraction of island flux in deblended subisland
 STRUCTURING_ELEMENT = [[0,1,0], [1,1,1], [0,1,0]] # Island connectiivty
 
+
+def deblend_and_fit(island, deblend_nthresh, fixed):
+    """Deblend an island, if required, and fit each of its parts.
+
+    Returns a list of (island, fit result) tuples, where the fit result is
+    None if the fit failed.
+    """
+    if deblend_nthresh:
+        islands = list(utils.flatten([island.deblend()]))
+    else:
+        islands = [island]
+    return [(part, part.fit(fixed=fixed)) for part in islands]
+
+
+def fit_islands(args):
+    """Deblend and fit a chunk of islands, see deblend_and_fit().
+
+    Takes an (islands, deblend_nthresh, fixed) tuple, so it can be mapped
+    onto a process pool. Returns the (island, fit result) tuples of all the
+    islands, in order.
+    """
+    islands, deblend_nthresh, fixed = args
+    return [fitted for island in islands
+            for fitted in deblend_and_fit(island, deblend_nthresh, fixed)]
+
+
 class ImageData(object):
     """Encapsulates an image in terms of a numpy array + meta/headerdata.
 
@@ -222,49 +249,49 @@ class ImageData(object):
         useful_data = self.data[useful_chunk[0]]
         my_xdim, my_ydim = useful_data.shape
 
-        rmsgrid, bggrid = [], []
-        for startx in xrange(0, my_xdim, self.back_size_x):
-            rmsrow, bgrow = [], []
-            for starty in xrange(0, my_ydim, self.back_size_y):
-                chunk = useful_data[
-                    startx:startx + self.back_size_x,
-                    starty:starty + self.back_size_y
-                ].ravel()
-                if not chunk.any():
-                    rmsrow.append(False)
-                    bgrow.append(False)
-                    continue
-                chunk, sigma, median, num_clip_its = stats.sigma_clip(
-                    chunk, self.beam)
-                if len(chunk) == 0 or not chunk.any():
-                    rmsrow.append(False)
-                    bgrow.append(False)
-                else:
-                    mean = numpy.mean(chunk)
-                    rmsrow.append(sigma)
-                    # In the case of a crowded field, the distribution will be
-                    # skewed and we take the median as the background level.
-                    # Otherwise, we take 2.5 * median - 1.5 * mean. This is the
-                    # same as SExtractor: see discussion at
-                    # <http://terapix.iap.fr/forum/showthread.php?tid=267>.
-                    # (mean - median) / sigma is a quick n' dirty skewness
-                    # estimator devised by Karl Pearson.
-                    if numpy.fabs(mean - median) / sigma >= 0.3:
-                        sigmaclip_logger.debug(
-                            'bg skewed, %f clipping iterations', num_clip_its)
-                        bgrow.append(median)
-                    else:
-                        sigmaclip_logger.debug(
-                            'bg not skewed, %f clipping iterations', num_clip_its)
-                        bgrow.append(2.5 * median - 1.5 * mean)
-
-            rmsgrid.append(rmsrow)
-            bggrid.append(bgrow)
-
-        rmsgrid = numpy.ma.array(
-            rmsgrid, mask=numpy.where(numpy.array(rmsgrid) == False, 1, 0))
-        bggrid = numpy.ma.array(
-            bggrid, mask=numpy.where(numpy.array(bggrid) == False, 1, 0))
+        # Cut the data into a stack of back_size_x by back_size_y tiles, so
+        # all tiles are clipped at once. Masked pixels and the padding of the
+        # tiles along the edges are NaN, which the clipping ignores.
+        nx = -(-my_xdim // self.back_size_x)
+        ny = -(-my_ydim // self.back_size_y)
+        if numpy.issubdtype(useful_data.dtype, numpy.floating):
+            dtype = useful_data.dtype
+        else:
+            dtype = numpy.float64
+        tiles = numpy.empty((nx * self.back_size_x, ny * self.back_size_y),
+                            dtype=dtype)
+        tiles.fill(numpy.nan)
+        tiles[:my_xdim, :my_ydim] = numpy.ma.filled(
+            useful_data.astype(dtype), numpy.nan)
+        tiles = tiles.reshape(nx, self.back_size_x, ny, self.back_size_y)
+        tiles = tiles.swapaxes(1, 2).reshape(
+            nx * ny, self.back_size_x * self.back_size_y)
+
+        usable, sigma, median, mean, num_clip_its = stats.sigma_clip_stack(
+            tiles, self.beam)
+
+        # In the case of a crowded field, the distribution will be
+        # skewed and we take the median as the background level.
+        # Otherwise, we take 2.5 * median - 1.5 * mean. This is the
+        # same as SExtractor: see discussion at
+        # <http://terapix.iap.fr/forum/showthread.php?tid=267>.
+        # (mean - median) / sigma is a quick n' dirty skewness
+        # estimator devised by Karl Pearson.
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            skewed = numpy.fabs(mean - median) / sigma >= 0.3
+        background = numpy.where(skewed, median, 2.5 * median - 1.5 * mean)
+        if usable.any():
+            sigmaclip_logger.debug(
+                '%d of %d tiles bg skewed, at most %d clipping iterations',
+                (skewed & usable).sum(), usable.sum(),
+                num_clip_its[usable].max())
+
+        # Tiles without a usable result are masked, as are tiles with a value
+        # of exactly zero.
+        rmsgrid = numpy.where(usable, sigma, 0).reshape(nx, ny)
+        bggrid = numpy.where(usable, background, 0).reshape(nx, ny)
+        rmsgrid = numpy.ma.array(rmsgrid, mask=(rmsgrid == 0))
+        bggrid = numpy.ma.array(bggrid, mask=(bggrid == 0))
 
         return {'rms': rmsgrid, 'bg': bggrid}
 
@@ -352,7 +379,8 @@ class ImageData(object):
     ###########################################################################
 
     def extract(self, det, anl, noisemap=None, bgmap=None, labelled_data=None,
-                labels=None, deblend_nthresh=0, force_beam=False):
+                labels=None, deblend_nthresh=0, force_beam=False,
+                fit_processes=1):
 
         """
         Kick off conventional (ie, RMS island finding) source extraction.
@@ -377,6 +405,9 @@ class ImageData(object):
             force_beam (bool): force all extractions to have major/minor axes
                 equal to the restoring beam
 
+            fit_processes (int): number of processes used to deblend and fit
+                the islands.
+
         Returns:
              :class:`tkp.utility.containers.ExtractionResults`
         """
@@ -413,7 +444,8 @@ class ImageData(object):
 
         return self._pyse(
             det * self.rmsmap, anl * self.rmsmap, deblend_nthresh, force_beam,
-            labelled_data=labelled_data, labels=labels
+            labelled_data=labelled_data, labels=labels,
+            fit_processes=fit_processes
         )
 
     def reverse_se(self, det):
@@ -437,11 +469,15 @@ class ImageData(object):
         return results
 
     def fd_extract(self, alpha, anl=None, noisemap=None,
-                   bgmap=None, deblend_nthresh=0, force_beam=False
+                   bgmap=None, deblend_nthresh=0, force_beam=False,
+                   fit_processes=1
     ):
         """False Detection Rate based source extraction.
         The FDR procedure guarantees that <FDR> < alpha.
 
+        fit_processes sets the number of processes used to deblend and fit
+        the islands, see extract().
+
         See `Hopkins et al., AJ, 123, 1086 (2002)
         <http://adsabs.harvard.edu/abs/2002AJ....123.1086H>`_.
         """
@@ -498,7 +534,8 @@ class ImageData(object):
         if not anl:
             anl = fdr_threshold
         return self._pyse(fdr_threshold * self.rmsmap, anl * self.rmsmap,
-                          deblend_nthresh, force_beam)
+                          deblend_nthresh, force_beam,
+                          fit_processes=fit_processes)
 
     def flux_at_pixel(self, x, y, numpix=1):
         """Return the background-subtracted flux at a certain position
@@ -796,7 +833,8 @@ class ImageData(object):
 
     def _pyse(
         self, detectionthresholdmap, analysisthresholdmap,
-        deblend_nthresh, force_beam, labelled_data=None, labels=[]
+        deblend_nthresh, force_beam, labelled_data=None, labels=[],
+        fit_processes=1
     ):
         """
         Run Python-based source extraction on this image.
@@ -820,6 +858,13 @@ class ImageData(object):
             labels (tuple): list of labels in the island map to use for
             fitting.
 
+            fit_processes (int): number of processes used to deblend and fit
+            the islands. The islands are handed out in fixed chunks and the
+            results are merged in label order, so the outcome doesn't depend
+            on this. A daemonic process, like a multiprocessing pool worker,
+            can't start processes, so there the islands are always fitted
+            sequentially.
+
         Returns:
 
             (..utility.containers.ExtractionResults):
@@ -877,12 +922,6 @@ class ImageData(object):
                 self.residuals_from_deblending[island.chunk] += (
                     island.data.filled(fill_value=0.))
 
-        # Deblend each of the islands to its consituent parts, if necessary
-        if deblend_nthresh:
-            deblended_list = map(lambda x: x.deblend(), island_list)
-            #deblended_list = [x.deblend() for x in island_list]
-            island_list = list(utils.flatten(deblended_list))
-
         # Set up the fixed fit parameters if 'force beam' is on:
         if force_beam:
             fixed = {'semimajor': self.beam[0],
@@ -891,11 +930,32 @@ class ImageData(object):
         else:
             fixed = None
 
-        # Iterate over the list of islands and measure the source in each,
-        # appending it to the results list.
+        # Deblend each of the islands to its consituent parts, if necessary,
+        # and measure the source in each.
+        if fit_processes > 1 and multiprocessing.current_process().daemon:
+            logger.warning("Can't start processes from a daemonic process, "
+                           "fitting the islands sequentially")
+            fit_processes = 1
+
+        if fit_processes > 1 and len(island_list) > 1:
+            # Fixed contiguous chunks, a few per process to balance the load.
+            size = -(-len(island_list) // (4 * fit_processes))
+            chunks = [(island_list[i:i + size], deblend_nthresh, fixed)
+                      for i in range(0, len(island_list), size)]
+            pool = multiprocessing.Pool(fit_processes)
+            try:
+                fitted = list(itertools.chain.from_iterable(
+                    pool.map(fit_islands, chunks, chunksize=1)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            fitted = fit_islands((island_list, deblend_nthresh, fixed))
+
+        # Iterate over the fitted islands, in label order, appending the
+        # measurements to the results list.
         results = containers.ExtractionResults()
-        for island in island_list:
-            fit_results = island.fit(fixed=fixed)
+        for island, fit_results in fitted:
             if fit_results:
                 measurement, residual = fit_results
             else:
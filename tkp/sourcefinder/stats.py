@@ -66,62 +66,149 @@ def sigma_clip(data, beam, sigma=unbiased_sigma, max_iter=100,
 
     max_iter sets the maximum number of iterations used.
 
-    my_iterations is a counter for recursive operation of the code; leave it
-    alone unless you really want to pretend to jump into the middle of a loop.
+    my_iterations and corr_clip are the starting values of the iteration
+    counter and the clipping correction; leave them alone unless you really
+    want to pretend to jump into the middle of the loop.
 
     sigma is subtle: if a callable is given, it is passed a copy of the data
     array and can calculate a clipping limit. See, for e.g., unbiased_sigma()
     defined above. However, if it isn't callable, sigma is assumed to just set
     a hard limit.
 
-    To do: Improve documentation
-            -Returns???
-            -How does it make use of the beam? (It estimates the noise correlation)
+    Returns a tuple of the clipped data, the unbiased standard deviation and
+    the centre of the data the last clip was based on, and the number of
+    iterations. The beam is used to estimate the number of independent
+    pixels, which corrects for the noise correlation.
     """
-    if my_iterations >= max_iter:
-        # Exceeded maximum number of iterations; return
-        return data, my_iterations
-
     # Numpy 1.1 breaks std() for MaskedArray: see
     # <http://www.scipy.org/scipy/numpy/wiki/MaskedArray>.
     # MaskedArray.compressed() returns a 1-D array of non-masked data.
     if isinstance(data, MaskedArray):
         data = data.compressed()
-    centre = centref(data)
-    N = numpy.size(data)
-    N_indep = indep_pixels(N, beam)
-    if N_indep < 1:
-        # This chunk is too small for processing; return an empty array.
-        return numpy.array([]), 0, 0, 0
-
-    # If sigma is callable, use it to dynamically calculate the clipping
-    # limits.
-    if callable(sigma):
-        my_sigma = sigma(N_indep)
-    else:
-        my_sigma = sigma
-
-    # distf=numpy.var is a sample variance with the factor N/(N-1)
-    # already built in, N being the number of pixels. So, we are
-    # going to remove that and replace it by N_indep/(N_indep-1)
-    clipped_var = distf(data) * (N - 1.) * N_indep / (N * (N_indep - 1.))
-    unbiased_var = corr_clip * clipped_var
-
-    # There is an extra factor c4 needed to get a unbiased standard
-    # deviation, unbiased if we disregard clipping bias, see
-    # http://en.wikipedia.org/wiki/Unbiased_estimation_of_standard_deviation\
-    #         #Results_for_the_normal_distribution
-    c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
-    unbiased_std = numpy.sqrt(unbiased_var) / c4
-
-    limit = my_sigma * unbiased_std
-
-    newdata = data.compress(abs(data - centre) <= limit)
-
-    if len(newdata) != len(data) and len(newdata) > 0:
+
+    while True:
+        centre = centref(data)
+        N = numpy.size(data)
+        N_indep = indep_pixels(N, beam)
+        if N_indep < 1:
+            # This chunk is too small for processing; return an empty array.
+            return numpy.array([]), 0, 0, 0
+
+        # If sigma is callable, use it to dynamically calculate the clipping
+        # limits.
+        if callable(sigma):
+            my_sigma = sigma(N_indep)
+        else:
+            my_sigma = sigma
+
+        # distf=numpy.var is a sample variance with the factor N/(N-1)
+        # already built in, N being the number of pixels. So, we are
+        # going to remove that and replace it by N_indep/(N_indep-1)
+        clipped_var = distf(data) * (N - 1.) * N_indep / (N * (N_indep - 1.))
+        unbiased_var = corr_clip * clipped_var
+
+        # There is an extra factor c4 needed to get a unbiased standard
+        # deviation, unbiased if we disregard clipping bias, see
+        # http://en.wikipedia.org/wiki/Unbiased_estimation_of_standard_deviation\
+        #         #Results_for_the_normal_distribution
+        c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
+        unbiased_std = numpy.sqrt(unbiased_var) / c4
+
+        limit = my_sigma * unbiased_std
+
+        newdata = data.compress(abs(data - centre) <= limit)
+
+        if (len(newdata) == len(data) or len(newdata) == 0 or
+                my_iterations >= max_iter):
+            return newdata, unbiased_std, centre, my_iterations
+
         corr_clip = var_helper(my_sigma)
         my_iterations += 1
-        return sigma_clip(newdata, beam, sigma, max_iter, centref, distf,
-                          my_iterations, corr_clip)
-    else:
-        return newdata, unbiased_std, centre, my_iterations
+        data = newdata
+
+
+def sigma_clip_stack(stack, beam, sigma=unbiased_sigma, max_iter=100):
+    """Iterative clipping of many samples at once
+
+    Does the same as sigma_clip() with the default centref and distf for
+    every row of the 2D array stack, but clips all rows in one go. NaN
+    entries are ignored, so rows of different lengths can be padded with
+    NaN.
+
+    Since clipping about the median always keeps a contiguous range of the
+    sorted data, the rows are sorted once and every iteration only shrinks a
+    window on them.
+
+    Returns a tuple of arrays with an entry per row: whether the row gave a
+    usable result, the unbiased standard deviation, the median, the mean of
+    the clipped data and the number of iterations. A row is not usable if it
+    contains no non-zero values before or after clipping, or if it has too
+    few independent pixels.
+    """
+    stack = numpy.asarray(stack)
+    if not numpy.issubdtype(stack.dtype, numpy.floating):
+        stack = stack.astype(numpy.float64)
+    # NaNs are sorted to the end of the rows
+    stack = numpy.sort(stack, axis=1)
+    n_rows, n_columns = stack.shape
+    columns = numpy.arange(n_columns)
+    rows = numpy.arange(n_rows)
+
+    present = ~numpy.isnan(stack)
+    start = numpy.zeros(n_rows, dtype=int)
+    size = present.sum(axis=1)
+    corr_clip = numpy.ones(n_rows)
+    iterations = numpy.zeros(n_rows, dtype=int)
+    std = numpy.zeros(n_rows)
+    centre = numpy.zeros(n_rows)
+    active = (present & (stack != 0)).any(axis=1)
+    usable = active.copy()
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        while active.any():
+            r = rows[active]
+            s = stack[r]
+            first, n = start[r], size[r]
+            window = (columns >= first[:, None]) & \
+                     (columns < (first + n)[:, None])
+            # mean of the middle two, like numpy.median()
+            index = numpy.arange(len(r))
+            centre_r = (s[index, first + (n - 1) // 2] +
+                        s[index, first + n // 2]) / 2.
+
+            N_indep = indep_pixels(n, beam)
+            if callable(sigma):
+                my_sigma = sigma(N_indep) * numpy.ones(len(r))
+            else:
+                my_sigma = sigma * numpy.ones(len(r))
+
+            mean = numpy.where(window, s, 0).sum(axis=1) / n
+            deviation = numpy.where(window, s - mean[:, None], 0)
+            var = (deviation * deviation).sum(axis=1) / n
+            clipped_var = var * (n - 1.) * N_indep / (n * (N_indep - 1.))
+            c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
+            std_r = numpy.sqrt(corr_clip[r] * clipped_var) / c4
+
+            limit = my_sigma * std_r
+            keep = window & (numpy.abs(s - centre_r[:, None]) <= limit[:, None])
+            new_size = keep.sum(axis=1)
+
+            too_small = N_indep < 1
+            done = (too_small | (new_size == n) | (new_size == 0) |
+                    (iterations[r] >= max_iter))
+
+            std[r], centre[r] = std_r, centre_r
+            start[r], size[r] = keep.argmax(axis=1), new_size
+            size[r[too_small]] = 0
+
+            going = ~done
+            corr_clip[r[going]] = var_helper(my_sigma[going])
+            iterations[r[going]] += 1
+            active[r[done]] = False
+
+    window = (columns >= start[:, None]) & (columns < (start + size)[:, None])
+    clipped = numpy.where(window, stack, 0)
+    usable &= (size > 0) & (clipped != 0).any(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean = clipped.sum(axis=1) / size
+    return usable, std, centre, mean, iterations
@@ -7,6 +7,11 @@ import math
 import scipy.integrate
 from tkp.sourcefinder.gaussian import gaussian
 from tkp.utility import coordinates
+from tkp.utility.memoize import MemoizeFunction
+
+# The beam is the same for all islands of an image, so the corrections
+# below are only integrated once per beam shape.
+BEAM_CACHE_SIZE = 64
 
 def generate_subthresholds(min_value, max_value, num_thresholds):
     """
@@ -138,6 +143,7 @@ def calculate_beamsize(semimajor, semiminor):
     return numpy.pi * semimajor * semiminor
 
 
+@MemoizeFunction(maxsize=BEAM_CACHE_SIZE)
 def fudge_max_pix(semimajor, semiminor, theta):
     """Estimate peak flux correction at pixel of maximum flux
 
@@ -175,6 +181,7 @@ def fudge_max_pix(semimajor, semiminor, theta):
     return correction
 
 
+@MemoizeFunction(maxsize=BEAM_CACHE_SIZE)
 def maximum_pixel_method_variance(semimajor, semiminor, theta):
     """Estimate variance for peak flux at pixel position of maximum
 
@@ -6,9 +6,13 @@ We keep them separately to make the pipeline logic easier to read at a glance.
 
 import datetime
 import ConfigParser
+import json
 import logging
 import os
+import sys
+import threading
 from pprint import pprint
+from Queue import Queue
 
 from collections import defaultdict, namedtuple
 
@@ -143,6 +147,70 @@ ImageMetadataForSort = namedtuple('ImageMetadataForSort', [
     'frequency',
 ])
 
+_index_time_format = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def image_signature(path):
+    """
+    Returns the (mtime, size) of an image, used to detect a changed image.
+
+    CASA images are directories, for these we use the table.dat file which
+    holds the keywords.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'table.dat')
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def load_metadata_index(path):
+    """
+    Load an index of image ordering metadata written by
+    store_metadata_index().
+
+    Args:
+        path (str): location of the index file
+
+    Returns:
+        dict: image path -> (signature, ImageMetadataForSort), empty if
+            there is no (readable) index at path
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+        index = {}
+        for url, (mtime, size, timestamp, frequency) in entries.items():
+            # json gives us unicode, the accessors expect a plain str path
+            url = url.encode('utf-8')
+            timestamp = datetime.datetime.strptime(timestamp,
+                                                   _index_time_format)
+            index[url] = ((mtime, size),
+                          ImageMetadataForSort(url, timestamp, frequency))
+    except (IOError, ValueError, TypeError) as e:
+        logger.warning("ignoring unreadable metadata index %s: %s" % (path, e))
+        return {}
+    return index
+
+
+def store_metadata_index(path, index):
+    """
+    Write an index as returned by load_metadata_index() to path.
+
+    The index is written to a temporary file first, so an interrupted job
+    never leaves a truncated index behind.
+    """
+    entries = {}
+    for url, ((mtime, size), metadata) in index.items():
+        entries[url] = (mtime, size,
+                        metadata.timestamp.strftime(_index_time_format),
+                        float(metadata.frequency))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(entries, f)
+    os.rename(tmp_path, path)
+
 
 def group_per_timestep(metadatas):
     """
@@ -176,3 +244,68 @@ def group_per_timestep(metadatas):
     # only return the urls
     return [(stamp, [m.url for m in metas]) for stamp, metas in grouped_tuple]
 
+
+
+def prefetch(func, iterable, depth=1):
+    """
+    Applies func to the items of iterable in a background thread, staying at
+    most depth items ahead of the consumer.
+
+    This is used to overlap the work on a next timestep (image I/O, quality
+    checking, source extraction) with the database work on the current one.
+    Results are yielded in the order of iterable. Exceptions raised by func
+    are not propagated but yielded, so the consumer can decide what to do with
+    a failed item without losing the items after it. An exception raised by
+    iterable itself is raised in the consumer, after the items prepared
+    before it have been yielded.
+
+    Args:
+        func (callable): called with a single item of iterable
+        iterable (iterable): items to process, may be an endless generator
+        depth (int): maximum number of processed items waiting to be consumed.
+                     0 disables the background thread, func is then
+                     called inline when the consumer asks for the next item.
+
+    Returns:
+        generator: yielding (item, result, exception) tuples. Either result or
+            exception is None.
+    """
+    if depth < 1:
+        for item in iterable:
+            try:
+                yield item, func(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+
+    done = object()
+    queue = Queue(maxsize=depth)
+    # exc_info of the iterable, if it failed
+    failure = []
+
+    def producer():
+        try:
+            for item in iterable:
+                try:
+                    result = func(item)
+                except Exception as e:
+                    queue.put((item, None, e))
+                else:
+                    queue.put((item, result, None))
+        except Exception:
+            # the iterable itself failed, nothing more will come
+            failure.append(sys.exc_info())
+        finally:
+            queue.put(done)
+
+    thread = threading.Thread(target=producer, name='prefetch_thread')
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        entry = queue.get()
+        if entry is done:
+            break
+        yield entry
+    if failure:
+        raise failure[0][0], failure[0][1], failure[0][2]
@@ -10,8 +10,10 @@ from astropy.io.fits import open as fits_open
 from casacore.images import image as casacore_image
 
 import tkp.accessors
+import tkp.db.cache
 from tkp.db.database import Database
 from tkp.db.orm import DataSet, Image
+from tkp.db.alchemy.image import insert_images
 from tkp.quality.rms import rms_with_clipped_subregion
 
 logger = logging.getLogger(__name__)
@@ -73,11 +75,27 @@ def store_images_in_db(images_metadata, extraction_radius_pix, dataset_id, bandw
         dataset_id: dataset id to be used. don't use value from parset file
                     since this can be -1 (TraP way of setting auto increment)
     Returns:
-        the database ID of this dataset
+        the database IDs of the images, sorted by timestamp
+    """
+    db_images = register_images(images_metadata, extraction_radius_pix,
+                                dataset_id, bandwidth_max)
+    return [db_image.id for db_image in db_images]
+
+
+def register_images(images_metadata, extraction_radius_pix, dataset_id,
+                    bandwidth_max):
+    """
+    Add the images of a timestep to the database in one go, see
+    :func:`tkp.db.alchemy.image.insert_images`, with a single commit.
+
+    Args: see store_images_in_db()
+
+    Returns:
+        list: of tkp.db.orm.Image objects, sorted by timestamp (the order of
+            images_metadata after the call)
     """
     database = Database()
     dataset = DataSet(id=dataset_id, database=database)
-    image_ids = []
 
     # sort images by timestamp
     images_metadata.sort(key=lambda m: m['taustart_ts'])
@@ -85,15 +103,38 @@ def store_images_in_db(images_metadata, extraction_radius_pix, dataset_id, bandw
     for metadata in images_metadata:
         metadata['freq_bw_max'] = bandwidth_max
         metadata['xtr_radius'] = extraction_radius_pix * abs(metadata['deltax'])
-        filename = metadata['url']
-        db_image = Image(data=metadata, dataset=dataset)
-        image_ids.append(db_image.id)
-        logger.debug("stored %s with ID %s" % (os.path.basename(filename),
-                                              db_image.id))
-    return image_ids
 
+    try:
+        rows = insert_images(database.session, dataset_id, images_metadata)
+        database.session.commit()
+    except Exception as e:
+        logger.error("error inserting images, %s: %s" % (type(e).__name__,
+                                                         str(e)))
+        database.session.rollback()
+        # the new bands and skyregions may have been cached
+        tkp.db.cache.invalidate(dataset_id)
+        raise
+
+    db_images = []
+    for metadata, row in zip(images_metadata, rows):
+        logger.debug("stored %s with ID %s" % (os.path.basename(metadata['url']),
+                                              row['id']))
+        db_images.append(Image.from_row(row, dataset))
+    return db_images
+
+
+def get_accessors(images, shm_dir=None):
+    """
+    Open images as accessors.
 
-def get_accessors(images):
+    args:
+        images (tuple): list of things tkp.accessors can handle
+        shm_dir (str): if given, move the pixel data of the accessors into
+                       shared memory segments in this directory, see
+                       tkp.accessors.DataAccessor.share_data()
+    returns:
+        list: of accessors
+    """
     results = []
     for image in images:
         try:
@@ -102,6 +143,8 @@ def get_accessors(images):
             logger.error("Can't open image %s: %s" % (image, e))
             raise
         else:
+            if shm_dir:
+                accessor.share_data(shm_dir)
             results.append(accessor)
     return results
 
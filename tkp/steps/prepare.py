@@ -0,0 +1,58 @@
+"""
+This `step` does all the per image work which doesn't need the database in one
+go, so an image has to be shipped to a worker process only once per timestep.
+"""
+import logging
+from collections import namedtuple
+
+import tkp.steps.persistence
+import tkp.steps.quality
+import tkp.steps.source_extraction
+
+logger = logging.getLogger(__name__)
+
+
+# Short-lived struct for returning the results of prepare_image(). The
+# extraction is None if the image was rejected.
+PreparedImage = namedtuple('PreparedImage', ['accessor',
+                                             'metadata',
+                                             'rejected',
+                                             'extraction'])
+
+
+def prepare_image(image, job_config, shm_dir=None):
+    """
+    Opens an image, extracts the metadata and the rms_qc, runs the telescope
+    specific quality checks and, if the image is not rejected, does the blind
+    source extraction.
+
+    The database side quality checks (see
+    :py:func:`tkp.quality.rms.reject_historical_rms`) still need to be applied
+    on the result.
+
+    args:
+        image: something tkp.accessors can handle, like a path or a HDUList
+        job_config: a tkp job config object
+        shm_dir (str): if set, keep the pixel data of the accessor in shared
+                       memory in this directory.
+
+    returns:
+        PreparedImage: the accessor, metadata dict, rejection (or None) and
+            ExtractionResults (or None)
+    """
+    accessor = tkp.steps.persistence.get_accessors([image], shm_dir)[0]
+
+    persistence = job_config.persistence
+    metadata = tkp.steps.persistence.extract_metadatas(
+        [accessor], persistence.rms_est_sigma, persistence.rms_est_fraction)[0]
+
+    rejected = tkp.steps.quality.reject_check(accessor, job_config)
+    if rejected:
+        logger.debug("skipping extraction for rejected image %s" % accessor.url)
+        extraction = None
+    else:
+        extraction = tkp.steps.source_extraction.extract_sources(
+            accessor, job_config.source_extraction)
+
+    return PreparedImage(accessor=accessor, metadata=metadata,
+                         rejected=rejected, extraction=extraction)
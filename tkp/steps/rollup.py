@@ -0,0 +1,53 @@
+import logging
+
+from tkp.db.alchemy.rollup import RESOLUTIONS, rollup_lightcurves,\
+    prune_lightcurves, truncate
+from tkp.db.model import Dataset
+from tkp.db import Database
+
+logger = logging.getLogger(__name__)
+
+
+def execute_rollup(dataset_id, before, prune=False, session=None):
+    """
+    Roll up the lightcurves of a dataset into per minute, hour and day bins,
+    and optionally delete the individual measurements that are rolled up.
+    Will create a database session if none is supplied.
+
+    args:
+        dataset_id: the ID of the dataset to roll up
+        before (datetime.datetime): roll up the complete bins before this
+                                    timestamp
+        prune: if True, delete the measurements of the images in the day
+               bins that were rolled up
+        session: An optional SQLAlchemy session
+
+    returns:
+        dict: the number of rows inserted per resolution, and deleted per
+              table if pruned
+    """
+    if not session:
+        database = Database()
+        session = database.Session()
+
+    dataset = Dataset(id=dataset_id)
+    counts = {}
+    for resolution in RESOLUTIONS:
+        insert_ = rollup_lightcurves(session, dataset=dataset,
+                                     resolution=resolution, before=before)
+        counts[resolution] = session.execute(insert_).rowcount
+
+    if prune:
+        # only the images in complete day bins are rolled up at every
+        # resolution
+        cutoff = truncate(before, 'day')
+        statements = prune_lightcurves(session, dataset=dataset,
+                                       before=cutoff)
+        for delete_ in statements:
+            table = delete_.table.name
+            counts[table] = counts.get(table, 0) + \
+                session.execute(delete_).rowcount
+    session.commit()
+    logger.info("rolled up lightcurves of dataset %s: %s" % (dataset_id,
+                                                              counts))
+    return counts
@@ -45,7 +45,8 @@ def extract_sources(accessor, extraction_params):
         det=extraction_params['detection_threshold'],
         anl=extraction_params['analysis_threshold'],
         deblend_nthresh=extraction_params['deblend_nthresh'],
-        force_beam=extraction_params['force_beam']
+        force_beam=extraction_params['force_beam'],
+        fit_processes=extraction_params.get('fit_processes', 1)
     )
     logger.debug("Detected %d sources in image %s" % (len(results), accessor.url))
 
@@ -1,9 +1,19 @@
-from tkp.db.alchemy.varmetric import store_varmetric, del_duplicate_varmetric
-from tkp.db.model import Dataset
+import logging
+
+from tkp.db.alchemy.varmetric import store_varmetric, del_duplicate_varmetric,\
+    touched_runcats, _combined
+from tkp.db.model import Dataset, Varmetric, Runningcatalog
 from tkp.db import Database
 
+logger = logging.getLogger(__name__)
+
+# columns of the varmetric table compared by check_varmetric()
+varmetric_fields = ['v_int', 'eta_int', 'band', 'newsource', 'sigma_rms_max',
+                    'sigma_rms_min', 'lightcurve_max', 'lightcurve_avg',
+                    'lightcurve_median']
+
 
-def execute_store_varmetric(dataset_id, session=None):
+def execute_store_varmetric(dataset_id, session=None, image_ids=None):
     """
     Executes the storing varmetric function. Will create a database session
     if none is supplied.
@@ -12,14 +22,82 @@ def execute_store_varmetric(dataset_id, session=None):
         dataset_id: the ID of the dataset for which you want to store the
                     varmetrics
         session: An optional SQLAlchemy session
+        image_ids: if given, only update the varmetrics of the runcats
+                   associated with a source in these images. The others
+                   don't change, so this gives the same result as updating
+                   the whole dataset.
     """
     if not session:
         database = Database()
         session = database.Session()
 
     dataset = Dataset(id=dataset_id)
-    delete_ = del_duplicate_varmetric(session=session, dataset=dataset)
+    runcats = None
+    if image_ids is not None:
+        if not image_ids:
+            return
+        runcats = touched_runcats(session, image_ids)
+    delete_ = del_duplicate_varmetric(session=session, dataset=dataset,
+                                      runcats=runcats)
     session.execute(delete_)
-    insert_ = store_varmetric(session, dataset=dataset)
+    insert_ = store_varmetric(session, dataset=dataset, runcats=runcats)
     session.execute(insert_)
     session.commit()
+
+
+def _equal(stored, expected, rel_tol=1e-9):
+    if stored is None or expected is None:
+        return stored is expected
+    if isinstance(expected, float) or isinstance(stored, float):
+        return abs(stored - expected) <= rel_tol * max(abs(stored),
+                                                       abs(expected))
+    return stored == expected
+
+
+def check_varmetric(dataset_id, session=None):
+    """
+    Verify the stored varmetrics of a dataset against a full recalculation,
+    for example after the incremental updates of execute_store_varmetric().
+
+    args:
+        dataset_id: the ID of the dataset to check
+        session: An optional SQLAlchemy session
+
+    returns:
+        list: runcat ids of which the stored varmetric is missing, superfluous
+              or differs from the recalculated one
+    """
+    if not session:
+        database = Database()
+        session = database.Session()
+
+    dataset = Dataset(id=dataset_id)
+    subquery = _combined(session, dataset=dataset)
+    expected = {}
+    fields = ['runcat'] + varmetric_fields
+    for row in session.query(*fields).select_from(subquery):
+        expected[row[0]] = tuple(row[1:])
+
+    stored = {}
+    columns = [Varmetric.v_int, Varmetric.eta_int, Varmetric.band_id,
+               Varmetric.newsource, Varmetric.sigma_rms_max,
+               Varmetric.sigma_rms_min, Varmetric.lightcurve_max,
+               Varmetric.lightcurve_avg, Varmetric.lightcurve_median]
+    query = session.query(Varmetric.runcat_id, *columns). \
+        join(Runningcatalog, Varmetric.runcat_id == Runningcatalog.id). \
+        filter(Runningcatalog.dataset == dataset)
+    for row in query:
+        stored[row[0]] = tuple(row[1:])
+
+    inconsistent = set(expected.keys()) ^ set(stored.keys())
+    for runcat in set(expected.keys()) & set(stored.keys()):
+        for field, s, e in zip(varmetric_fields, stored[runcat],
+                               expected[runcat]):
+            if not _equal(s, e):
+                logger.debug("varmetric %s of runcat %s is %s, expected %s" %
+                             (field, runcat, s, e))
+                inconsistent.add(runcat)
+    if inconsistent:
+        logger.warning("inconsistent varmetrics for %s runcats of dataset %s"
+                       % (len(inconsistent), dataset_id))
+    return sorted(inconsistent)
@@ -5,7 +5,9 @@ data version 1. We implemented an emulator for this stream in
 """
 from __future__ import print_function
 
+import errno
 import logging
+import select
 import socket
 import StringIO
 import struct
@@ -15,8 +17,10 @@ import numpy as np
 import time
 import dateutil.parser
 
-from Queue import Full
-from multiprocessing import Manager
+from Queue import Queue, Empty, Full
+from threading import Thread
+
+from tkp.utility.sharedmem import SharedRing, SlotOverwritten
 
 
 # the checksum is used to check if we are not drifting in the data flow
@@ -25,8 +29,20 @@ CHECKSUM = 0x47494A53484F4D4F
 # how many images groups do we keep before we start dropping
 BACK_LOG = 10
 
-# use this for debugging. Will not fork processes but run everything threaded
-THREADED = False
+# length of the AARTFAAC header preceding every window
+HEADER_LENGTH = 512
+
+# the receive throughput of a connection is logged every this many windows
+REPORT_WINDOWS = 60
+
+# seconds the merger waits for the missing bands of a timestep, and the
+# number of timesteps it keeps open for images that arrive out of order
+DEADLINE = 1.0
+REORDER = 2
+
+# seconds to wait before reconnecting, doubled after every failed attempt
+MIN_BACKOFF = 1
+MAX_BACKOFF = 30
 
 logger = logging.getLogger(__name__)
 
@@ -34,13 +50,18 @@ logger = logging.getLogger(__name__)
 def extract_timestamp(hdulist):
     """
     args:
-        hdulist (astropy.io.fits.HDUList): fits header to extract timestamp from
+        hdulist (astropy.io.fits.HDUList): fits header to extract timestamp
+                                           from, or a RingImage
 
     returns:
         datetime.datetime: extracted timestamp
 
     """
-    return dateutil.parser.parse(hdulist[0].header['date-obs'])
+    if isinstance(hdulist, RingImage):
+        header = hdulist.header
+    else:
+        header = hdulist[0].header
+    return dateutil.parser.parse(header['date-obs'])
 
 
 def getbytes(socket_, bytes_):
@@ -64,32 +85,110 @@ def getbytes(socket_, bytes_):
     return result.getvalue()
 
 
-def read_window(socket_):
+def recv_into(socket_, buffer_):
+    """
+    Fill a buffer from the socket, without copying the received chunks.
+
+    args:
+        socket_ (socket.socket): socket to use for reading
+        buffer_ (bytearray): buffer to fill completely
+    """
+    view = memoryview(buffer_)
+    offset = 0
+    length = len(buffer_)
+    while offset < length:
+        count = socket_.recv_into(view[offset:], length - offset)
+        if count == 0:
+            raise socket.error("Server closed connection")
+        offset += count
+
+
+class WindowBuffers(object):
+    """
+    The receive buffers of a connection, reused for every window as long
+    as its size doesn't change. Also keeps track of the receive throughput.
+
+    Since the image of a window is decoded as a view on its buffer, it is
+    overwritten by the next window. Set reuse to False if the images are
+    kept around, like the images queued by ingest().
+
+    args:
+        reuse (bool): reuse the image buffer for the next window
+    """
+    def __init__(self, reuse=True):
+        self.reuse = reuse
+        self.header = bytearray(HEADER_LENGTH)
+        self.fits = bytearray()
+        self.image = bytearray()
+        self.reset()
+
+    def reset(self):
+        self.windows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def buffer(self, name, length):
+        """
+        The buffer of the given name, of exactly length bytes.
+        """
+        buffer_ = getattr(self, name)
+        if len(buffer_) != length or (name == 'image' and not self.reuse):
+            buffer_ = bytearray(length)
+            setattr(self, name, buffer_)
+        return buffer_
+
+    def record(self, bytes_, seconds):
+        self.windows += 1
+        self.bytes += bytes_
+        self.seconds += seconds
+
+    def throughput(self):
+        """
+        returns:
+            float: MB/s received and decoded since the last reset, not
+                   counting the time waiting for a window to start
+        """
+        if not self.seconds:
+            return 0.0
+        return self.bytes / self.seconds / 1e6
+
+
+def read_window(socket_, buffers=None):
     """
     read raw aarfaac protocol window
 
     args:
         socket_ (socket.socket): socket to read from
+        buffers (WindowBuffers): receive buffers to reuse
     returns:
-        fits_bytes, image_bytes
+        fits_bytes, image_bytes: the FITS header as a str, the image data
+                                 as a bytearray
     """
-    header_bytes = getbytes(socket_, 512)
-    magic = struct.unpack('Q', header_bytes[:8])[0]
-    fits_length = struct.unpack('=L', header_bytes[8:12])[0]
-    array_length = struct.unpack('=L', header_bytes[12:16])[0]
+    if buffers is None:
+        buffers = WindowBuffers(reuse=False)
+    header = buffers.header
+    recv_into(socket_, header)
+    start = time.time()
+    magic, fits_length, array_length = struct.unpack_from('=QLL', header)
     assert magic == CHECKSUM, str(magic) + '!=' + str(CHECKSUM)
-    fits_bytes = getbytes(socket_, fits_length)
-    image_bytes = getbytes(socket_, array_length)
-    return fits_bytes, image_bytes
+    fits_buffer = buffers.buffer('fits', fits_length)
+    recv_into(socket_, fits_buffer)
+    image_bytes = buffers.buffer('image', array_length)
+    recv_into(socket_, image_bytes)
+    buffers.record(HEADER_LENGTH + fits_length + array_length,
+                   time.time() - start)
+    return str(fits_buffer), image_bytes
 
 
 def reconstruct_fits(fits_bytes, image_bytes):
     """
     reconstruct a fits object from serialised fits header and data.
 
+    The image is a float32 view on image_bytes, it is not copied.
+
     args:
         fits_bytes (str): a string with serialized fits bytes
-        image_bytes (str): a string with serialized image data
+        image_bytes (str or bytearray): serialized image data
     returns:
         astropy.io.fits.HDUList: the fits object
 
@@ -97,136 +196,518 @@ def reconstruct_fits(fits_bytes, image_bytes):
     hdu_header = astropy.io.fits.header.Header.fromstring(fits_bytes)   
     width = hdu_header["NAXIS1"]
     length = hdu_header["NAXIS2"]
-    image_array = struct.unpack(str(len(image_bytes)/4) + 'f', image_bytes)
-    image_matrix = np.reshape(image_array, (width, length))
+    image_array = np.frombuffer(image_bytes, dtype=np.float32)
+    image_matrix = image_array.reshape((width, length))
     hdu = astropy.io.fits.PrimaryHDU(image_matrix)
     hdu.header = hdu_header
     hdulist = astropy.io.fits.HDUList([hdu])
     return hdulist
 
 
-def connection_handler(socket_, image_queue):
+class StreamRing(object):
     """
-    Handles the connection, waits until a windows is returned and puts it in
-    the queue.
+    The shared memory ring the connections receive the image pixels in, see
+    :class:`tkp.utility.sharedmem.SharedRing`. It is created when the first
+    window arrives, with slots of the size of its image.
 
-    Daemon thread, will loop forever.
+    args:
+        directory (str): where to create the ring segment
+        slots (int): number of slots
+        policy (str): 'drop-oldest' or 'drop-newest'
+    """
+    def __init__(self, directory, slots, policy='drop-oldest'):
+        self.directory = directory
+        self.slots = slots
+        self.policy = policy
+        self.ring = None
+
+    @property
+    def dropped(self):
+        return self.ring.dropped if self.ring else 0
+
+    def accepts(self, length):
+        """
+        returns:
+            bool: True if an image of length bytes fits in a slot
+        """
+        if not self.ring:
+            self.ring = SharedRing(self.directory, length, self.slots,
+                                   self.policy)
+            logger.info("created ring of {} slots of {} bytes in {}".format(
+                self.slots, length, self.ring.path))
+        if length != self.ring.slot_bytes:
+            logger.warning("image of {} bytes doesn't match the ring slots "
+                           "of {} bytes".format(length, self.ring.slot_bytes))
+            return False
+        return True
+
+    def reserve(self):
+        return self.ring.reserve()
+
+    def view(self, slot):
+        return self.ring.view(slot)
+
+    def handle(self, slot):
+        return self.ring.handle(slot, (self.ring.slot_bytes // 4,),
+                                np.float32)
+
+    def release(self, handle):
+        self.ring.release(handle.slot, handle.sequence)
+
+    def unlink(self):
+        if self.ring:
+            self.ring.unlink()
+
+
+class RingImage(object):
+    """
+    A stream image with its pixels in a slot of a StreamRing. Only the FITS
+    header and the slot handle are pickled, so pool workers map the pixels
+    read-only instead of receiving a copy.
 
     args:
-        socket_ (socket.socket): socket used for reading
-        image_queue (Queue.Queue): used for putting images in
+        fits_bytes (str): the serialized FITS header
+        slot (tkp.utility.sharedmem.RingSlot): the slot with the pixels
+        ring (StreamRing): the ring, in the process that owns it
     """
-    while True:
-        try:
-            fits_bytes, image_bytes = read_window(socket_)
-        except Exception as e:
-            logger.error("error reading data: {}".format(str(e)))
-            logger.info("sleeping for 5 seconds")
-            time.sleep(5)
-            break
-        else:
-            hdulist = reconstruct_fits(fits_bytes, image_bytes)
-            image_queue.put(hdulist)
+    def __init__(self, fits_bytes, slot, ring=None):
+        self.fits_bytes = fits_bytes
+        self.slot = slot
+        self._ring = ring
+        self._header = None
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = astropy.io.fits.header.Header.fromstring(
+                self.fits_bytes)
+        return self._header
+
+    def hdulist(self):
+        """
+        The view isn't checked, copy the data and call verify() afterwards.
+
+        returns:
+            astropy.io.fits.HDUList: the image, with a read-only view on the
+                                     slot as data
+        """
+        return reconstruct_fits(self.fits_bytes, self.slot.attach())
+
+    def verify(self):
+        """
+        Raise SlotOverwritten if the slot has been written again, to be
+        called once the pixels are copied out of the slot.
+        """
+        if not self.slot.current():
+            raise SlotOverwritten("stream image {} overwritten in the "
+                                  "ring".format(self.header['date-obs']))
+
+    def release(self):
+        """
+        Free the slot, in the process that owns the ring.
+        """
+        if self._ring:
+            self._ring.release(self.slot)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_ring'] = None
+        state['_header'] = None
+        return state
+
+
+def release_images(images):
+    """
+    Free the ring slots of the RingImages among images, once they are
+    processed or dropped.
+    """
+    for image in images:
+        if isinstance(image, RingImage):
+            image.release()
 
 
-def connector(host, port, image_queue):
+class Connection(object):
     """
-    Tries to connect to a specific host and port, if succesfull will call
-    connection_handler() with the connection.
+    A non-blocking connection to one host and port of the stream, with the
+    state of the window being received.
 
     args:
         host (str): host to connect to
         port (int): port to connect to
-        image_queue (Queue.Queue): Will be used for putting the images in
-
+        ring (StreamRing): if given, the images are received in a slot of
+                           the ring and passed on as RingImage
     """
-    while True:
-        logger.info("connecting to {}:{}".format(host, port))
+    def __init__(self, host, port, ring=None):
+        self.host = host
+        self.port = port
+        self.ring = ring
+        self.socket = None
+        self.connecting = False
+        self.stage = None
+        # handle of the ring slot the image is received in
+        self.slot = None
+        self.buffers = WindowBuffers(reuse=False)
+        self.backoff = MIN_BACKOFF
+        self.retry_at = 0
+        self.reconnects = 0
+        self.windows = 0
+        self.bytes = 0
+        self.throughput = 0.0
+
+    def __str__(self):
+        return "{}:{}".format(self.host, self.port)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def connect(self):
+        """
+        Start connecting, ingest() waits until the socket is writable.
+        """
+        logger.info("connecting to {}".format(self))
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(0)
+        error = self.socket.connect_ex((self.host, self.port))
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.close(socket.error(error, errno.errorcode.get(error)))
+        else:
+            self.connecting = True
+
+    def connected(self):
+        """
+        Called when the socket becomes writable while connecting.
+        """
+        error = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            self.close(socket.error(error, errno.errorcode.get(error)))
+            return
+        logger.info("connected to {}".format(self))
+        self.connecting = False
+        self._expect('header', HEADER_LENGTH)
+
+    def close(self, error):
+        """
+        Close the socket after an error, and schedule a reconnect.
+        """
+        logger.error("connection to {} failed: {}, reconnecting in {} "
+                     "seconds".format(self, error, self.backoff))
+        if self.socket:
+            self.socket.close()
+        if self.stage == 'image' and self.slot is not None:
+            # the image was only partly received
+            self.ring.release(self.slot)
+        self.socket = None
+        self.connecting = False
+        self.stage = None
+        self.slot = None
+        self.reconnects += 1
+        self.retry_at = time.time() + self.backoff
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+    def _expect(self, stage, length, target=None):
+        self.stage = stage
+        if target is None:
+            target = self.buffers.buffer(stage, length)
+        self.target = target
+        self.view = memoryview(self.target)
+        self.offset = 0
+
+    def receive(self):
+        """
+        Receive what is available on the socket.
+
+        returns:
+            astropy.io.fits.HDUList: the image, or a RingImage, if a window
+                                     was completed
+        """
         try:
-            socket_ = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            socket_.settimeout(5)
-            socket_.connect((host, port))
+            count = self.socket.recv_into(self.view[self.offset:],
+                                          len(self.target) - self.offset)
         except socket.error as e:
-            logger.error("cant connect to {}:{}: {}".format(host, port, str(e)))
-            logger.info("will try reconnecting in 5 seconds")
-            time.sleep(5)
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return None
+            raise
+        if count == 0:
+            raise socket.error("Server closed connection")
+        self.offset += count
+        if self.offset < len(self.target):
+            return None
+
+        if self.stage == 'header':
+            self.start = time.time()
+            magic, fits_length, self.array_length = struct.unpack_from(
+                '=QLL', self.target)
+            if magic != CHECKSUM:
+                raise ValueError(str(magic) + '!=' + str(CHECKSUM))
+            self._expect('fits', fits_length)
+        elif self.stage == 'fits':
+            self.fits_bytes = str(self.target)
+            self.slot = None
+            self.dropping = False
+            if self.ring and self.ring.accepts(self.array_length):
+                slot = self.ring.reserve()
+                # if the ring is full the window is received and dropped
+                self.dropping = slot is None
+                if slot is not None:
+                    self.slot = self.ring.handle(slot)
+            if self.slot is not None:
+                self._expect('image', self.array_length,
+                             self.ring.view(self.slot.slot))
+            else:
+                self._expect('image', self.array_length)
         else:
-            logger.info("connected to {}:{}".format(host, port))
-            connection_handler(socket_, image_queue)
+            if self.slot is not None:
+                image = RingImage(self.fits_bytes, self.slot, self.ring)
+                self.slot = None
+            elif self.dropping:
+                logger.warning("ring full, dropping image from {}".format(self))
+                image = None
+            else:
+                image = reconstruct_fits(self.fits_bytes, self.target)
+            length = HEADER_LENGTH + len(self.fits_bytes) + len(self.target)
+            self._record(length, time.time() - self.start)
+            self._expect('header', HEADER_LENGTH)
+            return image
+
+    def _record(self, bytes_, seconds):
+        self.backoff = MIN_BACKOFF
+        self.windows += 1
+        self.bytes += bytes_
+        buffers = self.buffers
+        buffers.record(bytes_, seconds)
+        if buffers.windows == REPORT_WINDOWS:
+            self.throughput = buffers.throughput()
+            logger.info("{}: received {} windows, {:.1f} MB/s".format(
+                self, buffers.windows, self.throughput))
+            buffers.reset()
+
+
+def ingest(connections, image_queue, metrics=None):
+    """
+    Receive the windows of all connections in a single event loop and put
+    the decoded images in the queue, or drop them if the queue is full.
+    Connections that fail are reconnected with an exponential backoff.
 
+    Daemon thread, will loop forever.
 
-def merger(image_queue, grouped_queue):
+    args:
+        connections (list): Connection objects
+        image_queue (Queue.Queue): used for putting images in
+        metrics (StreamMetrics): counts the dropped images
     """
-    Will monitor image_queue for images and group them by timestamp. When an
-    image with an successive timestamp is received the group is put on the
-    grouped queue.
+    while True:
+        now = time.time()
+        for connection in connections:
+            if not connection.socket and connection.retry_at <= now:
+                connection.connect()
+
+        readers = [c for c in connections if c.socket and not c.connecting]
+        writers = [c for c in connections if c.connecting]
+        waiting = [c.retry_at - now for c in connections if not c.socket]
+        timeout = max(0, min(waiting + [1.0]))
+        if not (readers or writers):
+            time.sleep(timeout)
+            continue
+
+        try:
+            readable, writable, _ = select.select(readers, writers, [],
+                                                  timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for connection in writable:
+            connection.connected()
+        for connection in readable:
+            try:
+                hdulist = connection.receive()
+            except Exception as e:
+                connection.close(e)
+            else:
+                if hdulist is not None:
+                    try:
+                        image_queue.put(hdulist, block=False)
+                    except Full:
+                        logger.error("image queue full ({}), dropping image "
+                                     "from {}".format(image_queue.qsize(),
+                                                      connection))
+                        release_images([hdulist])
+                        if metrics:
+                            metrics.dropped_images += 1
+
+
+class StreamMetrics(object):
+    """
+    The state of the stream ingest: the depth of the queue of grouped
+    images, the number of dropped and incomplete groups, of dropped and late
+    images (also those dropped or overwritten in the ring) and the
+    throughput of every connection.
+    """
+    def __init__(self):
+        self.connections = []
+        self.grouped_queue = None
+        self.ring = None
+        self.dropped_groups = 0
+        self.dropped_images = 0
+        self.incomplete_groups = 0
+        self.late_images = 0
+
+    def summary(self):
+        """
+        returns:
+            dict: the metrics, with a dict per connection
+        """
+        connections = {}
+        for c in self.connections:
+            connections[str(c)] = {'connected': bool(c.socket) and
+                                                not c.connecting,
+                                   'reconnects': c.reconnects,
+                                   'windows': c.windows,
+                                   'bytes': c.bytes,
+                                   'throughput': c.throughput}
+        depth = self.grouped_queue.qsize() if self.grouped_queue else 0
+        return {'queue_depth': depth,
+                'dropped_groups': self.dropped_groups,
+                'dropped_images': self.dropped_images,
+                'incomplete_groups': self.incomplete_groups,
+                'late_images': self.late_images,
+                'ring_dropped': self.ring.dropped if self.ring else 0,
+                'connections': connections}
+
+
+def _put_group(grouped_queue, images, metrics):
+    """
+    Put a group on the grouped queue, or drop it if the queue is full.
+    """
+    logger.info("collected {} images, processing...".format(len(images)))
+    try:
+        grouped_queue.put(images, block=False)
+    except Full:
+        logger.error("grouped image queue full ({}), dropping group"
+                      " ({} images)".format(grouped_queue.qsize(),
+                                            len(images)))
+        if metrics:
+            metrics.dropped_groups += 1
+            metrics.dropped_images += len(images)
+        release_images(images)
+
+
+def merger(image_queue, grouped_queue, metrics=None, bands=None,
+           deadline=DEADLINE, reorder=REORDER):
+    """
+    Will monitor image_queue for images and group them by timestamp. The
+    groups are put on the grouped queue in order of timestamp.
+
+    A group is put on the queue as soon as it has an image for every band,
+    or when deadline seconds have passed since its first image arrived. Up
+    to reorder timestamps are kept open for images that arrive out of order;
+    if an image of yet another timestamp arrives, the oldest group is put on
+    the queue incomplete. Groups older than one that is put on the queue go
+    first, complete or not. Images of a timestamp that has already been put
+    on the queue are dropped.
 
     args:
         image_queue (Queue): the incoming image queue
         grouped_queue (Queue): the outgoing grouped image queue
+        metrics (StreamMetrics): counts the dropped groups and images
+        bands (int): the number of images of a complete group, if None
+                     groups are only complete after the deadline
+        deadline (float): seconds to wait for the missing images of a group
+        reorder (int): the number of timestamps kept open, at least 1
     """
     logger.info("merger thread started")
-    first_image = image_queue.get()
-    logger.info("merger received first image")
-    images = [first_image]
-    previous_timestamp = extract_timestamp(first_image)
+    # timestamp -> (arrival time of the first image, images)
+    pending = {}
+    last_timestamp = None
 
     while True:
-        new_image = image_queue.get()
-        new_timestamp = extract_timestamp(new_image)
-        logger.info("merger received image with timestamp {}".format(new_timestamp))
-        if new_timestamp < previous_timestamp:
-            logger.error("timing error, older image received after newer image")
-        if new_timestamp == previous_timestamp:
-            images.append(new_image)
-        else:
-            previous_timestamp = new_timestamp
-            logger.info("collected {} images, processing...".format(len(images)))
+        if pending:
+            first_arrival = min(arrival for arrival, _ in pending.values())
+            timeout = max(0, first_arrival + deadline - time.time())
             try:
-                grouped_queue.put(images, block=False)
-            except Full:
-                logger.error("grouped image queue full ({}), dropping group"
-                              " ({} images)".format(grouped_queue.qsize(),
-                                                    len(images)))
-
-            images = [new_image]
-
-
-def stream_generator(hosts, ports):
+                new_image = image_queue.get(timeout=timeout)
+            except Empty:
+                new_image = None
+        else:
+            new_image = image_queue.get()
+
+        if new_image is not None:
+            new_timestamp = extract_timestamp(new_image)
+            logger.info("merger received image with timestamp {}".format(new_timestamp))
+            if last_timestamp is not None and new_timestamp <= last_timestamp:
+                logger.error("timing error, image with timestamp {} received "
+                             "after its group, dropping".format(new_timestamp))
+                if metrics:
+                    metrics.late_images += 1
+                release_images([new_image])
+            else:
+                pending.setdefault(new_timestamp, (time.time(), []))[1]. \
+                    append(new_image)
+
+        now = time.time()
+        ready = [timestamp for timestamp, (arrival, images) in pending.items()
+                 if (bands and len(images) >= bands) or
+                 now - arrival >= deadline]
+        if len(pending) > reorder:
+            ready.append(sorted(pending)[-reorder - 1])
+        if not ready:
+            continue
+
+        newest = max(ready)
+        for timestamp in sorted(pending):
+            if timestamp > newest:
+                break
+            _, images = pending.pop(timestamp)
+            if bands and len(images) < bands:
+                logger.warning("group {} incomplete, {} of {} images".format(
+                    timestamp, len(images), bands))
+                if metrics:
+                    metrics.incomplete_groups += 1
+            _put_group(grouped_queue, images, metrics)
+            last_timestamp = timestamp
+
+
+def stream_generator(hosts, ports, metrics=None, deadline=DEADLINE,
+                     reorder=REORDER, ring=None):
     """
     Connects to all hosts on port in ports. Returns a generator yielding sets of
     images with the same timestamp.
 
+    The connections are handled by a single ingest() thread, the images are
+    grouped by a merger() thread, both pass the images through in-process
+    queues. Every port is expected to deliver one band per timestamp.
+
     args:
         hosts (tuple): list of hosts to connect to
         ports (tuple): list of ports to connect to
+        metrics (StreamMetrics): if given, is kept up to date
+        deadline (float): see merger()
+        reorder (int): see merger()
+        ring (StreamRing): if given, the images are yielded as RingImage,
+                           which should be released once processed
     """
-
-    if THREADED:
-        import threading
-        from queue import Queue
-        method = threading.Thread
-        image_queue = Queue()
-        grouped_queue = Queue(maxsize=BACK_LOG)
-    else:
-        import multiprocessing
-        manager = Manager()
-        image_queue = manager.Queue()
-        grouped_queue = manager.Queue(maxsize=BACK_LOG)
-        method = multiprocessing.Process
-
-    for host, port in zip(hosts, ports):
-        name = 'port_{}_proc'.format(port)
-        args = dict(target=connector, name=name, args=(host, port, image_queue))
-        con_proc = method(**args)
-        con_proc.daemon = True
-        con_proc.start()
-
-    args = dict(target=merger, name='merger_proc',
-                args=(image_queue, grouped_queue))
-    merger_proc = method(**args)
-    merger_proc.daemon = True
-    merger_proc.start()
+    if metrics is None:
+        metrics = StreamMetrics()
+    connections = [Connection(host, port, ring)
+                   for host, port in zip(hosts, ports)]
+    metrics.ring = ring
+    # room for the images of BACK_LOG timesteps
+    image_queue = Queue(maxsize=BACK_LOG * len(connections))
+    grouped_queue = Queue(maxsize=BACK_LOG)
+    metrics.connections = connections
+    metrics.grouped_queue = grouped_queue
+
+    ingest_thread = Thread(target=ingest, name='ingest_thread',
+                           args=(connections, image_queue, metrics))
+    ingest_thread.daemon = True
+    ingest_thread.start()
+
+    merger_thread = Thread(target=merger, name='merger_thread',
+                           args=(image_queue, grouped_queue, metrics,
+                                 len(connections), deadline, reorder))
+    merger_thread.daemon = True
+    merger_thread.start()
 
     while True:
         yield grouped_queue.get()
@@ -19,7 +19,7 @@ def gen_dataset(description='A test dataset without a description'):
 
 def gen_skyregion(dataset):
     return tkp.db.model.Skyregion(dataset=dataset, centre_ra=1, centre_decl=1,
-                                  xtr_radius=1, x=1, y=1, z=1)
+                                  xtr_radius=1, x=1, y=1, z=1, pixel=1)
 
 
 def gen_image(band=None, dataset=None, skyregion=None, taustart_ts=None):
@@ -37,7 +37,7 @@ def gen_image(band=None, dataset=None, skyregion=None, taustart_ts=None):
 
 
 def gen_extractedsource(image):
-    return tkp.db.model.Extractedsource(zone=1, ra=1, decl=1, uncertainty_ew=1, x=1, y=1,
+    return tkp.db.model.Extractedsource(zone=1, pixel=1, ra=1, decl=1, uncertainty_ew=1, x=1, y=1,
                                         z=1, uncertainty_ns=1, ra_err=1, decl_err=1,
                                         ra_fit_err=1, decl_fit_err=1, ew_sys_err=1,
                                         ns_sys_err=1, error_radius=1, racosdecl=1,
@@ -46,7 +46,7 @@ def gen_extractedsource(image):
 
 def gen_runningcatalog(xtrsrc, dataset):
     return tkp.db.model.Runningcatalog(xtrsrc=xtrsrc, dataset=dataset, datapoints=1,
-                                       zone=1, wm_ra=1., wm_decl=1, wm_uncertainty_ew=1,
+                                       zone=1, pixel=1, wm_ra=1., wm_decl=1, wm_uncertainty_ew=1,
                                        wm_uncertainty_ns=1, avg_ra_err=1, avg_decl_err=1,
                                        avg_wra=1, avg_wdecl=1, avg_weight_ra=1, avg_weight_decl=1,
                                        x=1, y=1, z=1)
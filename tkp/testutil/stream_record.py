@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+Record and replay an AARTFAAC stream, for reproducible benchmarks of the
+stream mode with real sky data.
+
+The recorder stores the raw windows as they arrive, header included, in an
+append-only data file. For every window an entry is appended to the index
+file next to it (the data file name with ``.idx`` appended), with the offset
+and length of the window, its arrival time and the port it came from.
+
+The replayer listens on a port per recorded port, and once a client is
+connected to every port, sends the windows back in recorded order, at the
+recorded pace, N times faster, or as fast as possible.
+
+Record and replay from the command line::
+
+    python -m tkp.testutil.stream_record record -o stream.dat \\
+        --hosts host1,host2 --ports 6666,6667 --duration 600
+    python -m tkp.testutil.stream_record replay stream.dat --speed 2
+"""
+import argparse
+import logging
+import socket
+import struct
+import time
+from collections import namedtuple
+from threading import Event, Lock, Thread
+
+from tkp.stream import WindowBuffers, read_window
+
+logger = logging.getLogger(__name__)
+
+# offset and length of the window, arrival time, recorded port
+INDEX_ENTRY = struct.Struct('=QQdH')
+
+IndexEntry = namedtuple('IndexEntry', ['offset', 'length', 'time', 'port'])
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+class StreamRecorder(object):
+    """
+    Appends windows to a recording, thread safe.
+
+    args:
+        path (str): the data file, appended to if it exists
+    """
+    def __init__(self, path):
+        self.data = open(path, 'ab')
+        self.index = open(index_path(path), 'ab')
+        self.lock = Lock()
+        self.windows = 0
+
+    def append(self, port, *parts):
+        """
+        Append a window.
+
+        args:
+            port (int): the port the window was received on
+            parts: the header, FITS header and image data of the window
+        """
+        arrival = time.time()
+        with self.lock:
+            if self.data.closed:
+                return
+            offset = self.data.tell()
+            for part in parts:
+                self.data.write(part)
+            length = self.data.tell() - offset
+            # the data goes first, a window is recorded once it is indexed
+            self.data.flush()
+            self.index.write(INDEX_ENTRY.pack(offset, length, arrival, port))
+            self.index.flush()
+            self.windows += 1
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class StreamRecording(object):
+    """
+    Reads a recording made by StreamRecorder.
+
+    args:
+        path (str): the data file
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(index_path(path), 'rb') as f:
+            index = f.read()
+        # ignore a partially written entry at the end
+        count = len(index) // INDEX_ENTRY.size
+        self.entries = [IndexEntry(*INDEX_ENTRY.unpack_from(index,
+                                                           n * INDEX_ENTRY.size))
+                        for n in range(count)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def ports(self):
+        """
+        The recorded ports, sorted.
+        """
+        return sorted(set(e.port for e in self.entries))
+
+    def windows(self):
+        """
+        returns:
+            generator: yielding (IndexEntry, raw window) tuples in recorded
+                       order
+        """
+        with open(self.path, 'rb') as f:
+            for entry in self.entries:
+                f.seek(entry.offset)
+                yield entry, f.read(entry.length)
+
+
+def _record_port(host, port, recorder, stop):
+    """
+    Record the windows of one port until stop is set.
+    """
+    socket_ = socket.create_connection((host, port))
+    logger.info("recording {}:{}".format(host, port))
+    buffers = WindowBuffers()
+    try:
+        while not stop.is_set():
+            fits_bytes, image_bytes = read_window(socket_, buffers)
+            recorder.append(port, buffers.header, fits_bytes, image_bytes)
+    except Exception as e:
+        logger.error("recording {}:{} stopped: {}".format(host, port, e))
+    finally:
+        socket_.close()
+
+
+def record(hosts, ports, path, windows=None, duration=None):
+    """
+    Record the stream of the hosts and ports, until the number of windows
+    have been recorded or the duration has passed.
+
+    args:
+        hosts (tuple): list of hosts to connect to
+        ports (tuple): list of ports to connect to
+        path (str): the data file
+        windows (int): stop after this many windows of all ports together
+        duration (float): stop after this many seconds
+
+    returns:
+        int: the number of windows recorded
+    """
+    recorder = StreamRecorder(path)
+    stop = Event()
+    threads = []
+    for host, port in zip(hosts, ports):
+        thread = Thread(target=_record_port, name='record_{}'.format(port),
+                        args=(host, port, recorder, stop))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    start = time.time()
+    while any(t.is_alive() for t in threads):
+        if windows and recorder.windows >= windows:
+            break
+        if duration and time.time() - start >= duration:
+            break
+        time.sleep(0.1)
+    stop.set()
+    # windows that are still being read are not recorded anymore
+    with recorder.lock:
+        recorder.close()
+        count = recorder.windows
+    logger.info("recorded {} windows in {}".format(count, path))
+    return count
+
+
+class Replayer(object):
+    """
+    Serves a recording through the AARTFAAC protocol.
+
+    args:
+        recording (StreamRecording): what to replay
+        ports (tuple): the port to serve each recorded port on, in the order
+                       of recording.ports; 0 picks a free port, the recorded
+                       ports are used if None
+        speed (float): 1 replays at the recorded pace, N N times faster, 0
+                       as fast as possible
+        host (str): the address to listen on
+    """
+    def __init__(self, recording, ports=None, speed=1.0, host='localhost'):
+        self.recording = recording
+        self.speed = speed
+        recorded = recording.ports
+        if ports is None:
+            ports = recorded
+        if len(ports) != len(recorded):
+            raise ValueError("need {} ports, got {}".format(len(recorded),
+                                                            len(ports)))
+        self.servers = {}
+        for recorded_port, port in zip(recorded, ports):
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))
+            server.listen(1)
+            self.servers[recorded_port] = server
+
+    @property
+    def ports(self):
+        """
+        The ports served, in the order of recording.ports.
+        """
+        return [self.servers[p].getsockname()[1]
+                for p in self.recording.ports]
+
+    def run(self):
+        """
+        Wait for a client on every port, then send all windows.
+
+        returns:
+            float: the replay throughput in MB/s
+        """
+        clients = {}
+        for recorded_port, server in self.servers.items():
+            logger.info("waiting for a client on {}".format(
+                server.getsockname()[1]))
+            clients[recorded_port], _ = server.accept()
+
+        sent = 0
+        start = time.time()
+        first = None
+        for entry, window in self.recording.windows():
+            if first is None:
+                first = entry.time
+            if self.speed:
+                delay = start + (entry.time - first) / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            clients[entry.port].sendall(window)
+            sent += len(window)
+        elapsed = time.time() - start
+        for client in clients.values():
+            client.close()
+        for server in self.servers.values():
+            server.close()
+        throughput = sent / elapsed / 1e6 if elapsed else 0.0
+        logger.info("replayed {} windows in {:.1f} s, {:.1f} MB/s".format(
+            len(self.recording), elapsed, throughput))
+        return throughput
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Record and replay an AARTFAAC stream")
+    subparsers = parser.add_subparsers()
+
+    record_parser = subparsers.add_parser('record', help="record a stream")
+    record_parser.add_argument('-o', '--output', required=True,
+                               help="data file, appended to if it exists")
+    record_parser.add_argument('--hosts', required=True,
+                               help="comma separated hosts")
+    record_parser.add_argument('--ports', required=True,
+                               help="comma separated ports")
+    record_parser.add_argument('--windows', type=int,
+                               help="stop after this many windows")
+    record_parser.add_argument('--duration', type=float,
+                               help="stop after this many seconds")
+    record_parser.set_defaults(func=_record_command)
+
+    replay_parser = subparsers.add_parser('replay', help="replay a recording")
+    replay_parser.add_argument('path', help="data file")
+    replay_parser.add_argument('--ports',
+                               help="comma separated ports to serve on, "
+                                    "default the recorded ports")
+    replay_parser.add_argument('--speed', type=float, default=1.0,
+                               help="replay speed, 0 is as fast as possible")
+    replay_parser.add_argument('--loop', action='store_true',
+                               help="replay again after every run")
+    replay_parser.set_defaults(func=_replay_command)
+    return parser
+
+
+def _record_command(options):
+    hosts = options.hosts.split(',')
+    ports = [int(p) for p in options.ports.split(',')]
+    if len(hosts) == 1:
+        hosts = hosts * len(ports)
+    record(hosts, ports, options.output, options.windows, options.duration)
+
+
+def _replay_command(options):
+    recording = StreamRecording(options.path)
+    ports = None
+    if options.ports:
+        ports = [int(p) for p in options.ports.split(',')]
+    while True:
+        Replayer(recording, ports, options.speed).run()
+        if not options.loop:
+            break
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    options = get_parser().parse_args()
+    options.func(options)
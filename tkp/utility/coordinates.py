@@ -6,6 +6,7 @@ General purpose astronomical coordinate handling routines.
 
 import sys
 import math
+import numpy
 from astropy import wcs as pywcs
 import logging
 import datetime
@@ -409,6 +410,23 @@ def alpha_inflate(theta, decl):
     else:
         return math.degrees(abs(math.atan(math.sin(math.radians(theta)) / math.sqrt(abs(math.cos(math.radians(decl - theta)) * math.cos(math.radians(decl + theta)))))))
 
+
+def alpha_inflate_array(theta, decl):
+    """Compute the ra expansion for arrays of theta and declination
+
+    Same as alpha_inflate(), but evaluated element wise over numpy arrays
+    (in decimal degrees).
+    """
+    theta = numpy.asarray(theta, dtype=float)
+    decl = numpy.asarray(decl, dtype=float)
+    near_pole = numpy.abs(decl) + theta > 89.9
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        alpha = numpy.degrees(numpy.abs(numpy.arctan(
+            numpy.sin(numpy.radians(theta)) /
+            numpy.sqrt(numpy.abs(numpy.cos(numpy.radians(decl - theta)) *
+                                 numpy.cos(numpy.radians(decl + theta)))))))
+    return numpy.where(near_pole, 180.0, alpha)
+
 # Find the RA of a point in a radio image, given l,m and field centre
 def delta(l, m, delta0):
     """Convert a coordinate in l, m into an coordinate in Dec
@@ -563,6 +581,88 @@ def eq_to_cart(ra, dec):
             math.sin(math.radians(dec)))  # Cartesian z
 
 
+# The sky pixelisation used to index positions in the database. The sky is cut
+# in declination rows, which are divided in RA cells about as wide as a row is
+# high. Must match the sky_pixel() SQL function.
+SKY_PIXEL_ROWS_PER_DEGREE = 10
+SKY_PIXEL_ROWS = 180 * SKY_PIXEL_ROWS_PER_DEGREE
+SKY_PIXEL_ROW_LENGTH = 360 * SKY_PIXEL_ROWS_PER_DEGREE
+
+
+def sky_pixel_cells(row):
+    """Number of RA cells in a row (or an array of rows) of the sky
+    pixelisation.
+
+    The cells are at least as wide as the row is high at the declination
+    of the row edge farthest from the equator.
+    """
+    row = numpy.asarray(row, dtype=float)
+    far_edge = numpy.maximum(
+        numpy.abs(row / SKY_PIXEL_ROWS_PER_DEGREE - 90),
+        numpy.abs((row + 1) / SKY_PIXEL_ROWS_PER_DEGREE - 90))
+    cells = numpy.floor(SKY_PIXEL_ROW_LENGTH *
+                        numpy.cos(numpy.radians(far_edge)))
+    return numpy.maximum(1, cells).astype(int)
+
+
+def sky_pixel(ra, decl):
+    """Find the sky pixel of a position, or of arrays of positions.
+
+    ra, decl should be in degrees, with 0 <= ra < 360.
+
+    Pixels are numbered row * SKY_PIXEL_ROW_LENGTH + cell, so the cells of
+    a row form a contiguous range of pixels.
+    """
+    ra = numpy.asarray(ra, dtype=float)
+    decl = numpy.asarray(decl, dtype=float)
+    row = numpy.clip(numpy.floor((decl + 90) * SKY_PIXEL_ROWS_PER_DEGREE),
+                     0, SKY_PIXEL_ROWS - 1).astype(int)
+    cells = sky_pixel_cells(row)
+    cell = numpy.clip(numpy.floor(ra * cells / 360.), 0, cells - 1)
+    pixel = row * SKY_PIXEL_ROW_LENGTH + cell.astype(int)
+    if pixel.ndim == 0:
+        return int(pixel)
+    return pixel
+
+
+def sky_pixel_ranges(ra, decl, radius):
+    """Find the sky pixels of a cone.
+
+    ra, decl and radius should be in degrees.
+
+    Returns a sorted list of (first, last) pixel ranges (both inclusive)
+    which contain all the positions within radius of ra, decl. The ranges
+    wrap around the RA = 0/360 meridian and cover whole rows around the
+    poles. They are padded by a cell on every side, so that rounding
+    differences with the SQL sky_pixel() function can't drop positions.
+    """
+    first = max(0, int(math.floor((decl - radius + 90) *
+                                  SKY_PIXEL_ROWS_PER_DEGREE)) - 1)
+    last = min(SKY_PIXEL_ROWS - 1, int(math.floor((decl + radius + 90) *
+                                                  SKY_PIXEL_ROWS_PER_DEGREE)) + 1)
+    dra = alpha_inflate(radius, decl)
+    ranges = []
+    for row in range(first, last + 1):
+        n = int(sky_pixel_cells(row))
+        low = int(math.floor((ra - dra) * n / 360.)) - 1
+        high = int(math.floor((ra + dra) * n / 360.)) + 1
+        if dra >= 180 or high - low + 1 >= n:
+            cells = [(0, n - 1)]
+        elif low < 0:
+            cells = [(0, high), (low + n, n - 1)]
+        elif high >= n:
+            cells = [(0, high - n), (low, n - 1)]
+        else:
+            cells = [(low, high)]
+        offset = row * SKY_PIXEL_ROW_LENGTH
+        for low, high in cells:
+            if ranges and offset + low <= ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], offset + high)
+            else:
+                ranges.append((offset + low, offset + high))
+    return ranges
+
+
 class CoordSystem(object):
     """A container for constant strings representing different coordinate
     systems."""
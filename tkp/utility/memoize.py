@@ -35,3 +35,38 @@ class Memoize(object):
             del(self.memo[instance])
         except KeyError:
             pass
+
+
+class MemoizeFunction(object):
+    """Decorator to cache the results of a function of hashable positional
+    arguments.
+
+    At most maxsize results are kept; the cache is emptied when it is full.
+    Example in sourcefinder/utils.py::
+
+        @MemoizeFunction(maxsize=64)
+        def fudge_max_pix(semimajor, semiminor, theta):
+            ...
+
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+
+    def __call__(self, funct):
+        memo = {}
+        maxsize = self.maxsize
+
+        def wrapper(*args):
+            try:
+                return memo[args]
+            except KeyError:
+                pass
+            if len(memo) >= maxsize:
+                memo.clear()
+            result = memo[args] = funct(*args)
+            return result
+
+        wrapper.memo = memo
+        update_wrapper(wrapper, funct)
+        return wrapper
@@ -0,0 +1,295 @@
+"""
+File backed shared memory for numpy arrays.
+
+A :class:`SharedArray` is a small, pickleable handle to a numpy array which
+lives in a file in a memory backed file system (``/dev/shm`` if available).
+Processes which unpickle the handle map the same pages instead of receiving
+a copy of the data, which makes passing large images to pool workers cheap.
+
+A :class:`SharedRing` is a fixed set of reusable slots in a single segment,
+for data that keeps arriving like the images of a stream.
+"""
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+# preferred location for the segments, a tmpfs on most Linux systems
+SHM_ROOT = '/dev/shm'
+
+
+def segment_directory(prefix='tkp_shm_'):
+    """
+    Create a new directory for shared memory segments.
+
+    The caller is responsible for removing it with :func:`remove_directory`.
+
+    returns:
+        str: path to the directory
+    """
+    root = SHM_ROOT if os.access(SHM_ROOT, os.W_OK) else None
+    directory = tempfile.mkdtemp(prefix=prefix, dir=root)
+    logger.debug("using {} for shared memory segments".format(directory))
+    return directory
+
+
+def remove_directory(directory):
+    """
+    Remove a directory created by :func:`segment_directory`, including all
+    segments which are still left in there.
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+class SharedArray(object):
+    """
+    Handle to a numpy array stored in a shared memory segment.
+
+    Only the location, shape, dtype and memory order are pickled. Use
+    :meth:`attach` to get the array back, and :meth:`unlink` in the owning
+    process to free the segment once nobody needs it anymore. Arrays that are
+    already attached stay valid after unlinking.
+    """
+    def __init__(self, path, shape, dtype, order='C'):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.order = order
+
+    @classmethod
+    def create(cls, array, directory):
+        """
+        Copy array into a new segment in directory.
+
+        args:
+            array (numpy.ndarray): the array to share
+            directory (str): where to create the segment, see
+                             :func:`segment_directory`
+        returns:
+            SharedArray: a handle to the segment
+        """
+        array = numpy.asanyarray(array)
+        if array.flags.f_contiguous and not array.flags.c_contiguous:
+            order = 'F'
+        else:
+            order = 'C'
+        path = os.path.join(directory, uuid.uuid4().hex)
+        shared = cls(path, array.shape, array.dtype, order)
+        with open(path, 'w+b') as f:
+            f.truncate(max(shared.nbytes, 1))
+            buffer_ = mmap.mmap(f.fileno(), max(shared.nbytes, 1))
+        target = numpy.ndarray(shared.shape, dtype=shared.dtype,
+                               buffer=buffer_, order=order)
+        target[...] = array
+        buffer_.flush()
+        return shared
+
+    @property
+    def nbytes(self):
+        return int(numpy.prod(self.shape)) * self.dtype.itemsize
+
+    def attach(self):
+        """
+        Map the segment into this process without copying the data.
+
+        The pages are mapped copy-on-write, so changes made to the returned
+        array stay private to the calling process.
+
+        returns:
+            numpy.ndarray: the shared array
+        """
+        with open(self.path, 'rb') as f:
+            buffer_ = mmap.mmap(f.fileno(), max(self.nbytes, 1),
+                                access=mmap.ACCESS_COPY)
+        return numpy.ndarray(self.shape, dtype=self.dtype, buffer=buffer_,
+                             order=self.order)
+
+    def unlink(self):
+        """
+        Remove the segment. Memory is freed when the last mapping is gone.
+        """
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            logger.debug("can't remove segment {}: {}".format(self.path, e))
+
+    def __repr__(self):
+        return "SharedArray(%r, %r, %r)" % (self.path, self.shape,
+                                            self.dtype.str)
+
+
+def _round_up(nbytes):
+    """
+    Round up to a multiple of the mmap offset granularity.
+    """
+    granularity = mmap.ALLOCATIONGRANULARITY
+    return -(-nbytes // granularity) * granularity
+
+
+class SharedRing(object):
+    """
+    A fixed number of equally sized slots in a single shared memory segment,
+    written by the owning process and read by others through
+    :class:`RingSlot` handles.
+
+    The first block of the segment holds a sequence number per slot, which
+    is increased every time a slot is reserved for writing. Readers use it
+    to check that a slot still holds the data they were handed.
+
+    When all slots are in use, the policy decides what happens to a new
+    write: with 'drop-oldest' the slot that was written longest ago is
+    overwritten, with 'drop-newest' :meth:`reserve` returns None.
+
+    args:
+        directory (str): where to create the segment, see
+                         :func:`segment_directory`
+        slot_bytes (int): size of a slot
+        slots (int): number of slots
+        policy (str): 'drop-oldest' or 'drop-newest'
+    """
+    policies = ('drop-oldest', 'drop-newest')
+
+    def __init__(self, directory, slot_bytes, slots, policy='drop-oldest'):
+        if policy not in self.policies:
+            raise ValueError("unknown ring policy %s" % policy)
+        self.slot_bytes = slot_bytes
+        self.slots = slots
+        self.policy = policy
+        self.stride = _round_up(slot_bytes)
+        self.header_bytes = _round_up(8 * slots)
+        self.path = os.path.join(directory, uuid.uuid4().hex)
+        size = self.header_bytes + self.stride * slots
+        with open(self.path, 'w+b') as f:
+            f.truncate(size)
+            self.buffer = mmap.mmap(f.fileno(), size)
+        self.sequences = numpy.frombuffer(self.buffer, dtype=numpy.int64,
+                                          count=slots)
+        self.in_use = [False] * slots
+        self.sequence = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Reserve a slot for writing, the least recently written free one.
+
+        returns:
+            int: the slot index, or None if the ring is full and the policy
+                 is 'drop-newest'
+        """
+        with self.lock:
+            free = [i for i in range(self.slots) if not self.in_use[i]]
+            if free:
+                slot = min(free, key=lambda i: self.sequences[i])
+            elif self.policy == 'drop-newest':
+                self.dropped += 1
+                return None
+            else:
+                slot = int(numpy.argmin(self.sequences))
+                self.dropped += 1
+                logger.warning("shared ring full, overwriting slot %s" % slot)
+            self.in_use[slot] = True
+            self.sequence += 1
+            self.sequences[slot] = self.sequence
+            return slot
+
+    def view(self, slot, nbytes=None):
+        """
+        A writable uint8 array on the first nbytes of a slot.
+        """
+        nbytes = self.slot_bytes if nbytes is None else nbytes
+        return numpy.frombuffer(self.buffer, dtype=numpy.uint8, count=nbytes,
+                                offset=self.header_bytes + slot * self.stride)
+
+    def handle(self, slot, shape, dtype):
+        """
+        A pickleable handle to the data written in a slot.
+        """
+        return RingSlot(self.path, slot, int(self.sequences[slot]),
+                        self.header_bytes + slot * self.stride, shape, dtype)
+
+    def release(self, slot, sequence):
+        """
+        Free a slot, unless it has been overwritten since.
+        """
+        with self.lock:
+            if self.sequences[slot] == sequence:
+                self.in_use[slot] = False
+
+    def unlink(self):
+        """
+        Remove the segment. Memory is freed when the last mapping is gone.
+        """
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            logger.debug("can't remove ring {}: {}".format(self.path, e))
+
+
+class SlotOverwritten(Exception):
+    """
+    The slot of a :class:`SharedRing` has been written again.
+    """
+
+
+class RingSlot(object):
+    """
+    Handle to the data in a slot of a :class:`SharedRing`, only the location
+    and the sequence number are pickled.
+    """
+    def __init__(self, path, slot, sequence, offset, shape, dtype):
+        self.path = path
+        self.slot = slot
+        self.sequence = sequence
+        self.offset = offset
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+
+    @property
+    def nbytes(self):
+        return int(numpy.prod(self.shape)) * self.dtype.itemsize
+
+    def current(self):
+        """
+        returns:
+            bool: True if the slot still holds the data of this handle
+        """
+        with open(self.path, 'rb') as f:
+            buffer_ = mmap.mmap(f.fileno(), 8 * (self.slot + 1),
+                                access=mmap.ACCESS_READ)
+        sequences = numpy.frombuffer(buffer_, dtype=numpy.int64)
+        return sequences[self.slot] == self.sequence
+
+    def verify(self):
+        """
+        raises:
+            SlotOverwritten: if the slot has been written again
+        """
+        if not self.current():
+            raise SlotOverwritten("slot %s of %s" % (self.slot, self.path))
+
+    def attach(self):
+        """
+        Map the slot read-only into this process without copying the data.
+
+        The slot can be written again at any time, also while the array is
+        read. Copy the data out of the array and call verify() afterwards,
+        the copy is only valid if that doesn't raise.
+
+        returns:
+            numpy.ndarray: the read-only array
+        """
+        with open(self.path, 'rb') as f:
+            buffer_ = mmap.mmap(f.fileno(), max(self.nbytes, 1),
+                                access=mmap.ACCESS_READ, offset=self.offset)
+        return numpy.ndarray(self.shape, dtype=self.dtype, buffer=buffer_)
+
+    def __repr__(self):
+        return "RingSlot(%r, %r, %r)" % (self.path, self.slot, self.sequence)